@@ -0,0 +1,365 @@
+# api_server.py
+"""
+Tab1/Tab2/Tab3 とその連結（パイプライン）を JSON で返す軽量 HTTP API（標準ライブラリの asyncio のみ）。
+各タブの build_payload / _call_llm をそのまま使うので、プロンプト・解析・正規化・応答キャッシュ・レート制限は画面と共有。
+
+  python api_server.py                        # GROQ_API_KEY を使う（127.0.0.1:8600）
+  python api_server.py --stub --port 8600     # 疑似応答（負荷試験用。履歴は一時DBへ）
+
+  POST /v1/tab1      {"usecase": "...", "background"?, "question"?, "issues"?, "aoi"?: [西端, 南端, 東端, 北端]}
+  POST /v1/tab2      {"tab1_output": {...}, "goal"?, "aoi"?, "usecase"?}
+  POST /v1/tab3      {"tab1_output": {...}, "tab2_output": {...}, "usecase"?}
+  POST /v1/pipeline  Tab1 の入力 + "goal"?  → tab1 → tab2 → tab3
+  GET  /healthz
+  共通: "model"?, "use_cache"?（既定 true）。?stream=1 か Accept: application/x-ndjson で NDJSON ストリーミング
+  （段ごとに {"event": "result", "stage": ..., "data": ...}、待ち時間中は heartbeat、最後に done / error）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import tab1_usecase
+import tab2_gap
+import tab3_plan
+import cloud_clim
+import llm_runtime
+from llm_runtime import cache_stats
+from run_store import input_hash
+from uc_seed import UC_DATA
+
+# =========================
+# 0) 設定
+# =========================
+API_HOST = os.environ.get("CDP_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("CDP_API_PORT", "8600"))
+API_WORKERS = int(os.environ.get("CDP_API_WORKERS", "64"))           # LLM呼び出し（ブロッキング）用スレッド
+API_MAX_INFLIGHT = int(os.environ.get("CDP_API_MAX_INFLIGHT", "1024"))  # 超えたら 503（バックプレッシャ）
+API_TOKEN = os.environ.get("CDP_API_TOKEN", "")                       # 設定時は Authorization: Bearer 必須
+API_MODEL = os.environ.get("CDP_API_MODEL", "llama-3.1-8b-instant")
+MAX_BODY = 1 << 20
+KEEPALIVE_S = 30.0
+HEARTBEAT_S = 10.0
+
+STAGES = {"tab1": tab1_usecase, "tab2": tab2_gap, "tab3": tab3_plan}
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error",
+            502: "Bad Gateway", 503: "Service Unavailable"}
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# =========================
+# 1) 段の実行（スレッドプールへ。同一入力の同時リクエストは1回の呼び出しにまとめる）
+# =========================
+class Pipeline:
+    def __init__(self, client, workers: int = API_WORKERS):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-llm")
+        self._calls = {}          # 実行中の (stage, model, input_hash) -> Future
+        self.coalesced = 0
+
+    async def run_stage(self, stage: str, model: str, payload: dict, usecase: str = None, use_cache: bool = True):
+        mod = STAGES[stage]
+        key = (stage, model, input_hash(stage, model, mod.SYSTEM_PROMPT, payload)) if use_cache else None
+        fut = self._calls.get(key) if key else None
+        if fut is not None:
+            self.coalesced += 1
+        else:
+            fut = asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(mod._call_llm, self.client, model, payload, usecase=usecase, use_cache=use_cache))
+            if key:
+                self._calls[key] = fut
+                fut.add_done_callback(lambda _: self._calls.pop(key, None))
+        try:
+            data, err = await asyncio.shield(fut)
+        except ApiError:
+            raise
+        except Exception as e:
+            # 段の中で取りこぼした例外も 500 で接続ごと落とさず、上流の失敗として返す
+            raise ApiError(502, f"{type(e).__name__}: {e}") from e
+        if err:
+            # キー未設定（キャッシュに無い入力）は上流の失敗ではなくこちらの設定不足
+            raise ApiError(503 if self.client is None else 502, err)
+        return data
+
+# =========================
+# 2) 入力の解釈（画面・ウォームアップと同じ build_payload を使い、キャッシュを共有）
+# =========================
+def _obj(body: dict, key: str) -> dict:
+    v = body.get(key)
+    if not isinstance(v, dict) or not v:
+        raise ApiError(400, f"{key}（オブジェクト）は必須です")
+    return v
+
+def _aoi(body: dict, usecase: str = None):
+    aoi = body.get("aoi", UC_DATA.get(usecase, {}).get("aoi"))
+    if aoi is None:
+        return None
+    try:
+        return cloud_clim.parse_bbox(aoi if isinstance(aoi, str) else ", ".join(str(v) for v in aoi))
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, f"aoi: {e}")
+
+def _tab1_payload(body: dict) -> dict:
+    uc = body.get("usecase")
+    if not isinstance(uc, str) or not uc.strip():
+        raise ApiError(400, "usecase は必須です")
+    seed = UC_DATA.get(uc, {})
+    ctx = {k: str(body.get(k, seed.get(k, ""))) for k in ("background", "question", "issues")}
+    return tab1_usecase.build_payload(uc, ctx["background"], ctx["question"], ctx["issues"], aoi=_aoi(body, uc))
+
+def _goal(body: dict) -> str:
+    return str(body.get("goal") or tab2_gap.PURPOSE_HYPOTHESIS)
+
+async def _events(pipe: Pipeline, endpoint: str, body: dict):
+    """エンドポイントごとの処理。段の結果を {"event": "result", ...} として順に返す。"""
+    model = str(body.get("model") or API_MODEL)
+    use_cache = body.get("use_cache", True) is not False
+    uc = body.get("usecase")
+    run = partial(pipe.run_stage, model=model, usecase=uc, use_cache=use_cache)
+
+    if endpoint == "tab1":
+        yield {"event": "result", "stage": "tab1", "data": await run("tab1", payload=_tab1_payload(body))}
+    elif endpoint == "tab2":
+        payload = tab2_gap.build_payload(_obj(body, "tab1_output"), _goal(body), aoi=_aoi(body, uc))
+        yield {"event": "result", "stage": "tab2", "data": await run("tab2", payload=payload)}
+    elif endpoint == "tab3":
+        payload = tab3_plan.build_payload(_obj(body, "tab1_output"), _obj(body, "tab2_output"))
+        yield {"event": "result", "stage": "tab3", "data": await run("tab3", payload=payload)}
+    else:  # pipeline
+        t1 = await run("tab1", payload=_tab1_payload(body))
+        yield {"event": "result", "stage": "tab1", "data": t1}
+        t2 = await run("tab2", payload=tab2_gap.build_payload(t1, _goal(body), aoi=_aoi(body, uc)))
+        yield {"event": "result", "stage": "tab2", "data": t2}
+        yield {"event": "result", "stage": "tab3", "data": await run("tab3", payload=tab3_plan.build_payload(t1, t2))}
+
+# =========================
+# 3) HTTP（HTTP/1.1 keep-alive / chunked）
+# =========================
+def parse_head(head: bytes) -> tuple:
+    """リクエスト行とヘッダを読む。戻り値 (method, target, version, headers)。不正なら ApiError(400)。"""
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise ApiError(400, "不正なリクエスト行")
+    headers = {}
+    for line in lines[1:]:
+        k, sep, v = line.partition(":")
+        if sep:
+            headers[k.strip().lower()] = v.strip()
+    return method, target, version, headers
+
+def content_length(headers: dict, limit: int = MAX_BODY) -> int:
+    """Content-Length を検証する。数字以外/負は 400、limit 超は 413。"""
+    if "transfer-encoding" in headers:
+        raise ApiError(400, "Transfer-Encoding 付きの本文には対応していません（Content-Length を指定してください）")
+    value = headers.get("content-length", "").strip() or "0"
+    if not (value.isascii() and value.isdigit()):
+        raise ApiError(400, f"Content-Length が不正です: {value[:40]!r}")
+    length = int(value)
+    if length > limit:
+        raise ApiError(413, f"本文は {limit} バイトまでです")
+    return length
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _head(status: int, headers: dict) -> bytes:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"] + [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+async def _send_json(writer, status: int, obj, keep_alive: bool, extra: dict = None):
+    body = _dumps(obj)
+    writer.write(_head(status, {"Content-Type": "application/json; charset=utf-8", "Content-Length": len(body),
+                                "Connection": "keep-alive" if keep_alive else "close", **(extra or {})}) + body)
+    await writer.drain()
+
+
+class Server:
+    def __init__(self, client, workers: int = API_WORKERS, max_inflight: int = API_MAX_INFLIGHT,
+                 token: str = API_TOKEN):
+        self.pipe = Pipeline(client, workers)
+        self.max_inflight = max_inflight
+        self.token = token
+        self.inflight = 0
+        self.served = 0
+        self.started_at = time.time()
+
+    def health(self) -> dict:
+        return {"ok": True, "stub": type(self.pipe.client).__name__ == "StubClient",
+                "inflight": self.inflight, "served": self.served, "coalesced": self.pipe.coalesced,
+                "workers": self.pipe._executor._max_workers, "cache": dict(cache_stats),
+                "uptime_s": round(time.time() - self.started_at, 1)}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_S)
+                except asyncio.LimitOverrunError:
+                    await _send_json(writer, 431, {"error": "ヘッダが大きすぎます"}, False)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                try:
+                    method, target, version, headers = parse_head(head)
+                    length = content_length(headers)
+                except ApiError as e:
+                    # 本文の境界が分からないので、応答したら接続を閉じる
+                    await _send_json(writer, e.status, {"error": str(e)}, False)
+                    break
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                body = await reader.readexactly(length) if length else b""
+                await self._dispatch(method, target, headers, body, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, headers, body, writer, keep_alive):
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        if path == "/healthz":
+            return await _send_json(writer, 200, self.health(), keep_alive)
+        endpoint = path[len("/v1/"):] if path.startswith("/v1/") else None
+        if endpoint not in ("tab1", "tab2", "tab3", "pipeline"):
+            return await _send_json(writer, 404, {"error": f"{path} はありません"}, keep_alive)
+        if method != "POST":
+            return await _send_json(writer, 405, {"error": "POST のみ"}, keep_alive, {"Allow": "POST"})
+        if self.token and headers.get("authorization") != f"Bearer {self.token}":
+            return await _send_json(writer, 401, {"error": "認証が必要です"}, keep_alive)
+        if self.inflight >= self.max_inflight:
+            return await _send_json(writer, 503, {"error": "混雑しています。しばらく待って再実行してください。"},
+                                    keep_alive, {"Retry-After": "5"})
+        try:
+            req = json.loads(body or b"{}")
+            if not isinstance(req, dict):
+                raise ValueError("JSON オブジェクトを送ってください")
+        except ValueError as e:
+            return await _send_json(writer, 400, {"error": f"JSON解析失敗: {e}"}, keep_alive)
+
+        stream = "1" in parse_qs(url.query).get("stream", []) or "application/x-ndjson" in headers.get("accept", "")
+        self.inflight += 1
+        t0 = time.perf_counter()
+        try:
+            if stream:
+                await self._stream(endpoint, req, writer, t0)
+                return
+            results = {}
+            try:
+                async for ev in _events(self.pipe, endpoint, req):
+                    results[ev["stage"]] = ev["data"]
+            except ApiError as e:
+                # パイプライン途中の失敗は、済んだ段の結果も返す
+                return await _send_json(writer, e.status, {"error": str(e), **({"partial": results} if results else {})},
+                                        keep_alive)
+            except Exception as e:
+                return await _send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"}, keep_alive)
+            out = {"stage": endpoint, "data": results.get(endpoint)} if endpoint != "pipeline" else {"stages": results}
+            out["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            await _send_json(writer, 200, out, keep_alive)
+        finally:
+            self.inflight -= 1
+            self.served += 1
+
+    async def _stream(self, endpoint, req, writer, t0):
+        """NDJSON を chunked で送る。ストリーム後は接続を閉じる。"""
+        writer.write(_head(200, {"Content-Type": "application/x-ndjson; charset=utf-8",
+                                 "Transfer-Encoding": "chunked", "Connection": "close"}))
+
+        async def send(obj):
+            line = _dumps(obj) + b"\n"
+            writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            await writer.drain()
+
+        agen = _events(self.pipe, endpoint, req)
+        nxt = asyncio.ensure_future(agen.__anext__())
+        try:
+            await send({"event": "accepted", "endpoint": endpoint})
+            while True:
+                done, _ = await asyncio.wait({nxt}, timeout=HEARTBEAT_S)
+                if not done:
+                    await send({"event": "heartbeat", "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)})
+                    continue
+                try:
+                    ev = nxt.result()
+                except StopAsyncIteration:
+                    await send({"event": "done", "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)})
+                    break
+                except ApiError as e:
+                    await send({"event": "error", "status": e.status, "error": str(e)})
+                    break
+                except Exception as e:
+                    await send({"event": "error", "status": 500, "error": f"{type(e).__name__}: {e}"})
+                    break
+                await send(ev)
+                nxt = asyncio.ensure_future(agen.__anext__())
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            if not nxt.done():
+                nxt.cancel()
+            writer.close()
+
+
+async def serve(client, host: str = API_HOST, port: int = API_PORT, **kwargs):
+    """起動済みの (asyncio.Server, Server) を返す（負荷試験からも同じプロセスで起動できるように）。"""
+    app = Server(client, **kwargs)
+    server = await asyncio.start_server(app.handle, host, port, backlog=2048)
+    return server, app
+
+# =========================
+# 4) CLI
+# =========================
+def make_stub_client(latency_s: float = 0.8):
+    """疑似応答クライアント。履歴は一時DBへ書き、レート制限は外す（本番の履歴/キャッシュを汚さない）。"""
+    import tempfile
+    from llm_stub import StubClient, stub_responses
+    from run_store import use_store
+    use_store(os.path.join(tempfile.mkdtemp(prefix="cdp-api-stub-"), "runs.db"))
+    llm_runtime.rate_limiter.rpm = 0
+    return StubClient(stub_responses(), latency_s=latency_s, seed=0)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=API_HOST)
+    ap.add_argument("--port", type=int, default=API_PORT)
+    ap.add_argument("--workers", type=int, default=API_WORKERS)
+    ap.add_argument("--stub", action="store_true", help="疑似応答で起動")
+    ap.add_argument("--stub-latency", type=float, default=0.8, help="--stub 時の基準レイテンシ(s)")
+    args = ap.parse_args()
+
+    if args.stub:
+        client = make_stub_client(args.stub_latency)
+    else:
+        from openai import OpenAI
+        key = os.environ.get("GROQ_API_KEY")
+        client = OpenAI(base_url="https://api.groq.com/openai/v1", api_key=key) if key else None
+        if client is None:
+            print("[api] GROQ_API_KEY 未設定：キャッシュ/履歴にある入力だけ応答します")
+
+    async def run():
+        server, _ = await serve(client, args.host, args.port, workers=args.workers)
+        print(f"[api] http://{args.host}:{args.port}  (workers={args.workers}{', stub' if args.stub else ''})")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
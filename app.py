@@ -5,10 +5,23 @@ from openai import OpenAI
 from tab1_usecase import render_tab as tab1_render
 from tab2_gap import render_tab as tab2_render
 from tab3_plan import render_tab as tab3_render
+from tab4_sweep import render_tab as tab4_render
+from jobs import get_manager
+from result_store import get_session_result, render_memory_report, touch_session
+from export import render_export
+import warmup
 
 st.set_page_config(page_title="CDPユースケース構成アシスタント", layout="wide")
 st.title("ユースケース構成アシスタント（Groq / Llama3.1）")
 
+# セッションの最終アクセス更新（アイドルセッションの結果参照は定期的に解放）
+touch_session()
+if st.session_state.pop("session_evicted", False):
+    st.info("しばらく操作が無かったため、一部の結果を解放しました。履歴から再読み込みできます。")
+
+# シードユースケースの事前計算（サーバ側キーがある場合のみ・初回だけバックグラウンド起動）
+warmup.start_background(st.secrets.get("GROQ_API_KEY") or os.environ.get("GROQ_API_KEY"))
+
 with st.sidebar:
     st.subheader("API設定")
     
@@ -18,29 +31,45 @@ with st.sidebar:
     )
     model_name = st.selectbox("モデル", ["llama-3.1-8b-instant","llama-3.1-70b-versatile"], index=0)
     st.caption("※ 無料枠の制限に注意。")
+    st.checkbox("同一入力の過去結果を再利用（キャッシュ）", value=True, key="use_cache",
+                help="外すと毎回Groqで再生成します。")
+    _q = get_manager().stats()
+    st.caption(f"実行キュー（全体）：実行中 {_q['running']} / 待機 {_q['queued']}")
+    _w = warmup.status()
+    if _w["state"] != "disabled":
+        st.caption(f"シード事前計算：{'実行中' if _w['state'] == 'running' else '待機'}"
+                   f"（完了 {_w['done']} / 予算スキップ {_w['skipped']} / 失敗 {_w['errors']} / {_w['tokens']:,} tokens）")
+        if _w["last_error"]:
+            st.caption(f"直近の事前計算エラー：{_w['last_error']}")
+    render_memory_report()
+    render_export()
 
-if "llm_client" not in st.session_state and api_key:
-    os.environ["OPENAI_API_KEY"] = api_key
-    st.session_state["llm_client"] = OpenAI(base_url="https://api.groq.com/openai/v1")
-    st.success("Groqクライアント準備OK")
+@st.cache_resource(show_spinner=False)
+def _groq_client(key: str):
+    # 同じキーのクライアントは全セッションで1つ（セッションごとに持たない）
+    return OpenAI(base_url="https://api.groq.com/openai/v1", api_key=key)
 
-# 共有ステート（各タブ間の受け渡し）
-st.session_state.setdefault("tab1_json", None)  # センサ構成（Tab1出力）
-st.session_state.setdefault("tab2_json", None)  # GAP分析（Tab2出力）
-st.session_state.setdefault("tab3_json", None)  # 構成方針（Tab3出力）
+llm_client = _groq_client(api_key) if api_key else None
+if llm_client is not None and not st.session_state.get("llm_ready"):
+    st.session_state["llm_ready"] = True
+    st.success("Groqクライアント準備OK")
 
-t1, t2, t3 = st.tabs(["① ユースケース定義", "② GAP分析", "③ 構成方針提示"])
+# 共有ステート（各タブ間の受け渡し）。session_state には内容ハッシュだけを置き、実体は共有ストア
+#   tab1_json: センサ構成（Tab1出力） / tab2_json: GAP分析（Tab2出力） / tab3_json: 構成方針（Tab3出力）
+t1, t2, t3, t4 = st.tabs(["① ユースケース定義", "② GAP分析", "③ 構成方針提示", "④ 感度分析"])
 
 with t1:
-    tab1_render(st.session_state.get("llm_client"), model_name)
+    tab1_render(llm_client, model_name)
 
 with t2:
-    if st.session_state["tab1_json"] is None:
+    if get_session_result("tab1_json") is None:
         st.info("まずは『① ユースケース定義』でセンサ構成を生成してください。")
-    tab2_render(st.session_state.get("llm_client"), model_name, st.session_state.get("tab1_json"))
+    tab2_render(llm_client, model_name, get_session_result("tab1_json"))
 
 with t3:
-    if st.session_state["tab2_json"] is None:
+    if get_session_result("tab2_json") is None:
         st.info("まずは『② GAP分析』まで実行してください。")
-    tab3_render(st.session_state.get("llm_client"), model_name, 
-                st.session_state.get("tab1_json"), st.session_state.get("tab2_json"))
+    tab3_render(llm_client, model_name, get_session_result("tab1_json"), get_session_result("tab2_json"))
+
+with t4:
+    tab4_render(llm_client, model_name, get_session_result("tab1_json"))
@@ -0,0 +1,126 @@
+# bench_structured.py
+"""
+構造化出力モード別に、各タブの解析失敗率・スキーマ違反率・再試行率・成功1件あたり実効レイテンシを測るベンチ。
+
+  python bench_structured.py --stub                     # オフライン（合成の失敗率。相対比較用）
+  python bench_structured.py --live --trials 5          # 実エンドポイント（GROQ_API_KEY 必須）
+
+モード:
+  legacy      : 従来動作（response_format なし・再試行なし。スキーマ適合は集計用に事後検証だけする）
+  off         : response_format なし + ローカルスキーマ検証 + 再試行
+  json_object : JSONモード + ローカルスキーマ検証 + 再試行
+  json_schema : スキーマモード（制約付きデコード）+ ローカル検証 + 再試行
+"""
+import argparse
+import os
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import tab1_usecase
+import tab2_gap
+import tab3_plan
+import llm_runtime
+from llm_runtime import complete_json, LLMOutputError
+from llm_stub import StubClient, stub_responses
+from output_schema import validate
+from uc_seed import UC_DATA
+
+MODES = ("legacy", "off", "json_object", "json_schema")
+
+
+def _tabs(samples: dict) -> dict:
+    """タブ名 → (SYSTEM_PROMPT, OUTPUT_SCHEMA, parse, 入力ペイロード群)"""
+    # 画面と同じ build_payload で作る（AOI の雲量気候値なども含め、本番と同じ入力で測る）
+    tab1_payloads = [
+        tab1_usecase.build_payload(uc, d["background"], d["question"], d["issues"], aoi=d.get("aoi"))
+        for uc, d in UC_DATA.items()
+    ]
+    tab2_payloads = [
+        tab2_gap.build_payload(samples["tab1"], tab2_gap.PURPOSE_HYPOTHESIS, aoi=d.get("aoi"))
+        for d in UC_DATA.values()
+    ]
+    tab3_payloads = [tab3_plan.build_payload(samples["tab1"], samples["tab2"])]
+    return {
+        "tab1": (tab1_usecase.SYSTEM_PROMPT, tab1_usecase.OUTPUT_SCHEMA, tab1_usecase._parse_tab1, tab1_payloads),
+        "tab2": (tab2_gap.SYSTEM_PROMPT, tab2_gap.OUTPUT_SCHEMA, tab2_gap._safe_parse_json, tab2_payloads),
+        "tab3": (tab3_plan.SYSTEM_PROMPT, tab3_plan.OUTPUT_SCHEMA, tab3_plan._safe_parse_json, tab3_payloads),
+    }
+
+
+def _one(client, model, mode, prompt, schema, parse, payload, max_tokens):
+    """1試行。戻り値 (結果, meta)。結果は "ok" / "parse"（解析失敗）/ "schema"（スキーマ違反が残った）。"""
+    if mode == "legacy":
+        # 従来動作は検証も再試行もしないので、出力のスキーマ適合はここで事後に確かめる（比較の公平のため）
+        kwargs = {"max_retries": 0}
+    else:
+        kwargs = {"schema": schema, "mode": mode}
+    try:
+        data, _, meta = complete_json(client, model, prompt, payload, parse=parse, max_tokens=max_tokens, **kwargs)
+    except LLMOutputError as e:
+        return "parse", e.meta
+    if mode == "legacy":
+        meta["schema_errors"] = len(validate(data, schema)) or None
+    return ("schema" if meta.get("schema_errors") else "ok"), meta
+
+
+def run_bench(client, model: str, modes, trials: int, concurrency: int) -> pd.DataFrame:
+    rows = []
+    max_tokens = {"tab1": 1600, "tab2": 2000, "tab3": 2200}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for tab, (prompt, schema, parse, payloads) in _tabs(stub_responses()).items():
+            for mode in modes:
+                jobs = [payloads[i % len(payloads)] for i in range(trials)]
+                results = list(pool.map(
+                    lambda p: _one(client, model, mode, prompt, schema, parse, p, max_tokens[tab]), jobs))
+                n = len(results)
+                ok = [m for s, m in results if s == "ok"]
+                attempts = [m.get("attempts", 1) for _, m in results]
+                latency = [m.get("latency_ms") or 0 for _, m in results]
+                first_try_fail = sum(1 for a, (s, _) in zip(attempts, results) if a > 1 or s != "ok")
+                rows.append({
+                    "tab": tab,
+                    "mode": mode,
+                    "n": n,
+                    "初回失敗率": first_try_fail / n,
+                    "再試行率": sum(a - 1 for a in attempts) / n,
+                    "解析失敗率": sum(1 for s, _ in results if s == "parse") / n,
+                    "スキーマ違反率": sum(1 for s, _ in results if s == "schema") / n,
+                    "最終失敗率": 1 - len(ok) / n,
+                    "平均レイテンシ(ms)": statistics.mean(latency),
+                    "成功1件あたり実効(ms)": (sum(latency) / len(ok)) if ok else float("nan"),
+                    "平均completion tokens": statistics.mean([m.get("completion_tokens") or 0 for _, m in results]),
+                })
+    return pd.DataFrame(rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--stub", action="store_true", help="オフラインの疑似応答で実行（既定）")
+    src.add_argument("--live", action="store_true", help="Groq 実エンドポイントで実行")
+    ap.add_argument("--model", default="llama-3.1-8b-instant")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--trials", type=int, default=20, help="タブ×モードごとの試行数")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--stub-latency", type=float, default=0.05, help="--stub 時の基準レイテンシ(s)")
+    args = ap.parse_args()
+
+    if args.live:
+        from openai import OpenAI
+        if not os.environ.get("OPENAI_API_KEY"):
+            os.environ["OPENAI_API_KEY"] = os.environ.get("GROQ_API_KEY", "")
+        client = OpenAI(base_url="https://api.groq.com/openai/v1")
+    else:
+        client = StubClient(stub_responses(), latency_s=args.stub_latency, seed=0)
+        llm_runtime.rate_limiter.rpm = 0  # 疑似応答ではレート制限不要
+
+    df = run_bench(client, args.model, [m.strip() for m in args.modes.split(",") if m.strip()],
+                   args.trials, args.concurrency)
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(df.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+# cloud_clim.py
+"""
+格子化した月別雲量気候値（雲の出現頻度）をメモリマップで引き、AOI の光学欠測率を見積もる。
+
+  python cloud_clim.py build --synthetic cloud_clim.bin              # 同梱の近似グリッドを再生成
+  python cloud_clim.py build --csv modis_cf.csv --res 0.25 out.bin   # 実データ（month,lat,lon,cloud_frac）から作成
+  python cloud_clim.py query 139.0,35.2,140.2,36.2 --revisit 5 --window 3
+
+同梱の cloud_clim.bin は緯度帯・季節・東アジアモンスーンを組み合わせた合成の近似値（1°格子）。
+実測に置き換えるときは MODIS MOD08_M3 の Cloud_Fraction_Mean 等を GDAL 等で CSV に書き出して build --csv に渡す。
+"""
+import argparse
+import array
+import csv
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# 0) 設定
+# =========================
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.environ.get("CDP_CLOUD_CLIM", os.path.join(HERE, "cloud_clim.bin"))
+WINDOW_DAYS = float(os.environ.get("CDP_CLOUD_WINDOW_DAYS", "7"))    # 目的文から読めないときの検知窓（日）
+AUTOCORR = float(os.environ.get("CDP_CLOUD_AUTOCORR", "0.3"))        # 窓内の観測どうしの雲の相関（0=独立）
+
+# =========================
+# 1) バイナリ形式（タイル分割 uint8。AOI が掛かるタイルのページだけを読む）
+# =========================
+# ヘッダ 256 バイト：magic, version, flags(bit0=合成), res_deg, lat0(南端), lon0(西端),
+#                    n_lat, n_lon, tile, months, 出典文字列長 → 出典(UTF-8)
+# 本体：タイル (ty, tx) の行優先 → 月 → タイル内の行 → 列。値は 0..250 = 雲量 0..100%、255 = 欠測
+MAGIC = b"CCLM"
+VERSION = 1
+HEADER_SIZE = 256
+_HEADER = struct.Struct("<4sHHfffHHHHH")
+NODATA = 255
+SCALE = 250
+FLAG_SYNTHETIC = 1
+
+
+class CloudClimatology:
+    """cloud_clim.bin の読み取り専用ビュー。ファイル全体はメモリに載せない。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.res, self.lat0, self.lon0,
+         self.n_lat, self.n_lon, self.tile, self.months, n_src) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: 雲量気候値ファイルではありません")
+        self.synthetic = bool(flags & FLAG_SYNTHETIC)
+        self.source = bytes(self._mm[_HEADER.size:_HEADER.size + n_src]).decode("utf-8")
+        self.n_ty = -(-self.n_lat // self.tile)
+        self.n_tx = -(-self.n_lon // self.tile)
+
+    def _cell_range(self, lo: float, hi: float, origin: float, n: int) -> tuple:
+        i0 = max(0, min(n - 1, int(math.floor((lo - origin) / self.res))))
+        i1 = max(0, min(n - 1, int(math.ceil((hi - origin) / self.res)) - 1))
+        return i0, max(i0, i1)
+
+    def cloud_fraction(self, bbox) -> list:
+        """bbox=(西端経度, 南端緯度, 東端経度, 北端緯度) の月別雲量（0..1、面積加重）。データが無い月は None。"""
+        west, south, east, north = bbox
+        r0, r1 = self._cell_range(south, north, self.lat0, self.n_lat)
+        # 日付変更線をまたぐ AOI は東西2つに分ける
+        spans = [(west, east)] if west <= east else [(west, self.lon0 + self.n_lon * self.res), (self.lon0, east)]
+        cols = [self._cell_range(w, e, self.lon0, self.n_lon) for w, e in spans]
+
+        t2 = self.tile * self.tile
+        sums, weights = [0.0] * self.months, [0.0] * self.months
+        for r in range(r0, r1 + 1):
+            w_row = math.cos(math.radians(self.lat0 + (r + 0.5) * self.res))
+            ty, ry = divmod(r, self.tile)
+            for c0, c1 in cols:
+                for tx in range(c0 // self.tile, c1 // self.tile + 1):
+                    a = max(c0, tx * self.tile) - tx * self.tile
+                    b = min(c1, tx * self.tile + self.tile - 1) - tx * self.tile + 1
+                    base = HEADER_SIZE + (ty * self.n_tx + tx) * self.months * t2 + ry * self.tile
+                    for m in range(self.months):
+                        row = self._mm[base + m * t2 + a:base + m * t2 + b]
+                        n_nodata = row.count(NODATA)
+                        valid = len(row) - n_nodata
+                        if valid:
+                            sums[m] += (sum(row) - NODATA * n_nodata) / SCALE * w_row
+                            weights[m] += valid * w_row
+        return [(s / w) if w else None for s, w in zip(sums, weights)]
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """プロセス内で1つ。データファイルが無ければ None（見積りは表示・送信しない）。"""
+    global _index
+    if _index is None and os.path.exists(DATA_PATH):
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = CloudClimatology(DATA_PATH)
+                except Exception as e:
+                    logger.warning("雲量気候値 %s を読み込めませんでした: %s", DATA_PATH, e)
+                    return None
+    return _index
+
+# =========================
+# 2) 欠測率の見積り
+# =========================
+def missing_rate(cloud: float, revisit_days: float, window_days: float, autocorr: float = AUTOCORR) -> float:
+    """
+    検知窓（window_days）の中で晴天観測が1回も得られない確率。
+    窓内の観測回数 n = window/revisit。n<1 なら観測自体が無い確率も含める。
+    観測どうしの雲の相関は有効観測回数 1+(n-1)(1-autocorr) で近似する。
+    """
+    n = window_days / max(revisit_days, 1e-6)
+    if n < 1:
+        return 1 - n * (1 - cloud)
+    return cloud ** (1 + (n - 1) * (1 - autocorr))
+
+def is_optical(sensor: dict) -> bool:
+    """SAR・マイクロ波は雲の影響を受けない扱い。"""
+    text = " ".join([str(sensor.get("name", ""))] + [str(b) for b in sensor.get("bands") or []]).upper()
+    return not any(k in text for k in ("SAR", "SMAP", "マイクロ波", "MICROWAVE"))
+
+def parse_bbox(text: str) -> tuple:
+    """「西端経度, 南端緯度, 東端経度, 北端緯度」を読む。範囲外は ValueError。"""
+    vals = [float(v) for v in re.split(r"[,\s、]+", (text or "").strip()) if v]
+    if len(vals) != 4:
+        raise ValueError("4つの数値（西端経度, 南端緯度, 東端経度, 北端緯度）を入力してください")
+    west, south, east, north = vals
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south < north <= 90):
+        raise ValueError("経度は -180..180、緯度は -90..90（南 < 北）で入力してください")
+    return west, south, east, north
+
+def window_days_from_goal(goal: str, default: float = WINDOW_DAYS) -> float:
+    """目的文の「3日以内」などから検知窓を読む。"""
+    m = re.search(r"(\d+(?:\.\d+)?)\s*日以内", goal or "")
+    return float(m.group(1)) if m else default
+
+def _pct(v: float) -> float:
+    return round(v * 100, 1)
+
+def estimate(bbox, sensors=(), window_days: float = WINDOW_DAYS) -> dict:
+    """
+    AOI の月別雲量と、センサごとの光学欠測率（年平均・最悪月）を返す。プロンプトへそのまま渡せる形。
+    合成グリッドなら reference_only=True を付ける（参考値としてだけ使わせる）。
+    データが無い/AOI にデータが無ければ None。
+    """
+    index = get_index()
+    if index is None or not bbox:
+        return None
+    monthly = index.cloud_fraction(bbox)
+    valid = [(m + 1, c) for m, c in enumerate(monthly) if c is not None]
+    if not valid:
+        return None
+
+    def summarize(revisits: list) -> dict:
+        # 複数の光学センサは窓内の観測回数を合算（1/revisit の和）
+        rate = sum(1 / r for r in revisits)
+        by_month = [(m, missing_rate(c, 1 / rate, window_days)) for m, c in valid]
+        worst_m, worst = max(by_month, key=lambda x: x[1])
+        return {
+            "missing_pct_annual": _pct(sum(v for _, v in by_month) / len(by_month)),
+            "missing_pct_worst_month": _pct(worst),
+            "worst_month": worst_m,
+        }
+
+    rows, optical = [], []
+    for s in sensors or []:
+        revisit = s.get("revisit_days")
+        if not isinstance(revisit, (int, float)) or revisit <= 0:
+            continue
+        row = {"name": s.get("name", ""), "revisit_days": revisit, "optical": is_optical(s)}
+        if row["optical"]:
+            optical.append(revisit)
+            mean_cloud = sum(c for _, c in valid) / len(valid)
+            row.update(summarize([revisit]), clear_obs_per_month=round(30 / revisit * (1 - mean_cloud), 1))
+        rows.append(row)
+
+    facts = {
+        "bbox": [round(v, 3) for v in bbox],
+        "source": index.source + ("（合成の近似値）" if index.synthetic else ""),
+        "cloud_pct_by_month": [_pct(c) if c is not None else None for c in monthly],
+        "cloud_pct_annual": _pct(sum(c for _, c in valid) / len(valid)),
+        "cloudiest_month": max(valid, key=lambda x: x[1])[0],
+    }
+    if index.synthetic:
+        # 合成グリッドの値は実測ではない。プロンプト側で確定値として扱わせない
+        facts["reference_only"] = True
+    if rows:
+        facts["window_days"] = window_days
+        facts["sensors"] = rows
+        if optical:
+            facts["optical_combined"] = summarize(optical)
+    return facts
+
+# =========================
+# 3) 表示（Tab1/Tab2 共通）
+# =========================
+def render_estimate(facts: dict, title: str = "☁️ AOI の雲量気候値と光学欠測率（見積り）"):
+    if not facts:
+        return
+    with st.expander(title, expanded=False):
+        st.caption(f"出典：{facts['source']} ／ AOI {facts['bbox']} ／ 年平均雲量 {facts['cloud_pct_annual']}%"
+                   f"（最大 {facts['cloudiest_month']}月）")
+        st.bar_chart({"雲量(%)": {f"{m + 1:02d}月": v for m, v in enumerate(facts["cloud_pct_by_month"])}})
+        if facts.get("sensors"):
+            st.markdown(f"検知窓 **{facts['window_days']:g}日** 内に晴天観測が1回も無い確率")
+            table = [{
+                "センサ": s["name"],
+                "再訪(日)": s["revisit_days"],
+                "種別": "光学" if s["optical"] else "SAR/マイクロ波（雲の影響なし）",
+                "欠測率 年平均(%)": s.get("missing_pct_annual"),
+                "欠測率 最悪月(%)": s.get("missing_pct_worst_month"),
+                "最悪月": s.get("worst_month"),
+                "晴天観測/月": s.get("clear_obs_per_month"),
+            } for s in facts["sensors"]]
+            comb = facts.get("optical_combined")
+            if comb:
+                table.append({"センサ": "光学センサ合算", "種別": "光学", "欠測率 年平均(%)": comb["missing_pct_annual"],
+                              "欠測率 最悪月(%)": comb["missing_pct_worst_month"], "最悪月": comb["worst_month"]})
+            st.dataframe(table, use_container_width=True, hide_index=True)
+
+# =========================
+# 4) グリッドの作成（同梱の近似値 / 実データ CSV）
+# =========================
+def _synthetic_cloud(lat: float, lon: float, month: int) -> float:
+    """緯度帯（ITCZ・亜熱帯高圧帯・中緯度低気圧帯）と季節移動、東アジアの梅雨/日本海側の冬季雲を重ねた近似。"""
+    season = math.cos(2 * math.pi * (month - 7) / 12)   # 7月 +1、1月 -1
+    g = lambda x, mu, sd: math.exp(-((x - mu) / sd) ** 2)
+    f = 0.55
+    f += 0.25 * g(lat, 5 + 8 * season, 8)                                     # ITCZ
+    f -= 0.22 * (g(lat, 25 + 5 * season, 8) + g(lat, -25 + 5 * season, 8))   # 亜熱帯高圧帯
+    f += 0.18 * (g(lat, 55, 12) + g(lat, -58, 10))                            # 中緯度の低気圧帯
+    lon_e = lon % 360
+    if 110 <= lon_e <= 150:
+        f += 0.22 * g(lat, 30 + 4 * season, 6) * max(0.0, season)            # 梅雨前線（6〜7月）
+        if 36.5 <= lat <= 45 and 130 <= lon_e <= 141:
+            f += 0.15 * max(0.0, -season)                                     # 日本海側の冬季（雪雲）
+        elif 25 <= lat < 36.5:
+            f -= 0.15 * max(0.0, -season)                                     # 太平洋側・大陸南部の冬季（乾燥）
+    if 30 <= lat <= 42 and (235 <= lon_e <= 245 or lon_e >= 350 or lon_e <= 40):
+        f -= 0.3 * max(0.0, season)                                           # 地中海性気候の夏季（カリフォルニア/地中海）
+    if abs(lat) > 65:
+        f -= 0.1 * (season if lat > 0 else -season)                          # 極域：夏に雲が増える
+    return min(0.95, max(0.05, f))
+
+def _write(path: str, grid, n_lat: int, n_lon: int, res: float, lat0: float, lon0: float,
+           tile: int, source: str, synthetic: bool):
+    """grid(m, r, c) -> 0..1 または None。"""
+    src = source.encode("utf-8")[:HEADER_SIZE - _HEADER.size]
+    header = _HEADER.pack(MAGIC, VERSION, FLAG_SYNTHETIC if synthetic else 0, res, lat0, lon0,
+                          n_lat, n_lon, tile, 12, len(src)) + src
+    n_ty, n_tx = -(-n_lat // tile), -(-n_lon // tile)
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        for ty in range(n_ty):
+            for tx in range(n_tx):
+                for m in range(12):
+                    block = bytearray([NODATA]) * (tile * tile)
+                    for ry in range(tile):
+                        r = ty * tile + ry
+                        if r >= n_lat:
+                            break
+                        for rx in range(tile):
+                            c = tx * tile + rx
+                            if c >= n_lon:
+                                break
+                            v = grid(m, r, c)
+                            if v is not None:
+                                block[ry * tile + rx] = int(round(min(1.0, max(0.0, v)) * SCALE))
+                    f.write(block)
+
+def build_synthetic(path: str, res: float = 1.0, tile: int = 16):
+    n_lat, n_lon = int(round(180 / res)), int(round(360 / res))
+    _write(path, lambda m, r, c: _synthetic_cloud(-90 + (r + 0.5) * res, -180 + (c + 0.5) * res, m + 1),
+           n_lat, n_lon, res, -90.0, -180.0, tile, f"合成気候モデル {res:g}°", synthetic=True)
+
+def build_from_csv(csv_path: str, path: str, res: float, tile: int = 16, source: str = None):
+    """
+    month(1-12), lat, lon, cloud_frac（0..1 または %）の CSV をセル平均して書き出す。
+    集計用の配列は月×格子分だけ確保する（0.25° で約 75MB）。
+    """
+    n_lat, n_lon = int(round(180 / res)), int(round(360 / res))
+    size = 12 * n_lat * n_lon
+    sums, counts = array.array("f", bytes(4 * size)), array.array("H", bytes(2 * size))
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                m, lat, lon, v = int(row["month"]) - 1, float(row["lat"]), float(row["lon"]), float(row["cloud_frac"])
+            except (KeyError, ValueError):
+                continue
+            if not 0 <= m < 12 or math.isnan(v):
+                continue
+            v = v / 100 if v > 1 else v
+            r = min(n_lat - 1, int((lat + 90) / res))
+            c = min(n_lon - 1, int(((lon + 180) % 360) / res))
+            i = (m * n_lat + r) * n_lon + c
+            sums[i] += v
+            counts[i] = min(counts[i] + 1, 65535)
+
+    def grid(m, r, c):
+        i = (m * n_lat + r) * n_lon + c
+        return sums[i] / counts[i] if counts[i] else None
+
+    _write(path, grid, n_lat, n_lon, res, -90.0, -180.0, tile,
+           source or os.path.basename(csv_path), synthetic=False)
+
+# =========================
+# 5) CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="グリッドを作成")
+    b.add_argument("out")
+    src = b.add_mutually_exclusive_group(required=True)
+    src.add_argument("--synthetic", action="store_true", help="同梱の近似グリッド")
+    src.add_argument("--csv", help="month,lat,lon,cloud_frac の CSV")
+    b.add_argument("--res", type=float, default=1.0, help="格子間隔（度）")
+    b.add_argument("--tile", type=int, default=16, help="タイル一辺のセル数")
+    b.add_argument("--source", default=None, help="出典の表記")
+    q = sub.add_parser("query", help="AOI を見積もる")
+    q.add_argument("bbox", help="西端経度,南端緯度,東端経度,北端緯度")
+    q.add_argument("--revisit", type=float, default=5)
+    q.add_argument("--window", type=float, default=WINDOW_DAYS)
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        if args.synthetic:
+            build_synthetic(args.out, args.res, args.tile)
+        else:
+            build_from_csv(args.csv, args.out, args.res, args.tile, args.source)
+        print(f"{args.out}: {os.path.getsize(args.out):,} bytes")
+    else:
+        t0 = time.perf_counter()
+        facts = estimate(parse_bbox(args.bbox), [{"name": "optical", "revisit_days": args.revisit}], args.window)
+        print(facts)
+        print(f"{(time.perf_counter() - t0) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+# export.py
+"""
+実行履歴（runs.db）の結果を、型付きの表（Parquet / Excel）と実行ごとの Markdown レポートへ一括で書き出す。
+
+  python export.py --out exports                              # 全形式・成功した実行すべて
+  python export.py --out exports --formats xlsx,md --stage tab3 --latest-only
+  python export.py --out exports --usecase 農業保険（干ばつ・冷害） --since 2026-01-01
+
+出力:
+  <out>/tables/<表名>.parquet   sensor_suite / dimensions / constellation / gap_closures / monthly_cost_estimate
+  <out>/runs.xlsx               同じ表を1シート1表で
+  <out>/reports/*.md            実行ごとのレポート（YAML front matter 付き。pandoc 等でそのまま PDF 化できる）
+
+実行履歴は chunk 件ずつ読み、表は ROW_GROUP 行ごとに書き出す（全件の DataFrame は作らない）。
+Parquet は pyarrow、Excel は openpyxl が必要（無い形式はエラーで知らせる）。
+"""
+import argparse
+import datetime
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+import streamlit as st
+
+from jobs import JOB_TTL_S, submit_job, render_jobs_panel
+from result_store import get_session_result, set_session_result
+from run_store import STAGE_LABELS, get_store
+from tab4_sweep import parse_yen
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 任意依存
+    pa = pq = None
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # 任意依存
+    Workbook = None
+
+# =========================
+# 0) 設定
+# =========================
+CHUNK_RUNS = int(os.environ.get("CDP_EXPORT_CHUNK", "200"))       # 1回に読む実行数
+ROW_GROUP = int(os.environ.get("CDP_EXPORT_ROW_GROUP", "5000"))   # Parquet/Excel へまとめて書く行数
+FORMATS = ("parquet", "xlsx", "md")
+# 画面から作った zip の置き場（セッションには結果ハッシュだけを置き、zip 本体はここ）
+EXPORT_DIR = os.environ.get("CDP_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "cdp-exports"))
+
+# =========================
+# 1) 表の定義（列名, 型）と平坦化
+# =========================
+# 型: str / float / int / ts（created_at）
+_RUN_COLUMNS = [("run_id", "int"), ("created_at", "ts"), ("usecase", "str"), ("model", "str")]
+
+def _join(v) -> str:
+    return ", ".join(str(x) for x in v) if isinstance(v, list) else ("" if v is None else str(v))
+
+def _float(v):
+    if isinstance(v, (int, float)):
+        return float(v)
+    m = re.search(r"-?\d+(?:\.\d+)?", str(v or ""))
+    return float(m.group()) if m else None
+
+def _items(run: dict, key: str) -> list:
+    v = (run.get("parsed") or {}).get(key)
+    return [x for x in v if isinstance(x, dict)] if isinstance(v, list) else []
+
+TABLES = {
+    # 表名: (ステージ, 列, run -> 行のリスト)
+    "sensor_suite": ("tab1", [
+        ("idx", "int"), ("name", "str"), ("platform", "str"), ("bands", "str"), ("gsd_m", "float"),
+        ("revisit_days", "float"), ("swath_km", "float"), ("typical_products", "str"), ("constraints", "str"),
+    ], lambda run: [
+        {"idx": i, "name": s.get("name"), "platform": s.get("platform"), "bands": _join(s.get("bands")),
+         "gsd_m": _float(s.get("gsd_m")), "revisit_days": _float(s.get("revisit_days")),
+         "swath_km": _float(s.get("swath_km")), "typical_products": _join(s.get("typical_products")),
+         "constraints": _join(s.get("constraints"))}
+        for i, s in enumerate(_items(run, "sensor_suite"))
+    ]),
+    "dimensions": ("tab2", [
+        ("goal", "str"), ("axis", "str"), ("current", "str"), ("target", "str"), ("gap", "str"),
+        ("reason", "str"), ("risk", "str"), ("mitigation", "str"),
+    ], lambda run: [
+        {"goal": (run.get("payload") or {}).get("goal"),
+         **{k: _join(d.get(k)) for k in ("axis", "current", "target", "gap", "reason", "risk", "mitigation")}}
+        for d in _items(run, "dimensions")
+    ]),
+    "constellation": ("tab3", [
+        ("idx", "int"), ("name", "str"), ("type", "str"), ("band", "str"), ("gsd_m", "float"),
+        ("revisit_days", "float"), ("role", "str"), ("why", "str"),
+    ], lambda run: [
+        {"idx": i, "name": c.get("name"), "type": c.get("type"), "band": _join(c.get("band")),
+         "gsd_m": _float(c.get("gsd_m")), "revisit_days": _float(c.get("revisit_days")),
+         "role": c.get("role"), "why": c.get("why")}
+        for i, c in enumerate(_items(run, "constellation"))
+    ]),
+    "gap_closures": ("tab3", [
+        ("axis", "str"), ("gap_level", "str"), ("approach", "str"), ("effect", "str"),
+    ], lambda run: [
+        {k: _join(g.get(k)) for k in ("axis", "gap_level", "approach", "effect")}
+        for g in _items(run, "gap_closures")
+    ]),
+    "monthly_cost_estimate": ("tab3", [
+        ("satellite", "str"), ("aerial", "str"), ("ground", "str"), ("cloud_processing", "str"),
+        ("total", "str"), ("total_yen", "float"),
+    ], lambda run: [
+        {**{k: _join(c.get(k)) for k in ("satellite", "aerial", "ground", "cloud_processing", "total")},
+         "total_yen": parse_yen(c.get("total"))}
+        for c in [(run.get("parsed") or {}).get("monthly_cost_estimate")] if isinstance(c, dict)
+    ]),
+}
+
+def _columns(table: str) -> list:
+    return _RUN_COLUMNS + TABLES[table][1]
+
+def _rows(table: str, run: dict) -> list:
+    base = {"run_id": run["id"], "created_at": datetime.datetime.fromtimestamp(run["created_at"]),
+            "usecase": run.get("usecase"), "model": run.get("model")}
+    return [{**base, **row} for row in TABLES[table][2](run)]
+
+def _cast(v, typ: str):
+    if v is None or typ == "ts":
+        return v
+    try:
+        return {"str": str, "float": float, "int": int}[typ](v)
+    except (TypeError, ValueError):
+        return None
+
+# =========================
+# 2) 出力先（表ごとに ROW_GROUP 行ずつ受け取る）
+# =========================
+class ParquetSink:
+    _TYPES = {"str": "string", "float": "float64", "int": "int64"}
+
+    def __init__(self, out_dir: str):
+        if pa is None:
+            raise RuntimeError("Parquet 出力には pyarrow が必要です（pip install pyarrow）")
+        self.dir = os.path.join(out_dir, "tables")
+        os.makedirs(self.dir, exist_ok=True)
+        self._writers = {}
+        self.paths = []
+
+    def write(self, table: str, rows: list):
+        cols = _columns(table)
+        if table not in self._writers:
+            schema = pa.schema([(c, pa.timestamp("s") if t == "ts" else getattr(pa, self._TYPES[t])())
+                                for c, t in cols])
+            path = os.path.join(self.dir, f"{table}.parquet")
+            self._writers[table] = pq.ParquetWriter(path, schema, compression="zstd")
+            self.paths.append(path)
+        writer = self._writers[table]
+        arrays = {c: [_cast(r.get(c), t) for r in rows] for c, t in cols}
+        writer.write_table(pa.Table.from_pydict(arrays, schema=writer.schema))
+
+    def close(self):
+        for w in self._writers.values():
+            w.close()
+
+
+class ExcelSink:
+    def __init__(self, out_dir: str):
+        if Workbook is None:
+            raise RuntimeError("Excel 出力には openpyxl が必要です（pip install openpyxl）")
+        self.path = os.path.join(out_dir, "runs.xlsx")
+        self.paths = [self.path]
+        # write_only: 行は追記のみ・シート全体をメモリに持たない
+        self._wb = Workbook(write_only=True)
+        self._sheets = {}
+
+    def write(self, table: str, rows: list):
+        cols = _columns(table)
+        ws = self._sheets.get(table)
+        if ws is None:
+            ws = self._sheets[table] = self._wb.create_sheet(title=table[:31])
+            ws.append([c for c, _ in cols])
+        for r in rows:
+            ws.append([_cast(r.get(c), t) for c, t in cols])
+
+    def close(self):
+        if not self._sheets:
+            self._wb.create_sheet(title="（該当なし）")
+        self._wb.save(self.path)
+
+# =========================
+# 3) 実行ごとの Markdown レポート
+# =========================
+def _cell(v) -> str:
+    return _join(v).replace("|", "\\|").replace("\n", " ")
+
+def _md_table(rows: list, columns: list) -> list:
+    """columns=[(キー, 見出し), ...]"""
+    if not rows:
+        return ["（なし）", ""]
+    lines = ["| " + " | ".join(h for _, h in columns) + " |", "|" + "---|" * len(columns)]
+    lines += ["| " + " | ".join(_cell(r.get(k)) for k, _ in columns) + " |" for r in rows]
+    return lines + [""]
+
+def _md_list(items) -> list:
+    return [f"- {_cell(x)}" for x in items or []] + [""]
+
+def _report_tab1(d: dict) -> list:
+    cap = d.get("capability_summary") or {}
+    return (["## 衛星センサ構成", ""]
+            + _md_table(d.get("sensor_suite") or [], [("name", "衛星"), ("platform", "軌道"), ("bands", "バンド"),
+                                                       ("gsd_m", "GSD(m)"), ("revisit_days", "再訪(日)"),
+                                                       ("swath_km", "スワス(km)"), ("constraints", "制約")])
+            + ["## できること", ""] + _md_list(cap.get("can"))
+            + ["## できないこと", ""] + _md_list(cap.get("cannot")))
+
+def _report_tab2(d: dict) -> list:
+    tobe = d.get("to_be_requirements") or {}
+    return (["## 目的", "", _cell(d.get("goal")), "", "## To-Be観測要件", ""]
+            + _md_table([tobe], [("revisit_days", "観測頻度"), ("gsd_m", "空間分解能"), ("coverage", "観測範囲"),
+                                 ("reliability", "信頼性"), ("cost", "コスト")])
+            + ["## ギャップ（4軸）", ""]
+            + _md_table(d.get("dimensions") or [], [("axis", "軸"), ("current", "現状"), ("target", "目標"),
+                                                    ("gap", "GAP"), ("reason", "根拠"), ("mitigation", "軽減策")]))
+
+def _report_tab3(d: dict) -> list:
+    rat = d.get("rationale") or {}
+    cost = d.get("monthly_cost_estimate") or {}
+    return (["## 方針", ""] + _md_list(v for v in rat.values() if v)
+            + ["## 衛星コンステレーション", ""]
+            + _md_table(d.get("constellation") or [], [("name", "衛星"), ("type", "種別"), ("gsd_m", "GSD(m)"),
+                                                       ("revisit_days", "再訪(日)"), ("role", "役割")])
+            + ["## 航空層（UAV/HAPS）", ""]
+            + _md_table(d.get("aerial_layer") or [], [("name", "種別"), ("platform", "機体"), ("role", "役割")])
+            + ["## 地上層", ""]
+            + _md_table(d.get("ground_layer") or [], [("name", "名称"), ("sensors", "センサ"), ("sampling", "頻度"),
+                                                      ("role", "役割")])
+            + ["## GAPの埋め方", ""]
+            + _md_table(d.get("gap_closures") or [], [("axis", "軸"), ("gap_level", "GAP"), ("approach", "対策"),
+                                                      ("effect", "期待改善")])
+            + ["## 月額コスト見積", ""]
+            + _md_table([cost], [("satellite", "衛星"), ("aerial", "航空"), ("ground", "地上"),
+                                 ("cloud_processing", "処理"), ("total", "合計")])
+            + ["## リスクと対策", ""]
+            + _md_table(d.get("risks_and_mitigations") or [], [("risk", "リスク"), ("mitigation", "対策")])
+            + ["## 段階的ロードマップ", ""]
+            + _md_table(d.get("phased_roadmap") or [], [("phase", "フェーズ"), ("months", "期間"), ("scope", "範囲")]))
+
+_REPORTS = {"tab1": _report_tab1, "tab2": _report_tab2, "tab3": _report_tab3}
+
+def render_report(run: dict) -> str:
+    ts = datetime.datetime.fromtimestamp(run["created_at"]).strftime("%Y-%m-%d %H:%M")
+    title = f"{STAGE_LABELS.get(run['stage'], run['stage'])}：{run.get('usecase') or '（UC不明）'}"
+    lines = [
+        "---",
+        f'title: "{title}"',
+        f'date: "{ts}"',
+        f"run_id: {run['id']}",
+        f"model: {run.get('model')}",
+        f"input_hash: {run.get('input_hash', '')[:16]}",
+        "---",
+        "",
+        f"# {title}",
+        "",
+        f"- 実行 #{run['id']} ／ {ts} ／ {run.get('model')}"
+        + (f" ／ {run['latency_ms'] / 1000:.1f}s" if run.get("latency_ms") else ""),
+        "",
+    ]
+    lines += _REPORTS.get(run["stage"], lambda d: [])(run.get("parsed") or {})
+    return "\n".join(lines)
+
+def _slug(text: str) -> str:
+    return re.sub(r"[\\/:*?\"<>|\s（）()]+", "_", text or "uc").strip("_")[:40]
+
+class MarkdownSink:
+    def __init__(self, out_dir: str):
+        self.dir = os.path.join(out_dir, "reports")
+        os.makedirs(self.dir, exist_ok=True)
+        self.paths = []
+        self._index = open(os.path.join(self.dir, "index.md"), "w", encoding="utf-8")
+        self._index.write("# 実行レポート一覧\n\n| 実行 | 日時 | ステージ | ユースケース | モデル |\n|---|---|---|---|---|\n")
+
+    def write_run(self, run: dict):
+        fn = f"{run['id']:06d}_{run['stage']}_{_slug(run.get('usecase'))}.md"
+        with open(os.path.join(self.dir, fn), "w", encoding="utf-8") as f:
+            f.write(render_report(run))
+        self.paths.append(os.path.join(self.dir, fn))
+        ts = datetime.datetime.fromtimestamp(run["created_at"]).strftime("%Y-%m-%d %H:%M")
+        self._index.write(f"| [#{run['id']}]({fn}) | {ts} | {STAGE_LABELS.get(run['stage'], run['stage'])} "
+                          f"| {_cell(run.get('usecase'))} | {run.get('model')} |\n")
+
+    def close(self):
+        self._index.close()
+
+# =========================
+# 4) 一括エクスポート（実行履歴を1回だけ走査して全出力へ流す）
+# =========================
+def export_runs(out_dir: str, formats=FORMATS, stage: str = None, usecase: str = None, model: str = None,
+                since: float = None, latest_only: bool = False, chunk_size: int = CHUNK_RUNS,
+                progress=None) -> dict:
+    """戻り値 {"runs": 件数, "rows": {表名: 行数}, "files": [出力パス]}。"""
+    os.makedirs(out_dir, exist_ok=True)
+    tables = [t for t, (s, _, _) in TABLES.items() if not stage or s == stage]
+    table_sinks = ([ParquetSink(out_dir)] if "parquet" in formats else []) \
+        + ([ExcelSink(out_dir)] if "xlsx" in formats else [])
+    md = MarkdownSink(out_dir) if "md" in formats else None
+
+    buffers = {t: [] for t in tables}
+    counts = {t: 0 for t in tables}
+    n_runs = 0
+
+    def flush(table: str):
+        for sink in table_sinks:
+            sink.write(table, buffers[table])
+        counts[table] += len(buffers[table])
+        buffers[table] = []
+
+    try:
+        for chunk in get_store().iter_runs(stage=stage, usecase=usecase, model=model, since=since,
+                                           latest_only=latest_only, chunk_size=chunk_size):
+            for run in chunk:
+                if not isinstance(run.get("parsed"), dict):
+                    continue
+                n_runs += 1
+                for t in tables:
+                    if TABLES[t][0] == run["stage"]:
+                        buffers[t].extend(_rows(t, run))
+                        if len(buffers[t]) >= ROW_GROUP:
+                            flush(t)
+                if md:
+                    md.write_run(run)
+            if progress:
+                progress(n_runs)
+        for t in tables:
+            if buffers[t] or (counts[t] == 0 and table_sinks):
+                flush(t)   # 該当0件でも空の表（列だけ）を作る
+    finally:
+        for sink in table_sinks + ([md] if md else []):
+            sink.close()
+
+    files = [p for s in table_sinks for p in s.paths] + ([os.path.join(md.dir, "index.md")] if md else [])
+    return {"runs": n_runs, "rows": counts, "files": files}
+
+# =========================
+# 5) 画面（ジョブで zip を作り、サイドバーからダウンロード）
+# =========================
+def _prune_archives(keep_s: float = JOB_TTL_S):
+    """完了ジョブの保持期間を過ぎた zip を消す。"""
+    cutoff = time.time() - keep_s
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if name.endswith(".zip") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def build_archive(formats, stage: str = None, latest_only: bool = True, progress=None):
+    """
+    ジョブ本体。EXPORT_DIR に zip を作り、(結果, err) を返す（jobs の _call_llm と同じ形）。
+    結果は zip のパスと件数だけ（小さいので共有結果ストアへ載せる）。
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _prune_archives()
+    if progress:
+        progress(0.05, "書き出し中…")
+    tmp = tempfile.mkdtemp(prefix="cdp-export-")
+    try:
+        res = export_runs(os.path.join(tmp, "export"), formats, stage=stage, latest_only=latest_only,
+                          progress=progress and (lambda n: progress(0.5, f"{n} 実行を書き出し中…")))
+        if progress:
+            progress(0.9, "zip に圧縮中…")
+        base = os.path.join(EXPORT_DIR, f"cdp_export_{uuid.uuid4().hex[:12]}")
+        path = shutil.make_archive(base, "zip", os.path.join(tmp, "export"))
+    except RuntimeError as e:
+        return None, str(e)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {"path": path, "runs": res["runs"], "rows": res["rows"], "created_at": time.time()}, None
+
+def _apply_job(job):
+    set_session_result("export_result", job.result)
+    st.toast("エクスポートを作成しました。")
+
+def render_export():
+    with st.expander("📦 エクスポート（Parquet / Excel / Markdown）", expanded=False):
+        formats = st.multiselect("形式", list(FORMATS), default=[f for f in FORMATS
+                                                                 if (f != "parquet" or pa) and (f != "xlsx" or Workbook)],
+                                 key="export_formats")
+        stage = st.selectbox("ステージ", [None, "tab1", "tab2", "tab3"],
+                             format_func=lambda s: "すべて" if s is None else STAGE_LABELS[s], key="export_stage")
+        latest_only = st.checkbox("同一入力は最新のみ", value=True, key="export_latest_only")
+        if st.button("エクスポートを作成", use_container_width=True, disabled=not formats):
+            submit_job("export", f"エクスポート: {', '.join(formats)}", build_archive, list(formats),
+                       stage=stage, latest_only=latest_only, with_progress=True)
+
+        render_jobs_panel("export", _apply_job)
+
+        res = get_session_result("export_result")
+        if res and os.path.exists(res["path"]):
+            st.caption(f"{res['runs']} 実行 ／ " + "、".join(f"{t} {n}行" for t, n in res["rows"].items()))
+            with open(res["path"], "rb") as f:
+                st.download_button("zip をダウンロード", f, file_name="cdp_export.zip",
+                                   mime="application/zip", use_container_width=True)
+        elif res:
+            st.caption("zip の保持期間が過ぎました。もう一度作成してください。")
+
+# =========================
+# 6) CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", default="exports")
+    ap.add_argument("--formats", default=",".join(FORMATS), help="parquet,xlsx,md から選択")
+    ap.add_argument("--stage", choices=["tab1", "tab2", "tab3"])
+    ap.add_argument("--usecase")
+    ap.add_argument("--model")
+    ap.add_argument("--since", help="YYYY-MM-DD 以降の実行のみ")
+    ap.add_argument("--latest-only", action="store_true", help="同一入力（input_hash）は最新のみ")
+    ap.add_argument("--chunk", type=int, default=CHUNK_RUNS)
+    args = ap.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip() in FORMATS]
+    since = datetime.datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else None
+    res = export_runs(args.out, formats, stage=args.stage, usecase=args.usecase, model=args.model, since=since,
+                      latest_only=args.latest_only, chunk_size=args.chunk,
+                      progress=lambda n: print(f"\r{n} 実行…", end="", flush=True))
+    print(f"\n{res['runs']} 実行を書き出しました")
+    for t, n in res["rows"].items():
+        print(f"  {t}: {n} 行")
+    for p in res["files"]:
+        print(f"  {p}")
+
+
+if __name__ == "__main__":
+    main()
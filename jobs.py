@@ -0,0 +1,230 @@
+# jobs.py
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from result_store import get_result_store, session_id
+
+# =========================
+# 0) 設定（全セッション共有のワーカープール）
+# =========================
+MAX_WORKERS = int(os.environ.get("CDP_JOB_WORKERS", "4"))
+MAX_PENDING = int(os.environ.get("CDP_JOB_MAX_PENDING", "32"))          # サーバ全体の未完了ジョブ上限
+MAX_PER_SESSION = int(os.environ.get("CDP_JOB_MAX_PER_SESSION", "4"))   # 1セッションの未完了ジョブ上限
+JOB_TTL_S = int(os.environ.get("CDP_JOB_TTL_S", "3600"))                # 完了ジョブを保持する秒数
+# 長時間ワーカーを占有するステージの上限 {stage: (表示名, サーバ全体, 1セッション)}。全体は MAX_WORKERS 未満にして他タブの枠を残す
+STAGE_LIMITS = {
+    "sweep": ("スイープ", int(os.environ.get("CDP_JOB_MAX_SWEEPS", str(max(1, MAX_WORKERS // 2)))), 1),
+}
+
+ACTIVE = ("queued", "running")
+STATUS_LABELS = {"queued": "⏳ 待機中", "running": "🔄 実行中", "done": "✅ 完了", "error": "❌ 失敗", "cancelled": "🚫 取消"}
+
+
+class QueueFull(Exception):
+    """バックプレッシャ：上限を超えた投入を拒否する。"""
+
+
+# =========================
+# 1) ジョブ
+# =========================
+class Job:
+    def __init__(self, session_id: str, stage: str, label: str, meta: dict = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.stage = stage
+        self.label = label
+        self.meta = meta or {}
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = "待機中"
+        self.result_ref = None   # 結果は共有ストアにハッシュで持つ
+        self.error = None
+        self.applied = False   # 結果をセッションへ反映済みか
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    def set_progress(self, progress: float, message: str = None):
+        self.progress = max(0.0, min(1.0, float(progress)))
+        if message:
+            self.message = message
+
+    @property
+    def result(self):
+        return get_result_store().get(self.result_ref)
+
+    @property
+    def elapsed_s(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+# =========================
+# 2) マネージャ（プロセス内で1つ）
+# =========================
+class JobManager:
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id: str, stage: str, label: str, fn, *args,
+               meta: dict = None, with_progress: bool = False, **kwargs) -> Job:
+        """
+        fn(*args, **kwargs) は各タブの _call_llm と同じく (data, err) を返す想定。
+        with_progress=True なら progress=Job.set_progress を渡す。
+        """
+        with self._lock:
+            self._gc_locked()
+            active = [j for j in self._jobs.values() if j.status in ACTIVE]
+            if len(active) >= MAX_PENDING:
+                raise QueueFull(f"サーバ全体の実行待ちが上限（{MAX_PENDING}件）です。しばらく待って再実行してください。")
+            if sum(1 for j in active if j.session_id == session_id) >= MAX_PER_SESSION:
+                raise QueueFull(f"このセッションの同時実行は{MAX_PER_SESSION}件までです。完了を待ってください。")
+            if stage in STAGE_LIMITS:
+                name, total, per_session = STAGE_LIMITS[stage]
+                same = [j for j in active if j.stage == stage]
+                if sum(1 for j in same if j.session_id == session_id) >= per_session:
+                    raise QueueFull(f"このセッションの{name}は同時に{per_session}件までです。完了を待ってください。")
+                if len(same) >= total:
+                    raise QueueFull(f"サーバ全体の{name}が上限（{total}件）です。しばらく待って再実行してください。")
+            job = Job(session_id, stage, label, meta)
+            self._jobs[job.id] = job
+        if with_progress:
+            kwargs["progress"] = job.set_progress
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job.status == "cancelled":
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        job.set_progress(0.1, "Groqに問い合わせ中…")
+        try:
+            data, err = fn(*args, **kwargs)
+            if err:
+                job.error = err
+            else:
+                job.result_ref = get_result_store().put(data)
+                job.status = "done"
+                job.set_progress(1.0, "完了")
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            if job.error:
+                job.status = "error"
+                job.message = job.error.splitlines()[0][:120]   # 一覧には要約だけ（全文は st.error）
+            job.finished_at = time.time()
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.status != "queued":
+            return False
+        if job.future is None or job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return True
+        return False
+
+    def get(self, job_id: str) -> Job:
+        return self._jobs.get(job_id)
+
+    def for_session(self, session_id: str, stage: str = None) -> list:
+        with self._lock:
+            jobs = [j for j in self._jobs.values()
+                    if j.session_id == session_id and (stage is None or j.stage == stage)]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {s: sum(1 for j in jobs if j.status == s) for s in STATUS_LABELS}
+
+    def _gc_locked(self):
+        cutoff = time.time() - JOB_TTL_S
+        for jid in [jid for jid, j in self._jobs.items()
+                    if j.status not in ACTIVE and (j.finished_at or j.created_at) < cutoff]:
+            get_result_store().release(self._jobs.pop(jid).result_ref)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager()
+    return _manager
+
+# =========================
+# 3) Streamlit 側ヘルパ
+# =========================
+def submit_job(stage: str, label: str, fn, *args, meta: dict = None, **kwargs):
+    """ボタンから呼ぶ。投入できれば Job、バックプレッシャで拒否されたら st.warning して None。"""
+    try:
+        job = get_manager().submit(session_id(), stage, label, fn, *args, meta=meta, **kwargs)
+    except QueueFull as e:
+        st.warning(str(e))
+        return None
+    st.toast(f"ジョブを投入しました：{label}")
+    return job
+
+def _render_jobs(stage: str, on_done):
+    mgr = get_manager()
+    jobs = mgr.for_session(session_id(), stage)
+    if not jobs:
+        return
+
+    # 完了したジョブの結果を一度だけセッションへ反映
+    newly_applied = False
+    for j in sorted(jobs, key=lambda j: j.finished_at or 0):
+        if j.status == "done" and not j.applied:
+            on_done(j)
+            j.applied = True
+            newly_applied = True
+
+    st.markdown("##### 🧵 実行ジョブ")
+    for j in jobs:
+        c1, c2, c3 = st.columns([5, 3, 2])
+        with c1:
+            st.markdown(f"**{j.label}**  \n{STATUS_LABELS.get(j.status, j.status)}　{j.message}　（{j.elapsed_s:.1f}s）")
+        with c2:
+            st.progress(j.progress)
+        with c3:
+            if j.status == "queued":
+                if st.button("取消", key=f"job_cancel_{j.id}", use_container_width=True):
+                    mgr.cancel(j.id)
+            elif j.status == "done":
+                if st.button("この結果を表示", key=f"job_show_{j.id}", use_container_width=True):
+                    on_done(j)
+                    st.rerun()
+        if j.status == "error":
+            st.error(j.error)
+
+    # 他タブにも結果を反映させるため、新規完了時はアプリ全体を再実行
+    if newly_applied:
+        st.rerun()
+
+_render_jobs_live = st.fragment(run_every=1.0)(_render_jobs)
+_render_jobs_static = st.fragment(_render_jobs)
+
+def render_jobs_panel(stage: str, on_done):
+    """
+    このセッションのジョブ一覧。未完了がある間だけ1秒ごとにポーリングする（ページ全体は止めない）。
+    on_done(job) は完了ジョブの結果をセッションへ反映する関数。
+    """
+    active = any(j.status in ACTIVE for j in get_manager().for_session(session_id(), stage))
+    if active:
+        _render_jobs_live(stage, on_done)
+    else:
+        _render_jobs_static(stage, on_done)
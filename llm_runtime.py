@@ -0,0 +1,216 @@
+# llm_runtime.py
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from output_schema import response_format, validate
+from result_store import get_result_store
+from run_store import get_store, input_hash
+
+MAX_RETRIES = int(os.environ.get("CDP_LLM_MAX_RETRIES", "1"))  # 解析/スキーマ違反時の再試行回数
+RATE_LIMIT_RPM = float(os.environ.get("CDP_LLM_RPM", "30"))     # プロセス全体の毎分リクエスト上限（0=無制限）
+RATE_LIMIT_BURST = float(os.environ.get("CDP_LLM_BURST", "0"))  # 連続で出せる呼び出し数（0=10秒分）
+CACHE_MAX_ENTRIES = int(os.environ.get("CDP_CACHE_MAX", "256"))  # メモリ上の応答キャッシュ件数
+
+# =========================
+# 0) 共有レートリミッタ（全セッション・全ジョブで1つ）
+# =========================
+class RateLimiter:
+    """
+    トークンバケット。acquire() は枠が空くまでブロックする（ワーカースレッドから呼ぶ前提）。
+    """
+
+    def __init__(self, rpm: float, burst: float = 0):
+        self.rpm = rpm
+        self.capacity = max(1.0, burst or rpm / 6)  # 既定は10秒分までのバースト
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rpm <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rpm / 60.0)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * 60.0 / self.rpm
+            time.sleep(wait)
+
+    def eta_s(self, calls: int) -> float:
+        """バケットが満杯の状態から calls 回を出し切るまでの最短秒数（所要時間の目安表示用）。"""
+        if self.rpm <= 0:
+            return 0.0
+        return max(0.0, calls - self.capacity) * 60.0 / self.rpm
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_RPM, RATE_LIMIT_BURST)
+
+# =========================
+# 1) Groq 呼び出し（OpenAI互換・計測つき）
+# =========================
+def chat_complete(client, model: str, messages: list, temperature: float = 0.2, max_tokens: int = 1600,
+                  response_format: dict = None):
+    """
+    OpenAI互換クライアントで1回だけ呼び出し、(raw, meta) を返す。
+    meta には latency_ms / prompt_tokens / completion_tokens を入れる（履歴保存用）。
+    """
+    kwargs = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens)
+    if response_format:
+        kwargs["response_format"] = response_format
+
+    rate_limiter.acquire()
+    t0 = time.perf_counter()
+    # openai==1.51+ の chat_completions.create 互換 & 旧 .chat.completions.create 両対応
+    if hasattr(client, "chat_completions"):
+        resp = client.chat_completions.create(**kwargs)
+    else:
+        resp = client.chat.completions.create(**kwargs)
+    latency_ms = (time.perf_counter() - t0) * 1000.0
+    # 記録済み応答の再生時は、当時のレイテンシを採用する
+    latency_ms = getattr(resp, "recorded_latency_ms", None) or latency_ms
+
+    raw = resp.choices[0].message.content or ""
+    usage = getattr(resp, "usage", None)
+    meta = {
+        "latency_ms": latency_ms,
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+    }
+    return raw, meta
+
+# =========================
+# 2) 構造化出力つき呼び出し（JSONモード/スキーマモード + ローカル検証 + 再試行）
+# =========================
+class LLMOutputError(Exception):
+    """再試行しても解析/検証に通らなかった。最後の raw と計測値を持つ。"""
+
+    def __init__(self, message: str, raw: str, meta: dict):
+        super().__init__(message)
+        self.raw = raw
+        self.meta = meta
+
+
+# response_format を拒否された (model, mode) を覚えておき、以降は付けない
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+def _is_response_format_rejection(e: Exception) -> bool:
+    status = getattr(e, "status_code", None)
+    return status == 400 and "response_format" in str(e)
+
+def _merge_meta(total: dict, meta: dict):
+    for k, v in meta.items():
+        if v is not None:
+            total[k] = (total.get(k) or 0) + v
+
+def complete_json(client, model: str, system_prompt: str, payload: dict, *, parse, schema: dict = None,
+                  schema_name: str = "output", mode: str = None, temperature: float = 0.2,
+                  max_tokens: int = 1600, max_retries: int = MAX_RETRIES):
+    """
+    parse(raw) -> dict で解析し、schema があればローカル検証する。
+    失敗したら違反内容を添えて max_retries 回まで再生成を依頼する。
+    戻り値 (data, raw, meta)。meta はトークン/レイテンシを全試行で合算し attempts と last_*（最後の試行分）を含む。
+    最後まで解析できなければ LLMOutputError。スキーマ違反だけが残った場合は data を返す（従来互換）。
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
+    ]
+    fmt = response_format(schema, schema_name, mode) if schema else None
+
+    total = {"attempts": 0}
+    data, raw, last_err = None, "", None
+    for attempt in range(max_retries + 1):
+        use_fmt = fmt if fmt and (model, fmt["type"]) not in _unsupported else None
+        try:
+            raw, meta = chat_complete(client, model, messages, temperature=temperature,
+                                      max_tokens=max_tokens, response_format=use_fmt)
+        except Exception as e:
+            if use_fmt and _is_response_format_rejection(e):
+                # エンドポイント非対応 → 以降は付けずにプロンプト＋ローカル検証で運用
+                with _unsupported_lock:
+                    _unsupported.add((model, use_fmt["type"]))
+                raw, meta = chat_complete(client, model, messages, temperature=temperature, max_tokens=max_tokens)
+            else:
+                raise
+        _merge_meta(total, meta)
+        total["attempts"] += 1
+        # 最後の試行だけの値（記録の再生で「1回の呼び出し」として使う）
+        total.update({f"last_{k}": v for k, v in meta.items()})
+
+        t0 = time.perf_counter()
+        try:
+            data = parse(raw)
+            problems = validate(data, schema) if schema else []
+            last_err = None
+        except Exception as e:
+            data, problems, last_err = None, [], e
+        total["parse_ms"] = (total.get("parse_ms") or 0) + (time.perf_counter() - t0) * 1000.0
+
+        if data is not None and not problems:
+            return data, raw, total
+
+        # 再試行：直前の出力と問題点を伝えて修正版を求める
+        reason = f"JSON解析失敗: {last_err}" if last_err else "スキーマ違反: " + " / ".join(problems[:10])
+        messages = messages[:2] + [
+            {"role": "assistant", "content": raw[:4000]},
+            {"role": "user", "content": f"{reason}\n出力スキーマに厳密に従い、修正したJSONのみを返してください。"},
+        ]
+
+    if data is not None:
+        total["schema_errors"] = len(problems)
+        return data, raw, total
+    raise LLMOutputError(str(last_err), raw, total)
+
+# =========================
+# 3) 応答キャッシュ（メモリLRU → 実行履歴DB の順に参照）
+# =========================
+# 値は共有結果ストアのハッシュ（セッションと同じ実体を参照し、重複して持たない）
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0}
+
+def cache_get(stage: str, model: str, system_prompt: str, payload: dict):
+    """同一入力（ステージ/モデル/プロンプト/ペイロード）の成功結果があれば返す。"""
+    key = input_hash(stage, model, system_prompt, payload)
+    with _cache_lock:
+        ref = _cache.get(key)
+        if ref is not None:
+            _cache.move_to_end(key)
+    if ref is not None:
+        data = get_result_store().get(ref)
+        if data is not None:
+            cache_stats["hits"] += 1
+            return data
+    try:
+        run = get_store().latest_by_hash(key)
+    except Exception:
+        run = None
+    if run and run.get("parsed") is not None:
+        cache_put(stage, model, system_prompt, payload, run["parsed"])
+        cache_stats["hits"] += 1
+        return run["parsed"]
+    cache_stats["misses"] += 1
+    return None
+
+def cache_put(stage: str, model: str, system_prompt: str, payload: dict, data: dict):
+    key = input_hash(stage, model, system_prompt, payload)
+    store = get_result_store()
+    ref = store.put(data)
+    released = []
+    with _cache_lock:
+        if key in _cache:
+            released.append(_cache[key])
+        _cache[key] = ref
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            released.append(_cache.popitem(last=False)[1])
+    for r in released:
+        store.release(r)
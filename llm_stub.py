@@ -0,0 +1,142 @@
+# llm_stub.py
+import copy
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+# =========================
+# OpenAI互換のオフライン応答（ベンチ/評価/負荷試験用）
+# =========================
+class StubRejected(Exception):
+    """非対応の response_format を渡されたときの 400 相当。"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.status_code = 400
+
+
+class StubClient:
+    """
+    client.chat.completions.create(...) だけを持つ疑似クライアント。
+    responses={"tab1": {...}, ...} の中から、システムプロンプトに含まれるキー名が最も多いものを返す。
+
+    失敗の注入（合成値。実測は --live で取ること）:
+    - malformed_rate : response_format なしのとき構文崩れ（コードフェンス/末尾カンマ/前置き文/途中切れ）
+    - violation_rate : json_schema 以外のときスキーマ違反（必須キー欠落）
+    """
+
+    def __init__(self, responses: dict, latency_s: float = 0.8, jitter: float = 0.3,
+                 malformed_rate: float = 0.15, violation_rate: float = 0.1,
+                 supports=("json_object", "json_schema"), seed: int = None):
+        self.responses = responses
+        self.latency_s = latency_s
+        self.jitter = jitter
+        self.malformed_rate = malformed_rate
+        self.violation_rate = violation_rate
+        self.supports = set(supports)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _rand(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _route(self, system_prompt: str) -> str:
+        def score(body):
+            return sum(1 for k in body if f'"{k}"' in system_prompt)
+        return max(self.responses, key=lambda stage: score(self.responses[stage]))
+
+    def _body(self, stage: str, response_format: dict) -> str:
+        body = copy.deepcopy(self.responses[stage])
+        mode = (response_format or {}).get("type")
+        if mode != "json_schema" and body and self._rand() < self.violation_rate:
+            body.pop(next(iter(body)))
+        raw = json.dumps(body, ensure_ascii=False, indent=2)
+        if mode is None and self._rand() < self.malformed_rate:
+            kind = int(self._rand() * 4)
+            if kind == 0:
+                raw = f"```json\n{raw}\n```"
+            elif kind == 1:
+                raw = raw.replace("\n}", ",\n}", 1)
+            elif kind == 2:
+                raw = "以下が出力です。\n" + raw
+            else:
+                raw = raw[: len(raw) * 2 // 3]
+        return raw
+
+    def _create(self, model: str, messages: list, temperature: float = 0.2, max_tokens: int = 1600,
+                response_format: dict = None, **_):
+        if response_format and response_format.get("type") not in self.supports:
+            raise StubRejected(f"response_format '{response_format.get('type')}' is not supported by {model}")
+        with self._lock:
+            self.calls += 1
+
+        raw = self._body(self._route(messages[0]["content"]), response_format)
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        # 出力長に比例した生成時間 + ゆらぎ
+        time.sleep(max(0.0, self.latency_s * (0.5 + len(raw) / 4000) * (1 + self.jitter * (self._rand() - 0.5))))
+
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=raw))],
+            usage=SimpleNamespace(prompt_tokens=prompt_chars // 2, completion_tokens=len(raw) // 2),
+        )
+
+
+class RecordingMissing(Exception):
+    """再生用の記録が実行履歴DBに無い。"""
+
+
+class RecordedClient:
+    """
+    実行履歴DB（run_store）に保存済みの raw を入力ハッシュで引いて再生する。
+    stage_of={SYSTEM_PROMPT: "tab1", ...} でプロンプトからステージを決める。
+    再試行のメッセージは無視し、最初の入力に対する最新の記録を返す（失敗した記録も含む）。
+    """
+
+    def __init__(self, stage_of: dict, store=None):
+        from run_store import get_store
+        self.stage_of = stage_of
+        self.store = store or get_store()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: list, **_):
+        from run_store import input_hash
+        system = messages[0]["content"]
+        stage = self.stage_of.get(system)
+        payload = json.loads(messages[1]["content"])
+        run = self.store.latest_by_hash(input_hash(stage, model, system, payload), ok_only=False) if stage else None
+        if run is None or run.get("raw") is None:
+            raise RecordingMissing(f"{stage or '?'} / {model}: 記録がありません")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=run["raw"]))],
+            usage=SimpleNamespace(prompt_tokens=self._last(run, "prompt_tokens"),
+                                  completion_tokens=self._last(run, "completion_tokens")),
+            recorded_latency_ms=self._last(run, "latency_ms"),
+        )
+
+    @staticmethod
+    def _last(run: dict, key: str):
+        """raw を返した最後の試行の値。列追加前の記録は合計を試行回数で割って近似する。"""
+        if run.get(f"last_{key}") is not None:
+            return run[f"last_{key}"]
+        total = run.get(key)
+        if total is None:
+            return None
+        value = total / max(1, run.get("attempts") or 1)
+        return value if key == "latency_ms" else int(value)
+
+
+def stub_responses() -> dict:
+    """各タブの OUTPUT_SCHEMA から組み立てた、スキーマ合格の応答テンプレート。"""
+    from output_schema import example_instance
+    import tab1_usecase, tab2_gap, tab3_plan
+
+    return {
+        "tab1": example_instance(tab1_usecase.OUTPUT_SCHEMA, fill_min_items=True),
+        "tab2": example_instance(tab2_gap.OUTPUT_SCHEMA, fill_min_items=True),
+        "tab3": example_instance(tab3_plan.OUTPUT_SCHEMA, fill_min_items=True),
+    }
@@ -0,0 +1,167 @@
+# loadtest_api.py
+"""
+api_server の負荷試験（標準ライブラリの asyncio のみ）。
+
+  python loadtest_api.py --concurrency 300 --requests 3000                   # 同一プロセスで疑似応答サーバを起動して計測
+  python loadtest_api.py --url http://127.0.0.1:8600 --endpoint pipeline --stream
+
+--unique は「キャッシュに無い新しい入力」の割合（0 なら全リクエストが同じ入力 = キャッシュ/合流の効果を見る）。
+接続は仮想ユーザーごとに keep-alive で使い回す（ストリーミング時は毎回接続）。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+from uc_seed import UC_DATA
+
+
+# =========================
+# 1) 最小の HTTP/1.1 クライアント
+# =========================
+async def _read_response(reader) -> tuple:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+    if headers.get("transfer-encoding") == "chunked":
+        body = b""
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).strip(), 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            body += chunk[:-2]
+    else:
+        body = await reader.readexactly(int(headers.get("content-length") or 0))
+    return status, headers, body
+
+def _request(method: str, path: str, host: str, body: dict = None, stream: bool = False) -> bytes:
+    data = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else b""
+    headers = [f"{method} {path} HTTP/1.1", f"Host: {host}", f"Content-Length: {len(data)}",
+               "Content-Type: application/json"]
+    if stream:
+        headers.append("Accept: application/x-ndjson")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + data
+
+# =========================
+# 2) 入力の生成
+# =========================
+def _body(endpoint: str, unique: bool, samples: dict, rng: random.Random) -> dict:
+    uc = rng.choice(list(UC_DATA))
+    seed = UC_DATA[uc]
+    salt = f" #{rng.getrandbits(48):x}" if unique else ""
+    if endpoint in ("tab1", "pipeline"):
+        return {"usecase": uc, "background": seed["background"] + salt}
+    if endpoint == "tab2":
+        return {"usecase": uc, "tab1_output": samples["tab1"], "goal": "3日以内に面的検知したい" + salt}
+    return {"usecase": uc, "tab1_output": samples["tab1"], "tab2_output": {**samples["tab2"], "goal": salt or "-"}}
+
+# =========================
+# 3) 計測
+# =========================
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else float("nan")
+
+async def run_load(url: str, endpoint: str, n_requests: int, concurrency: int, unique: float,
+                   stream: bool = False, seed: int = 0) -> dict:
+    from llm_stub import stub_responses
+    samples = stub_responses()
+    u = urlsplit(url)
+    host, port = u.hostname, u.port or 80
+    path = f"/v1/{endpoint}"
+    rng = random.Random(seed)
+    bodies = [_body(endpoint, rng.random() < unique, samples, rng) for _ in range(n_requests)]
+    queue = asyncio.Queue()
+    for b in bodies:
+        queue.put_nowait(b)
+
+    latencies, statuses = [], {}
+
+    async def user():
+        reader = writer = None
+        while not queue.empty():
+            body = queue.get_nowait()
+            t0 = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                writer.write(_request("POST", path, host, body, stream))
+                await writer.drain()
+                status, headers, data = await _read_response(reader)
+                if stream:
+                    events = [json.loads(l) for l in data.splitlines() if l.strip()]
+                    if not events or events[-1].get("event") != "done":
+                        status = (events[-1].get("status") if events else None) or 599
+                if headers.get("connection") == "close":
+                    writer.close()
+                    reader = writer = None
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                status = type(e).__name__
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+            latencies.append((time.perf_counter() - t0) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+        if writer is not None:
+            writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(_request("GET", "/healthz", host))
+    await writer.drain()
+    _, _, health = await _read_response(reader)
+    writer.close()
+    await writer.wait_closed()
+
+    return {
+        "requests": n_requests, "concurrency": concurrency, "wall_s": round(wall, 2),
+        "rps": round(n_requests / wall, 1), "status": statuses,
+        "p50_ms": round(_percentile(latencies, 0.50), 1), "p95_ms": round(_percentile(latencies, 0.95), 1),
+        "p99_ms": round(_percentile(latencies, 0.99), 1), "max_ms": round(max(latencies), 1),
+        "server": json.loads(health),
+    }
+
+# =========================
+# 4) CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default=None, help="既存サーバの URL（省略時は疑似応答サーバを同一プロセスで起動）")
+    ap.add_argument("--stub-latency", type=float, default=0.8, help="疑似応答の基準レイテンシ(s)")
+    ap.add_argument("--workers", type=int, default=None, help="同一プロセス起動時の API ワーカースレッド数")
+    ap.add_argument("--endpoint", default="tab1", choices=["tab1", "tab2", "tab3", "pipeline"])
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=300)
+    ap.add_argument("--unique", type=float, default=0.5, help="新規入力の割合（0..1）")
+    ap.add_argument("--stream", action="store_true", help="NDJSON ストリーミングで受け取る")
+    args = ap.parse_args()
+
+    async def run():
+        server = None
+        url = args.url
+        if not url:
+            import api_server
+            client = api_server.make_stub_client(args.stub_latency)
+            kwargs = {"workers": args.workers} if args.workers else {}
+            server, _ = await api_server.serve(client, "127.0.0.1", 0, **kwargs)
+            url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        try:
+            return await run_load(url, args.endpoint, args.requests, args.concurrency, args.unique, args.stream)
+        finally:
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+                await asyncio.sleep(0.1)   # 切断済み接続のハンドラが終わるのを待つ
+
+    print(json.dumps(asyncio.run(run()), ensure_ascii=False, indent=1))
+
+
+if __name__ == "__main__":
+    main()
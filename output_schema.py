@@ -0,0 +1,124 @@
+# output_schema.py
+import json
+import os
+
+# =========================
+# 0) 設定
+# =========================
+# off         : response_format を付けない（従来どおりプロンプト＋ゆるJSON救済）
+# json_object : JSONモード（構文だけ保証。スキーマは下のローカル検証で担保）
+# json_schema : スキーマモード（制約付きデコード。対応モデルのみ）
+STRUCTURED_OUTPUT = os.environ.get("CDP_STRUCTURED_OUTPUT", "json_object")
+MODES = ("off", "json_object", "json_schema")
+
+# =========================
+# 1) スキーマ → プロンプト用テンプレート
+# =========================
+def example_instance(schema: dict, fill_min_items: bool = False):
+    """
+    スキーマの examples / enum / description からテンプレートJSONを組み立てる。
+    fill_min_items=True なら minItems を満たすまで要素を複製する（スタブ応答用）。
+    """
+    t = schema.get("type")
+    if isinstance(t, list):
+        t = t[0]
+    if t == "object":
+        return {k: example_instance(v, fill_min_items) for k, v in (schema.get("properties") or {}).items()}
+    if t == "array":
+        if "examples" in schema:
+            items = list(schema["examples"][0])
+        else:
+            items = [example_instance(schema.get("items") or {}, fill_min_items)]
+        if fill_min_items and items:
+            while len(items) < schema.get("minItems", 0):
+                items.append(items[len(items) % len(items)])
+        return items
+    if "examples" in schema:
+        return schema["examples"][0]
+    if "enum" in schema:
+        # 選択肢は「A|B|C」で提示（出力時はどれか1つ）
+        return schema["enum"][0] if fill_min_items else "|".join(map(str, schema["enum"]))
+    if t in ("number", "integer"):
+        return 0
+    return schema.get("description", "")
+
+def _dumps_compact(v, indent: int = 0) -> str:
+    # スカラー配列は1行にまとめる（プロンプトのトークン節約）
+    pad = "  " * indent
+    if isinstance(v, dict):
+        if not v:
+            return "{}"
+        body = ",\n".join(f'{pad}  {json.dumps(k, ensure_ascii=False)}: {_dumps_compact(x, indent + 1)}'
+                          for k, x in v.items())
+        return "{\n" + body + "\n" + pad + "}"
+    if isinstance(v, list):
+        if all(not isinstance(x, (dict, list)) for x in v):
+            return "[" + ",".join(json.dumps(x, ensure_ascii=False) for x in v) + "]"
+        body = ",\n".join(f"{pad}  {_dumps_compact(x, indent + 1)}" for x in v)
+        return "[\n" + body + "\n" + pad + "]"
+    return json.dumps(v, ensure_ascii=False)
+
+def schema_prompt(schema: dict) -> str:
+    """SYSTEM_PROMPT に埋め込むスキーマ節（JSONテンプレート）。"""
+    return _dumps_compact(example_instance(schema))
+
+# =========================
+# 2) response_format（エンドポイントへ渡す形）
+# =========================
+def _strip_annotations(schema):
+    # examples/description はデコード制約には不要なので送らない（トークン節約）
+    if isinstance(schema, dict):
+        return {k: _strip_annotations(v) for k, v in schema.items() if k not in ("examples", "description")}
+    if isinstance(schema, list):
+        return [_strip_annotations(v) for v in schema]
+    return schema
+
+def response_format(schema: dict, name: str, mode: str = None):
+    mode = mode or STRUCTURED_OUTPUT
+    if mode == "json_schema":
+        return {"type": "json_schema",
+                "json_schema": {"name": name, "schema": _strip_annotations(schema), "strict": False}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+# =========================
+# 3) ローカル検証（制約付きデコードが無い場合の担保）
+# =========================
+_TYPES = {
+    "object": dict, "array": list, "string": str, "boolean": bool,
+    "number": (int, float), "integer": int, "null": type(None),
+}
+
+def _type_ok(value, t) -> bool:
+    if isinstance(t, list):
+        return any(_type_ok(value, x) for x in t)
+    if t in ("number", "integer") and isinstance(value, bool):
+        return False
+    return isinstance(value, _TYPES.get(t, object))
+
+def validate(data, schema: dict, path: str = "$") -> list:
+    """
+    必要最小限の JSON Schema 検証（type/required/properties/items/enum/minItems）。
+    違反のリスト（空なら合格）を返す。
+    """
+    errs = []
+    t = schema.get("type")
+    if t and not _type_ok(data, t):
+        return [f"{path}: 型が{t}ではありません"]
+    if "enum" in schema and data not in schema["enum"]:
+        errs.append(f"{path}: {schema['enum']} のいずれかが必要です（{data!r}）")
+    if isinstance(data, dict):
+        for k in schema.get("required", []):
+            if k not in data or data[k] in (None, "", [], {}):
+                errs.append(f"{path}.{k}: 必須項目が空です")
+        for k, sub in (schema.get("properties") or {}).items():
+            if data.get(k) not in (None, "", [], {}):
+                errs.extend(validate(data[k], sub, f"{path}.{k}"))
+    if isinstance(data, list):
+        if len(data) < schema.get("minItems", 0):
+            errs.append(f"{path}: {schema['minItems']}件以上必要です（{len(data)}件）")
+        if "items" in schema:
+            for i, item in enumerate(data):
+                errs.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errs
@@ -0,0 +1,290 @@
+# prompt_eval.py
+"""
+SYSTEM_PROMPT のバリアント別に、シードカタログ × モデルで各タブを評価するハーネス。
+解析成功率・スキーマ適合率・ルール遵守スコア・トークン・p50/p95 レイテンシを出し、保存済みベースラインとの差分を表示する。
+
+  python prompt_eval.py --stub                                   # オフライン（疑似応答。配線確認用）
+  python prompt_eval.py --live --models llama-3.1-8b-instant,llama-3.3-70b-versatile --record
+  python prompt_eval.py --recorded                               # --record 済みの応答を再生（トークン消費なし）
+  python prompt_eval.py --live --save-baseline                   # 現在の結果をベースラインとして保存
+
+バリアントは prompt_variants.VARIANTS と --variants-dir の「<tab>.<name>.txt」。
+入力（フィクスチャ）は初回に --fixtures へ保存し、以降は同じものを使う（--recorded の再生キーを安定させるため）。
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import tab1_usecase
+import tab2_gap
+import tab3_plan
+import llm_runtime
+from llm_runtime import complete_json, LLMOutputError
+from llm_stub import StubClient, RecordedClient, RecordingMissing, stub_responses
+from prompt_variants import load_variants
+from run_store import DB_PATH, get_store, record_run
+from tab4_sweep import parse_yen
+from uc_seed import UC_DATA
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# 生成物は実行履歴DBの隣（.gitignore 済み）へ
+EVAL_DIR = os.environ.get("CDP_EVAL_DIR", os.path.join(os.path.dirname(DB_PATH), "eval_data"))
+DEFAULT_BASELINE = os.path.join(EVAL_DIR, "prompt_eval_baseline.json")
+DEFAULT_FIXTURES = os.path.join(EVAL_DIR, "prompt_eval_fixtures.json")
+
+# タブ名 → (OUTPUT_SCHEMA, parse, max_tokens)
+TABS = {
+    "tab1": (tab1_usecase.OUTPUT_SCHEMA, tab1_usecase._parse_tab1, 1600),
+    "tab2": (tab2_gap.OUTPUT_SCHEMA, tab2_gap._safe_parse_json, 2000),
+    "tab3": (tab3_plan.OUTPUT_SCHEMA, tab3_plan._safe_parse_json, 2200),
+}
+
+# =========================
+# 1) ルール遵守チェック（各プロンプトの「制約/ルール」節に対応）
+# =========================
+SATELLITES = ["Sentinel-1", "Sentinel-2", "Landsat-8", "Landsat-9", "MODIS", "VIIRS",
+              "ALOS-2", "PlanetScope", "WorldView-3", "SMAP"]
+_NON_SATELLITE = re.compile(r"UAV|HAPS|ドローン|IoT|行政DB", re.IGNORECASE)
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+def _n_numbers(text) -> int:
+    return len(_NUMBER.findall(str(text or "")))
+
+def _rules_tab1(d: dict) -> dict:
+    suite = d.get("sensor_suite") or []
+    cap = d.get("capability_summary") or {}
+    lines = (cap.get("can") or []) + (cap.get("cannot") or [])
+    return {
+        "sensor_suite>=3": len(suite) >= 3,
+        "can>=5": len(cap.get("can") or []) >= 5,
+        "cannot>=5": len(cap.get("cannot") or []) >= 5,
+        "各行に数値2つ以上": bool(lines) and all(_n_numbers(s) >= 2 for s in lines),
+        "実衛星のみ": bool(suite) and all(any(n in str(s.get("name", "")) for n in SATELLITES) for s in suite),
+        "非衛星なし": not _NON_SATELLITE.search(json.dumps(suite, ensure_ascii=False)),
+    }
+
+def _rules_tab2(d: dict) -> dict:
+    dims = d.get("dimensions") or []
+    fields = list((d.get("to_be_requirements") or {}).values())
+    fields += [x.get(k) for x in dims for k in ("current", "target", "reason")]
+    return {
+        "4軸すべて": set(tab2_gap.AXES) <= {x.get("axis") for x in dims},
+        "各フィールドに数値": bool(fields) and all(_n_numbers(f) >= 1 for f in fields if isinstance(f, str)),
+        "gapが大/中/小": bool(dims) and all(x.get("gap") in ("大", "中", "小") for x in dims),
+        "非衛星を提案しない": not any(_NON_SATELLITE.search(str(x.get("mitigation", ""))) for x in dims),
+    }
+
+def _rules_tab3(d: dict) -> dict:
+    required = tab3_plan.OUTPUT_SCHEMA["required"]
+    return {
+        "「例:」なし": not re.search(r"例[:：]", json.dumps(d, ensure_ascii=False)),
+        "全項目が埋まっている": all(d.get(k) for k in required),
+        "gap_closuresが4軸": set(tab3_plan.AXES) <= {x.get("axis") for x in d.get("gap_closures") or []},
+        "月額totalが読める": parse_yen((d.get("monthly_cost_estimate") or {}).get("total")) is not None,
+    }
+
+RULES = {"tab1": _rules_tab1, "tab2": _rules_tab2, "tab3": _rules_tab3}
+
+def rule_score(tab: str, data: dict) -> float:
+    checks = RULES[tab](data)
+    return sum(checks.values()) / len(checks)
+
+# =========================
+# 2) フィクスチャ（シードカタログ。Tab2/3 の入力は履歴の最新成功結果、無ければ疑似応答）
+# =========================
+def _latest_parsed(stage: str, usecase: str):
+    try:
+        runs = get_store().list_runs(stage=stage, usecase=usecase, limit=1)
+    except Exception:
+        return None
+    run = get_store().load_run(runs[0]["id"]) if runs else None
+    return run and run.get("parsed")
+
+def build_fixtures() -> dict:
+    """{"tab1": [(usecase, payload), ...], "tab2": [...], "tab3": [...]}"""
+    samples = stub_responses()
+    fx = {"tab1": [], "tab2": [], "tab3": []}
+    for uc, seed in UC_DATA.items():
+        fx["tab1"].append((uc, tab1_usecase.build_payload(uc, seed["background"], seed["question"], seed["issues"],
+                                                          aoi=seed.get("aoi"))))
+        t1 = _latest_parsed("tab1", uc) or samples["tab1"]
+        t2 = _latest_parsed("tab2", uc) or samples["tab2"]
+        fx["tab2"].append((uc, tab2_gap.build_payload(t1, tab2_gap.PURPOSE_HYPOTHESIS, aoi=seed.get("aoi"))))
+        fx["tab3"].append((uc, tab3_plan.build_payload(t1, t2)))
+    return fx
+
+def load_fixtures(path: str, rebuild: bool = False) -> dict:
+    if path and os.path.exists(path) and not rebuild:
+        with open(path, encoding="utf-8") as f:
+            return {tab: [tuple(x) for x in cases] for tab, cases in json.load(f).items()}
+    fx = build_fixtures()
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(fx, f, ensure_ascii=False, indent=1)
+    return fx
+
+# =========================
+# 3) 実行と集計
+# =========================
+def _run_case(client, model, tab, variant, prompt, usecase, payload, mode, record):
+    schema, parse, max_tokens = TABS[tab]
+    try:
+        data, raw, meta = complete_json(client, model, prompt, payload, parse=parse, schema=schema,
+                                        schema_name=f"{tab}_output", mode=mode, max_tokens=max_tokens,
+                                        max_retries=0)
+    except RecordingMissing:
+        return None
+    except LLMOutputError as e:
+        if record:
+            record_run(tab, model, prompt, payload, raw=e.raw, error=str(e), usecase=usecase, **e.meta)
+        return {"parsed": False, "schema_ok": False, "score": 0.0, **e.meta}
+    except Exception as e:
+        # 429・タイムアウト等。評価全体は止めず、この1件を「API失敗」として別に数える
+        error = f"{type(e).__name__}: {e}"
+        if record:
+            record_run(tab, model, prompt, payload, error=error, usecase=usecase)
+        return {"parsed": False, "schema_ok": False, "score": 0.0, "error": error}
+    if record:
+        record_run(tab, model, prompt, payload, raw=raw, parsed=data, usecase=usecase, **meta)
+    return {"parsed": True, "schema_ok": not meta.get("schema_errors"), "score": rule_score(tab, data), **meta}
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def _aggregate(results: list) -> dict:
+    lat = [r.get("latency_ms") or 0 for r in results]
+    return {
+        "n": len(results),
+        "解析成功率": sum(r["parsed"] for r in results) / len(results),
+        "スキーマ適合率": sum(r["schema_ok"] for r in results) / len(results),
+        "ルール遵守": statistics.mean(r["score"] for r in results),
+        "prompt tokens": statistics.mean(r.get("prompt_tokens") or 0 for r in results),
+        "completion tokens": statistics.mean(r.get("completion_tokens") or 0 for r in results),
+        "p50(ms)": _percentile(lat, 0.50),
+        "p95(ms)": _percentile(lat, 0.95),
+    }
+
+def evaluate(client, models: list, variants: dict, fixtures: dict, concurrency: int = 4,
+             mode: str = None, record: bool = False) -> pd.DataFrame:
+    cases = [(tab, name, prompt, model, uc, payload)
+             for tab, named in variants.items()
+             for name, prompt in named.items()
+             for model in models
+             for uc, payload in fixtures.get(tab, [])]
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="prompt-eval") as pool:
+        results = list(pool.map(
+            lambda c: _run_case(client, c[3], c[0], c[1], c[2], c[4], c[5], mode, record), cases))
+
+    groups = {}
+    for (tab, name, _, model, _, _), r in zip(cases, results):
+        groups.setdefault((tab, name, model), []).append(r)
+    rows = []
+    for (tab, name, model), rs in groups.items():
+        # 未収録（再生用の記録なし）と API失敗 は解析成功率などの分母に入れない
+        done = [r for r in rs if r is not None and not r.get("error")]
+        failed = [r for r in rs if r is not None and r.get("error")]
+        row = {"tab": tab, "variant": name, "model": model, "未収録": sum(r is None for r in rs),
+               "API失敗": len(failed)}
+        if done:
+            row.update(_aggregate(done))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+# =========================
+# 4) ベースライン比較
+# =========================
+KEY = ["tab", "variant", "model"]
+METRICS = ["解析成功率", "スキーマ適合率", "ルール遵守", "prompt tokens", "completion tokens", "p50(ms)", "p95(ms)"]
+
+def save_baseline(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(df.to_dict(orient="records"), f, ensure_ascii=False, indent=1)
+
+def diff_baseline(df: pd.DataFrame, path: str) -> pd.DataFrame:
+    """今回の値と「Δ指標」（今回 − ベースライン）を並べる。ベースラインに無い行は Δ が空。"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        base = pd.DataFrame(json.load(f))
+    if base.empty:
+        return None
+    metrics = [m for m in METRICS if m in df and m in base]
+    merged = df.merge(base[KEY + metrics], on=KEY, how="left", suffixes=("", " (base)"))
+    for m in metrics:
+        merged[f"Δ{m}"] = merged[m] - merged[f"{m} (base)"]
+    return merged[KEY + [c for m in metrics for c in (m, f"Δ{m}")]]
+
+# =========================
+# 5) CLI
+# =========================
+def _stage_of(variants: dict) -> dict:
+    return {prompt: tab for tab, named in variants.items() for prompt in named.values()}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--stub", action="store_true", help="オフラインの疑似応答で実行（既定）")
+    src.add_argument("--live", action="store_true", help="Groq 実エンドポイントで実行")
+    src.add_argument("--recorded", action="store_true", help="実行履歴DBに記録済みの応答を再生")
+    ap.add_argument("--models", default="llama-3.1-8b-instant", help="カンマ区切り")
+    ap.add_argument("--tabs", default=",".join(TABS), help="カンマ区切り")
+    ap.add_argument("--variants", default="", help="評価するバリアント名（カンマ区切り。既定は全て）")
+    ap.add_argument("--variants-dir", default=os.path.join(HERE, "prompt_variants"))
+    ap.add_argument("--mode", default=None, help="構造化出力モード（既定は CDP_STRUCTURED_OUTPUT）")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    ap.add_argument("--rebuild-fixtures", action="store_true")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存")
+    ap.add_argument("--record", action="store_true", help="--live の応答を実行履歴DBへ記録（--recorded で再生可能に）")
+    ap.add_argument("--out", default=None, help="結果CSVの出力先")
+    ap.add_argument("--stub-latency", type=float, default=0.05, help="--stub 時の基準レイテンシ(s)")
+    args = ap.parse_args()
+
+    tabs = [t.strip() for t in args.tabs.split(",") if t.strip() in TABS]
+    names = {n.strip() for n in args.variants.split(",") if n.strip()}
+    variants = {tab: {n: p for n, p in named.items() if not names or n in names}
+                for tab, named in load_variants(args.variants_dir).items() if tab in tabs}
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+
+    if args.live:
+        from openai import OpenAI
+        client = OpenAI(base_url="https://api.groq.com/openai/v1", api_key=os.environ.get("GROQ_API_KEY", ""))
+    elif args.recorded:
+        client = RecordedClient(_stage_of(variants))
+        llm_runtime.rate_limiter.rpm = 0
+    else:
+        client = StubClient(stub_responses(), latency_s=args.stub_latency, seed=0)
+        llm_runtime.rate_limiter.rpm = 0  # 疑似応答ではレート制限不要
+
+    fixtures = load_fixtures(args.fixtures, rebuild=args.rebuild_fixtures)
+    df = evaluate(client, models, variants, fixtures, args.concurrency, mode=args.mode,
+                  record=args.record and args.live)
+    if args.record and args.live:
+        get_store().flush()
+
+    with pd.option_context("display.width", 240, "display.max_columns", 30):
+        print(df.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        diff = diff_baseline(df, args.baseline)
+        if diff is not None:
+            print(f"\n--- ベースライン差分（{os.path.basename(args.baseline)}）---")
+            print(diff.to_string(index=False, float_format=lambda v: f"{v:+.3f}"))
+    if args.out:
+        df.to_csv(args.out, index=False)
+    if args.save_baseline:
+        save_baseline(df, args.baseline)
+        print(f"\nベースラインを保存しました: {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# prompt_variants.py
+"""
+評価ハーネス（prompt_eval.py）で比較する SYSTEM_PROMPT の名前付きバリアント。
+"baseline" は各タブで実際に使っているプロンプト。追加は VARIANTS に足すか、
+--variants-dir に「<tab>.<name>.txt」（例: tab2.short.txt）を置く。
+"""
+import os
+
+import tab1_usecase
+import tab2_gap
+import tab3_plan
+from output_schema import schema_prompt
+
+# =========================
+# 1) 短縮版（ルールを箇条書きに圧縮。スキーマ節は同じ OUTPUT_SCHEMA から生成）
+# =========================
+TAB1_COMPACT = """
+衛星リモートセンシング専門家として、ユースケース入力に対する「衛星のみのセンサ構成」と「できること/できないこと」をJSONのみで返す。
+- 実衛星のみ：Sentinel-1, Sentinel-2, Landsat-8/9, Terra/Aqua MODIS, VIIRS, ALOS-2, PlanetScope, WorldView-3, SMAP。非衛星は禁止。
+- sensor_suite は3件以上。can / cannot は各5件以上、各行に数値を2つ以上（GSD/再訪/しきい値/スワス/雲量%）。
+- cannot は「原因＋回避策＋数値条件」。曖昧語・空欄・説明文・コードフェンスは禁止。
+- 入力の cloud_climatology（AOIの月別雲量%）があれば雲量の数値はそれを使う（reference_only=true なら参考値。調整可、「（目安）」を付ける）。
+# 出力スキーマ
+""" + schema_prompt(tab1_usecase.OUTPUT_SCHEMA) + "\n"
+
+TAB2_COMPACT = """
+GAP分析アナリストとして、Tab1の衛星構成とgoalから To-Be観測要件 を定め、As-Isとの GAP を4軸（観測頻度/空間分解能/観測範囲/コスト=月額円）で定量化しJSONのみで返す。
+- dimensions は4軸すべて。各フィールドに数値（m, 日, km, %, 円）を1つ以上。
+- 非衛星（UAV/HAPS/IoT 等）は提案しない。説明文・コードフェンス禁止。
+- 入力の optical_missing_estimate（光学欠測率%）があれば reliability と current/reason はその数値を使う（reference_only=true なら参考値。調整可、「（目安）」を付ける）。
+# 出力スキーマ
+""" + schema_prompt(tab2_gap.OUTPUT_SCHEMA) + "\n"
+
+TAB3_COMPACT = """
+アーキテクトとして、Tab1（衛星構成）とTab2（GAP分析）から、衛星＋UAV/HAPS＋地上補完＋融合設計の統合方針をJSONのみで返す。
+- スキーマの全項目を具体値で埋める。数値根拠（日, m, km, %, 円/月）を入れる。
+- 説明文・コードフェンス・「例:」の文字は出力禁止。
+# 出力スキーマ
+""" + schema_prompt(tab3_plan.OUTPUT_SCHEMA) + "\n"
+
+VARIANTS = {
+    "tab1": {"baseline": tab1_usecase.SYSTEM_PROMPT, "compact": TAB1_COMPACT},
+    "tab2": {"baseline": tab2_gap.SYSTEM_PROMPT, "compact": TAB2_COMPACT},
+    "tab3": {"baseline": tab3_plan.SYSTEM_PROMPT, "compact": TAB3_COMPACT},
+}
+
+# =========================
+# 2) ファイルからの追加
+# =========================
+def load_variants(variants_dir: str = None) -> dict:
+    variants = {tab: dict(v) for tab, v in VARIANTS.items()}
+    if variants_dir and os.path.isdir(variants_dir):
+        for fn in sorted(os.listdir(variants_dir)):
+            tab, _, rest = fn.partition(".")
+            name, ext = os.path.splitext(rest)
+            if tab in variants and name and ext == ".txt":
+                with open(os.path.join(variants_dir, fn), encoding="utf-8") as f:
+                    variants[tab][name] = f.read()
+    return variants
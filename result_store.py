@@ -0,0 +1,225 @@
+# result_store.py
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+import streamlit as st
+
+# =========================
+# 0) 設定
+# =========================
+DECODED_MAX = int(os.environ.get("CDP_RESULT_DECODED_MAX", "64"))   # 展開済みJSONを保持する件数
+SESSION_IDLE_S = int(os.environ.get("CDP_SESSION_IDLE_S", "1800"))  # これ以上操作が無いセッションは参照を解放
+EVICT_INTERVAL_S = 60
+
+# =========================
+# 1) 共有・参照カウント・圧縮ストア
+# =========================
+class ResultStore:
+    """
+    内容ハッシュ → zlib圧縮JSON。同じ結果は全セッションで1つだけ持つ。
+    - put() / acquire() で参照+1、release() で-1。0になったら破棄。
+    - get() は展開済みJSONを小さなLRUで共有し、呼び出しごとに別オブジェクトへ復元する。
+    """
+
+    def __init__(self, decoded_max: int = DECODED_MAX):
+        self._blobs = {}
+        self._refs = {}
+        self._raw_sizes = {}
+        self._decoded = OrderedDict()
+        self._decoded_max = decoded_max
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _encode(data):
+        raw = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()[:32], raw
+
+    def key_of(self, data) -> str:
+        return self._encode(data)[0]
+
+    def put(self, data) -> str:
+        h, raw = self._encode(data)
+        with self._lock:
+            if h not in self._blobs:
+                self._blobs[h] = zlib.compress(raw, 6)
+                self._raw_sizes[h] = len(raw)
+            self._refs[h] = self._refs.get(h, 0) + 1
+        return h
+
+    def acquire(self, h: str) -> bool:
+        with self._lock:
+            if h not in self._blobs:
+                return False
+            self._refs[h] += 1
+            return True
+
+    def release(self, h: str):
+        if not h:
+            return
+        with self._lock:
+            n = self._refs.get(h, 0) - 1
+            if n > 0:
+                self._refs[h] = n
+                return
+            self._refs.pop(h, None)
+            self._blobs.pop(h, None)
+            self._raw_sizes.pop(h, None)
+            self._decoded.pop(h, None)
+
+    def get(self, h: str):
+        """
+        毎回新しいオブジェクトを返す（呼び出し側が書き換えても他セッションの結果には影響しない）。
+        LRU には展開済みの JSON（バイト列）を持ち、zlib 展開だけを省く。
+        """
+        if not h:
+            return None
+        with self._lock:
+            raw = self._decoded.get(h)
+            if raw is not None:
+                self._decoded.move_to_end(h)
+            blob = self._blobs.get(h)
+        if raw is None:
+            if blob is None:
+                return None
+            raw = zlib.decompress(blob)
+            with self._lock:
+                if h in self._blobs:
+                    self._decoded[h] = raw
+                    while len(self._decoded) > self._decoded_max:
+                        self._decoded.popitem(last=False)
+        return json.loads(raw)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._blobs),
+                "refs": sum(self._refs.values()),
+                "compressed_bytes": sum(len(b) for b in self._blobs.values()),
+                "raw_bytes": sum(self._raw_sizes.values()),
+                "decoded_entries": len(self._decoded),
+            }
+
+
+_store = ResultStore()
+
+def get_result_store() -> ResultStore:
+    return _store
+
+# =========================
+# 2) セッション → ハッシュ参照（session_state にはハッシュだけを置く）
+# =========================
+_sessions = {}   # session_id -> {"refs": {name: hash}, "last_seen": ts}
+_sessions_lock = threading.Lock()
+_last_evict = 0.0
+
+def session_id() -> str:
+    """セッション識別子。リランをまたいで不変。"""
+    return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+def _session() -> dict:
+    sid = session_id()
+    now = time.time()
+    with _sessions_lock:
+        sess = _sessions.get(sid)
+        if sess is None:
+            sess = {"refs": {}, "last_seen": now}
+            _sessions[sid] = sess
+            # アイドル解放後に戻ってきた場合：他で生きている結果は取り戻す
+            lost = []
+            for name, h in (st.session_state.get("result_refs") or {}).items():
+                if _store.acquire(h):
+                    sess["refs"][name] = h
+                else:
+                    lost.append(name)
+            st.session_state["result_refs"] = dict(sess["refs"])
+            if lost:
+                st.session_state["session_evicted"] = True
+        sess["last_seen"] = now
+    return sess
+
+def get_session_result(name: str):
+    return _store.get(_session()["refs"].get(name))
+
+def set_session_result(name: str, data):
+    sess = _session()
+    old = sess["refs"].get(name)
+    if data is None:
+        new = None
+    else:
+        new = _store.key_of(data)
+        if new == old:
+            return
+        new = _store.put(data)
+    with _sessions_lock:
+        if new:
+            sess["refs"][name] = new
+        else:
+            sess["refs"].pop(name, None)
+    st.session_state.setdefault("result_refs", {})
+    if new:
+        st.session_state["result_refs"][name] = new
+    else:
+        st.session_state["result_refs"].pop(name, None)
+    _store.release(old)
+
+def evict_idle(idle_s: int = SESSION_IDLE_S) -> int:
+    """一定時間操作の無いセッションの参照を解放する。解放したセッション数を返す。"""
+    cutoff = time.time() - idle_s
+    with _sessions_lock:
+        idle = [sid for sid, s in _sessions.items() if s["last_seen"] < cutoff]
+        dropped = [_sessions.pop(sid) for sid in idle]
+    for sess in dropped:
+        for h in sess["refs"].values():
+            _store.release(h)
+    return len(dropped)
+
+def touch_session():
+    """各リランの先頭で呼ぶ。最終アクセスの更新と、定期的なアイドル解放。"""
+    global _last_evict
+    _session()
+    now = time.time()
+    if now - _last_evict > EVICT_INTERVAL_S:
+        _last_evict = now
+        evict_idle()
+
+# =========================
+# 3) メモリレポート
+# =========================
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ピーク値（Linux以外の代替）
+        except Exception:
+            return 0
+
+def memory_report() -> dict:
+    s = _store.stats()
+    with _sessions_lock:
+        n_sessions = len(_sessions)
+        n_session_refs = sum(len(x["refs"]) for x in _sessions.values())
+    return {
+        **s,
+        "sessions": n_sessions,
+        "session_refs": n_session_refs,
+        "compression_ratio": (s["raw_bytes"] / s["compressed_bytes"]) if s["compressed_bytes"] else 0.0,
+        "rss_bytes": _rss_bytes(),
+    }
+
+def render_memory_report():
+    with st.expander("🧠 メモリレポート", expanded=False):
+        r = memory_report()
+        st.caption(
+            f"プロセスRSS {r['rss_bytes'] / 2**20:,.1f} MiB ／ セッション {r['sessions']}（参照 {r['session_refs']}）\n\n"
+            f"共有結果 {r['entries']} 件・参照 {r['refs']} ／ 圧縮 {r['compressed_bytes'] / 1024:,.1f} KiB"
+            f"（元 {r['raw_bytes'] / 1024:,.1f} KiB, ×{r['compression_ratio']:.1f}）／ 展開済み {r['decoded_entries']} 件"
+        )
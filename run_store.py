@@ -0,0 +1,337 @@
+# run_store.py
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# 0) 設定
+# =========================
+DB_PATH = os.environ.get(
+    "CDP_RUN_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "runs.db")
+)
+
+STAGE_LABELS = {"tab1": "① ユースケース定義", "tab2": "② GAP分析", "tab3": "③ 構成方針"}
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS runs (
+    id                INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at        REAL    NOT NULL,
+    stage             TEXT    NOT NULL,
+    usecase           TEXT,
+    model             TEXT    NOT NULL,
+    input_hash        TEXT    NOT NULL,
+    payload_json      TEXT    NOT NULL,
+    raw               TEXT,
+    parsed_json       TEXT,
+    error             TEXT,
+    latency_ms        REAL,
+    parse_ms          REAL,
+    prompt_tokens     INTEGER,
+    completion_tokens INTEGER,
+    attempts          INTEGER,
+    schema_errors     INTEGER,
+    last_latency_ms        REAL,
+    last_prompt_tokens     INTEGER,
+    last_completion_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_runs_stage_created ON runs(stage, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_runs_usecase       ON runs(usecase, stage, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_runs_model         ON runs(model, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_runs_input_hash    ON runs(input_hash, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_runs_created       ON runs(created_at DESC);
+"""
+
+_COLUMNS = (
+    "created_at", "stage", "usecase", "model", "input_hash", "payload_json", "raw",
+    "parsed_json", "error", "latency_ms", "parse_ms", "prompt_tokens", "completion_tokens",
+    "attempts", "schema_errors", "last_latency_ms", "last_prompt_tokens", "last_completion_tokens",
+)
+
+# 既存DBへの列追加（CREATE TABLE IF NOT EXISTS では増えないため）
+_ADDED_COLUMNS = {"attempts": "INTEGER", "schema_errors": "INTEGER", "last_latency_ms": "REAL",
+                  "last_prompt_tokens": "INTEGER", "last_completion_tokens": "INTEGER"}
+
+# =========================
+# 1) 入力ハッシュ（同一入力の検索キー）
+# =========================
+def input_hash(stage: str, model: str, system_prompt: str, payload: dict) -> str:
+    """
+    ステージ・モデル・システムプロンプト・入力ペイロードから決定的なハッシュを作る。
+    プロンプトを変えたら別入力として扱う。
+    """
+    canon = json.dumps(
+        {"stage": stage, "model": model, "prompt": system_prompt, "payload": payload},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+# =========================
+# 2) ストア本体（WAL / 書き込みは専用スレッド）
+# =========================
+class RunStore:
+    """
+    SQLite(WAL) の実行履歴ストア。
+    - 書き込みはキューに積むだけ（描画スレッドを待たせない）。専用スレッドがまとめてコミット。
+    - 読み取りはスレッドごとの接続で行う（WALなので書き込みと並行可）。
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        with self._connect() as conn:
+            conn.executescript(_DDL)
+            have = {r["name"] for r in conn.execute("PRAGMA table_info(runs)")}
+            for col, typ in _ADDED_COLUMNS.items():
+                if col not in have:
+                    conn.execute(f"ALTER TABLE runs ADD COLUMN {col} {typ}")
+        self._writer = threading.Thread(target=self._writer_loop, name="run-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # ---- 書き込み ----
+    def record(self, row: dict):
+        self._queue.put(row)
+
+    def flush(self, timeout: float = 10.0):
+        """キュー済みの書き込みが全てコミットされるまで待つ（CLI/終了時用）。"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _writer_loop(self):
+        conn = self._connect()
+        sql = f"INSERT INTO runs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+        while True:
+            batch = [self._queue.get()]
+            # 溜まっている分はまとめて1トランザクションで
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [b for b in batch if isinstance(b, dict)]
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany(sql, [tuple(r.get(c) for c in _COLUMNS) for r in rows])
+                except Exception as e:
+                    logger.warning("実行履歴の書き込みに失敗しました（%d件）: %s", len(rows), e)
+            for b in batch:
+                if isinstance(b, threading.Event):
+                    b.set()
+
+    # ---- 読み取り ----
+    def list_runs(self, stage: str = None, usecase: str = None, model: str = None,
+                  ok_only: bool = True, limit: int = 50) -> list:
+        where, args = [], []
+        if stage:
+            where.append("stage = ?"); args.append(stage)
+        if usecase:
+            where.append("usecase = ?"); args.append(usecase)
+        if model:
+            where.append("model = ?"); args.append(model)
+        if ok_only:
+            where.append("error IS NULL")
+        sql = (
+            "SELECT id, created_at, stage, usecase, model, input_hash, latency_ms, "
+            "prompt_tokens, completion_tokens, attempts, error FROM runs"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + " ORDER BY created_at DESC LIMIT ?"
+        )
+        args.append(int(limit))
+        return [dict(r) for r in self._reader().execute(sql, args).fetchall()]
+
+    def iter_runs(self, stage: str = None, usecase: str = None, model: str = None, ok_only: bool = True,
+                  since: float = None, latest_only: bool = False, chunk_size: int = 200):
+        """
+        条件に合う実行を古い順に chunk_size 件ずつ（payload / parsed 展開済みの list[dict]）返すジェネレータ。
+        全件を一度に読まないので、件数が多いエクスポートでもメモリは chunk 分で済む。
+        latest_only=True なら同一入力（input_hash）の最新だけ（ok_only なら成功した中の最新）。
+        """
+        where, args = [], []
+        if stage:
+            where.append("stage = ?"); args.append(stage)
+        if usecase:
+            where.append("usecase = ?"); args.append(usecase)
+        if model:
+            where.append("model = ?"); args.append(model)
+        if ok_only:
+            where.append("error IS NULL")
+        if since:
+            where.append("created_at >= ?"); args.append(float(since))
+        if latest_only:
+            # ok_only なら「成功した中で最新」（最新が失敗でも、その入力の成功結果は残す）
+            where.append("id IN (SELECT MAX(id) FROM runs" + (" WHERE error IS NULL" if ok_only else "")
+                         + " GROUP BY input_hash)")
+        sql = (
+            "SELECT id, created_at, stage, usecase, model, input_hash, payload_json, parsed_json, error, "
+            "latency_ms, prompt_tokens, completion_tokens, attempts, schema_errors FROM runs"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + " ORDER BY created_at, id"
+        )
+        # 専用接続（読み取り中に同じスレッドの他クエリと干渉させない）
+        conn = self._connect()
+        try:
+            cur = conn.execute(sql, args)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                chunk = []
+                for r in rows:
+                    run = dict(r)
+                    run["payload"] = json.loads(run.pop("payload_json") or "null")
+                    run["parsed"] = json.loads(run.pop("parsed_json") or "null")
+                    chunk.append(run)
+                yield chunk
+        finally:
+            conn.close()
+
+    def load_run(self, run_id: int) -> dict:
+        r = self._reader().execute("SELECT * FROM runs WHERE id = ?", (int(run_id),)).fetchone()
+        if r is None:
+            return None
+        run = dict(r)
+        run["payload"] = json.loads(run.pop("payload_json") or "null")
+        run["parsed"] = json.loads(run.pop("parsed_json") or "null")
+        return run
+
+    def latest_by_hash(self, ihash: str, ok_only: bool = True) -> dict:
+        r = self._reader().execute(
+            "SELECT id FROM runs WHERE input_hash = ?" + (" AND error IS NULL" if ok_only else "")
+            + " ORDER BY created_at DESC LIMIT 1",
+            (ihash,),
+        ).fetchone()
+        return self.load_run(r["id"]) if r else None
+
+    def usecases(self) -> list:
+        rows = self._reader().execute(
+            "SELECT DISTINCT usecase FROM runs WHERE usecase IS NOT NULL ORDER BY usecase"
+        ).fetchall()
+        return [r["usecase"] for r in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> RunStore:
+    """プロセス内で1つだけ（全セッション共有）。"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RunStore()
+                atexit.register(_store.flush, 5.0)
+    return _store
+
+def use_store(path: str) -> RunStore:
+    """既定DBの代わりに path を使う（スタブでの負荷試験などで本番の履歴を汚さないため）。"""
+    global _store
+    with _store_lock:
+        _store = RunStore(path)
+        atexit.register(_store.flush, 5.0)
+    return _store
+
+# =========================
+# 3) 各タブからの記録API
+# =========================
+def record_run(stage: str, model: str, system_prompt: str, payload: dict, *, raw: str = None,
+               parsed: dict = None, error: str = None, usecase: str = None, latency_ms: float = None,
+               parse_ms: float = None, prompt_tokens: int = None, completion_tokens: int = None,
+               attempts: int = None, schema_errors: int = None, last_latency_ms: float = None,
+               last_prompt_tokens: int = None, last_completion_tokens: int = None):
+    """
+    1回分の呼び出し結果をキューに積む（即時リターン）。失敗しても画面側には影響させない。
+    latency_ms / *_tokens は全試行の合計、last_* は最後の試行（raw を返した呼び出し）の値。
+    """
+    try:
+        get_store().record({
+            "created_at": time.time(),
+            "stage": stage,
+            "usecase": usecase,
+            "model": model,
+            "input_hash": input_hash(stage, model, system_prompt, payload),
+            "payload_json": json.dumps(payload, ensure_ascii=False),
+            "raw": raw,
+            "parsed_json": json.dumps(parsed, ensure_ascii=False) if parsed is not None else None,
+            "error": error,
+            "latency_ms": latency_ms,
+            "parse_ms": parse_ms,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "attempts": attempts,
+            "schema_errors": schema_errors,
+            "last_latency_ms": last_latency_ms,
+            "last_prompt_tokens": last_prompt_tokens,
+            "last_completion_tokens": last_completion_tokens,
+        })
+    except Exception as e:
+        logger.warning("実行履歴の記録をスキップしました: %s", e)
+
+# =========================
+# 4) 履歴ブラウザ（各タブ共通UI）
+# =========================
+def _label(r: dict) -> str:
+    ts = datetime.datetime.fromtimestamp(r["created_at"]).strftime("%Y-%m-%d %H:%M")
+    lat = f"{r['latency_ms'] / 1000:.1f}s" if r.get("latency_ms") else "-"
+    return f"#{r['id']}  {ts}  {r.get('usecase') or '（UC不明）'}  /  {r['model']}  ({lat})"
+
+def render_history(stage: str, on_load, usecase: str = None):
+    """
+    過去の実行をインデックス経由で一覧し、選んだ結果を on_load(run) に渡す。
+    run は load_run() の戻り値（payload / parsed / usecase など）。
+    """
+    with st.expander(f"📚 過去の実行履歴（{STAGE_LABELS.get(stage, stage)}）", expanded=False):
+        c1, c2 = st.columns([3, 1])
+        with c1:
+            only_uc = st.checkbox(
+                "選択中のユースケースのみ", value=bool(usecase), disabled=not usecase,
+                key=f"hist_only_uc_{stage}",
+            )
+        with c2:
+            limit = st.number_input("件数", 10, 500, 50, step=10, key=f"hist_limit_{stage}")
+
+        try:
+            runs = get_store().list_runs(stage=stage, usecase=usecase if only_uc else None, limit=limit)
+        except Exception as e:
+            st.caption(f"履歴を読み込めませんでした: {e}")
+            return
+        if not runs:
+            st.caption("（保存済みの実行はありません）")
+            return
+
+        by_id = {r["id"]: r for r in runs}
+        run_id = st.selectbox("実行を選択", list(by_id.keys()), format_func=lambda i: _label(by_id[i]),
+                              key=f"hist_pick_{stage}")
+        if st.button("この結果を読み込む", key=f"hist_load_{stage}", use_container_width=True):
+            run = get_store().load_run(run_id)
+            if run and run.get("parsed"):
+                on_load(run)
+                st.rerun()  # 上流タブにも反映させるため全体を再描画
+            else:
+                st.error("結果が見つかりませんでした。")
@@ -3,6 +3,12 @@ import json
 import re
 import streamlit as st
 from uc_seed import UC_DATA
+from llm_runtime import complete_json, LLMOutputError, cache_get, cache_put
+from output_schema import schema_prompt
+from run_store import record_run, render_history
+from jobs import submit_job, render_jobs_panel
+from result_store import get_session_result, set_session_result
+import cloud_clim
 
 # ============================
 # 1) プロンプト（中身を必ず埋める・数値を入れる・実衛星限定）
@@ -22,35 +28,58 @@ SYSTEM_PROMPT = r"""
     - can の各行は「対象・指標・しきい値・解像度・再訪・条件（雲量/地目等）」を最低3要素含める。
     - cannot の各行は「制約の原因（雲・再訪・分光・教師）＋回避策（SAR/地上補完など）＋数値条件」を含める。
 - “高頻度・広域・高精度”等の**曖昧語禁止**。必ず数値で条件を入れる。
+- 入力に cloud_climatology（AOIの月別雲量%）がある場合、雲量・欠測に関する数値は**その値を使う**（推測値で置き換えない）。
+  ただし reference_only が true のときは合成モデルの参考値なので、一般的な気候の知見と食い違えば調整してよく、その数値には「（目安）」を付ける。
 
-# 出力スキーマ（固定）
-{
-  "sensor_suite": [
-    {
-      "name": "実衛星名",
-      "platform": "LEO|SSO|GEO",
-      "bands": ["VNIR","SWIR","TIR","C-SAR","L-SAR"],
-      "gsd_m": 10.0,
-      "revisit_days": 5.0,
-      "swath_km": 290.0,
-      "typical_products": ["NDVI","NDWI","LST"],
-      "constraints": ["雲被りに弱い"]
-    }
-  ],
-  "capability_summary": {
-    "can": [
-      "NDVIトレンドの週次監視（10 m, 5日再訪, 290 kmスワス）",
-      "干ばつ早期検知（NDVI偏差<-0.1を連続3日で警戒）",
-      "冠水面の面的把握（C-SAR, 10 m, 昼夜観測）"
-    ],
-    "cannot": [
-      "雲量>60%地域での連続監視（光学は欠測多発, 代替: SAR）",
-      "病害種別同定（分光分解能/教師データ不足）",
-      "日次LSTマップの安定取得（TIR再訪不足＋雲影響）"
-    ]
-  }
+"""
+
+# 出力スキーマ（機械可読。プロンプトの雛形・response_format・ローカル検証の全てをここから作る）
+OUTPUT_SCHEMA = {
+    "type": "object",
+    "required": ["sensor_suite", "capability_summary"],
+    "properties": {
+        "sensor_suite": {
+            "type": "array",
+            "minItems": 3,
+            "items": {
+                "type": "object",
+                "required": ["name", "platform", "bands", "gsd_m", "revisit_days", "swath_km"],
+                "properties": {
+                    "name": {"type": "string", "examples": ["実衛星名"]},
+                    "platform": {"type": "string", "enum": ["LEO", "SSO", "GEO"]},
+                    "bands": {"type": "array", "items": {"type": "string"},
+                              "examples": [["VNIR", "SWIR", "TIR", "C-SAR", "L-SAR"]]},
+                    "gsd_m": {"type": "number", "examples": [10.0]},
+                    "revisit_days": {"type": "number", "examples": [5.0]},
+                    "swath_km": {"type": "number", "examples": [290.0]},
+                    "typical_products": {"type": "array", "items": {"type": "string"},
+                                         "examples": [["NDVI", "NDWI", "LST"]]},
+                    "constraints": {"type": "array", "items": {"type": "string"},
+                                    "examples": [["雲被りに弱い"]]},
+                },
+            },
+        },
+        "capability_summary": {
+            "type": "object",
+            "required": ["can", "cannot"],
+            "properties": {
+                "can": {"type": "array", "minItems": 5, "items": {"type": "string"}, "examples": [[
+                    "NDVIトレンドの週次監視（10 m, 5日再訪, 290 kmスワス）",
+                    "干ばつ早期検知（NDVI偏差<-0.1を連続3日で警戒）",
+                    "冠水面の面的把握（C-SAR, 10 m, 昼夜観測）",
+                ]]},
+                "cannot": {"type": "array", "minItems": 5, "items": {"type": "string"}, "examples": [[
+                    "雲量>60%地域での連続監視（光学は欠測多発, 代替: SAR）",
+                    "病害種別同定（分光分解能/教師データ不足）",
+                    "日次LSTマップの安定取得（TIR再訪不足＋雲影響）",
+                ]]},
+            },
+        },
+    },
 }
 
+SYSTEM_PROMPT += "# 出力スキーマ（固定）\n" + schema_prompt(OUTPUT_SCHEMA) + r"""
+
 # ユースケース入力
 {usecase_json}
 """
@@ -129,29 +158,42 @@ def _normalize_tab1_dict(data: dict) -> dict:
 # ============================
 # 4) Groq 呼び出し（OpenAI互換クライアントで両系に対応）
 # ============================
-def _call_llm(client, model: str, payload: dict):
-    if client is None:
-        return None, "Groq APIキー未設定"
+def _parse_tab1(raw: str) -> dict:
+    parsed = _safe_parse_json(raw)
+    normalized = _normalize_tab1_dict(parsed)
+    return _apply_quick_facts_corrections(normalized)
 
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
-    ]
+def build_payload(usecase: str, background: str, question: str, issues: str, aoi=None) -> dict:
+    """Tab1 の入力ペイロード（画面とウォームアップで同じ形にしてキャッシュを共有する）。"""
+    payload = {"usecase": usecase, "context": {"background": background, "question": question, "issues": issues}}
+    facts = cloud_clim.estimate(aoi)
+    if facts:
+        payload["cloud_climatology"] = facts
+    return payload
 
-    # openai==1.51+ の chat_completions.create 互換 & 旧 .chat.completions.create 両対応
-    if hasattr(client, "chat_completions"):
-        resp = client.chat_completions.create(model=model, messages=messages, temperature=0.2, max_tokens=1600)
-    else:
-        resp = client.chat.completions.create(model=model, messages=messages, temperature=0.2, max_tokens=1600)
+def _call_llm(client, model: str, payload: dict, usecase: str = None, use_cache: bool = True):
+    # 同一入力の結果が既にあれば再利用（プロンプト/モデルが同じ場合のみ）
+    if use_cache:
+        cached = cache_get("tab1", model, SYSTEM_PROMPT, payload)
+        if cached is not None:
+            return cached, None
+    if client is None:
+        return None, "Groq APIキー未設定"
 
-    raw = resp.choices[0].message.content or ""
+    usecase = usecase or payload.get("usecase")
     try:
-        parsed = _safe_parse_json(raw)
-        normalized = _normalize_tab1_dict(parsed)
-        normalized = _apply_quick_facts_corrections(normalized)
-        return normalized, None
-    except Exception as e:
+        data, raw, meta = complete_json(client, model, SYSTEM_PROMPT, payload, parse=_parse_tab1,
+                                        schema=OUTPUT_SCHEMA, schema_name="tab1_sensor_suite", max_tokens=1600)
+    except LLMOutputError as e:
+        record_run("tab1", model, SYSTEM_PROMPT, payload, raw=e.raw, error=str(e), usecase=usecase, **e.meta)
         return None, str(e)
+    except Exception as e:
+        # 通信/API エラー（429・タイムアウト等）も履歴に残す
+        record_run("tab1", model, SYSTEM_PROMPT, payload, error=f"{type(e).__name__}: {e}", usecase=usecase)
+        return None, f"Groq API呼び出し失敗: {e}"
+    record_run("tab1", model, SYSTEM_PROMPT, payload, raw=raw, parsed=data, usecase=usecase, **meta)
+    cache_put("tab1", model, SYSTEM_PROMPT, payload, data)
+    return data, None
 
 # --- 追記: 既知センサのクイック補正（事実の下限ガード） ---
 def _apply_quick_facts_corrections(data: dict) -> dict:
@@ -252,7 +294,21 @@ def _render_tab1_readable(data: dict):
         st.json(data, expanded=False)
 
 # ============================
-# 6) エントリポイント（既存 app.py から呼ばれる）
+# 6) 履歴/ジョブからの反映
+# ============================
+def _load_from_history(run: dict):
+    set_session_result("tab1_json", run["parsed"])
+    st.session_state["tab1_usecase"] = run.get("usecase")
+    st.session_state["tab1_aoi"] = ((run.get("payload") or {}).get("cloud_climatology") or {}).get("bbox")
+
+def _apply_job(job):
+    set_session_result("tab1_json", job.result)
+    st.session_state["tab1_usecase"] = job.meta.get("usecase")
+    st.session_state["tab1_aoi"] = job.meta.get("aoi")
+    st.toast(f"Tab1 JSON を保存しました（{job.meta.get('usecase')}）。")
+
+# ============================
+# 7) エントリポイント（既存 app.py から呼ばれる）
 # ============================
 def render_tab(client, model):
     st.subheader("① ユースケース定義 → 衛星（のみ）センサ構成")
@@ -264,20 +320,41 @@ def render_tab(client, model):
         bg = st.text_area("背景", seed["background"])
         qn = st.text_area("顧客の問い", seed["question"])
         isu = st.text_area("現状の課題", seed["issues"])
+        aoi_text = st.text_input("AOI（西端経度, 南端緯度, 東端経度, 北端緯度）",
+                                 ", ".join(f"{v:g}" for v in seed.get("aoi") or ()),
+                                 help="雲量気候値から光学の欠測率を見積もり、プロンプトに数値で渡します。空欄なら使いません。")
+    try:
+        aoi = cloud_clim.parse_bbox(aoi_text) if aoi_text.strip() else None
+    except ValueError as e:
+        st.error(f"AOI：{e}")
+        aoi = None
 
     # 生成ボタン
     if st.button("衛星センサ構成を生成", type="primary", use_container_width=True):
-        payload = {"usecase": uc, "context": {"background": bg, "question": qn, "issues": isu}}
-        with st.spinner("Groqに問い合わせ中…"):
-            data, err = _call_llm(client, model, payload)
-        if err:
-            st.error(err)
+        payload = build_payload(uc, bg, qn, isu, aoi=aoi)
+        use_cache = st.session_state.get("use_cache", True)
+        cached = cache_get("tab1", model, SYSTEM_PROMPT, payload) if use_cache else None
+        if cached is not None:
+            # 事前計算済み（ウォームアップ/過去の実行）→ ジョブを介さず即時反映
+            set_session_result("tab1_json", cached)
+            st.session_state["tab1_usecase"] = uc
+            st.session_state["tab1_aoi"] = aoi
+            st.toast("キャッシュ済みの Tab1 JSON を読み込みました。")
         else:
-            st.session_state["tab1_json"] = data
-            st.success("Tab1 JSON を保存しました。")
-            #_render_tab1_readable(st.session_state["tab1_json"])
+            # ワーカーで実行（ページは固まらない。ユースケースを切り替えて複数投入も可）
+            submit_job("tab1", f"Tab1: {uc}", _call_llm, client, model, payload,
+                       use_cache=use_cache, meta={"usecase": uc, "aoi": aoi})
+
+    # 実行中/完了ジョブ（完了したら結果をセッションへ反映）
+    render_jobs_panel("tab1", _apply_job)
+
+    # 過去の実行（同僚の実行も含む）から読み込み
+    render_history("tab1", _load_from_history, usecase=uc)
 
     # セッションに前回結果があれば表示
-    if st.session_state.get("tab1_json"):
+    tab1_json = get_session_result("tab1_json")
+    if tab1_json:
         # ユーザーが生成ボタンを押さなくても、常に最新状態を見せる
-        _render_tab1_readable(st.session_state["tab1_json"])
+        _render_tab1_readable(tab1_json)
+    # AOI の雲量と、生成済みセンサ構成の光学欠測率（見積り）
+    cloud_clim.render_estimate(cloud_clim.estimate(aoi, (tab1_json or {}).get("sensor_suite")))
@@ -3,6 +3,12 @@ import json
 import re
 import streamlit as st
 import pandas as pd
+from llm_runtime import complete_json, LLMOutputError, cache_get, cache_put
+from output_schema import schema_prompt
+from run_store import record_run, render_history
+from jobs import submit_job, render_jobs_panel
+from result_store import get_session_result, set_session_result
+import cloud_clim
 
 # =========================
 # 0) 目的の仮説（初期値。編集可）
@@ -27,34 +33,56 @@ SYSTEM_PROMPT = r"""
 - 観測範囲（swath / 面積 / 雲量条件）
 - コスト（**月額の予算上限（円）**）
 
-# 出力スキーマ（固定）
-{
-  "goal": "入力goalを要約（1文）",
-  "to_be_requirements": {
-    "revisit_days": "数値 + 条件（例：<=3日, 雲量<40%）",
-    "gsd_m": "数値条件（例：<=10m）",
-    "coverage": "面積や流域など（例：対象流域全体, スワス>=250km）",
-    "reliability": "欠測率や雲量など（例：欠測率<20%）",
-    "cost": "月額の上限（例：<=500,000円/月）",
-    "indicators": ["使用指標（例：NDVI, NDWI, LST など）"]
-  },
-  "dimensions": [
-    {
-      "axis": "観測頻度|空間分解能|観測範囲|コスト",
-      "current": "As-Is（例：Sentinel-2:5日, 10m, 290km等）",
-      "target": "To-Be（例：<=3日, <=10m, 流域全体 等）",
-      "gap": "大|中|小",
-      "reason": "根拠（数値を含める）",
-      "risk": "影響（検知遅延, 欠測率, コスト超過 等）",
-      "mitigation": "軽減策（SAR併用, 合成, 複数衛星, 地上補完 等）"
-    }
-  ]
+"""
+
+# 出力スキーマ（機械可読。プロンプトの雛形・response_format・ローカル検証の全てをここから作る）
+AXES = ["観測頻度", "空間分解能", "観測範囲", "コスト"]
+OUTPUT_SCHEMA = {
+    "type": "object",
+    "required": ["goal", "to_be_requirements", "dimensions"],
+    "properties": {
+        "goal": {"type": "string", "description": "入力goalを要約（1文）"},
+        "to_be_requirements": {
+            "type": "object",
+            "required": ["revisit_days", "gsd_m", "coverage", "reliability", "cost"],
+            "properties": {
+                "revisit_days": {"type": "string", "description": "数値 + 条件（例：<=3日, 雲量<40%）"},
+                "gsd_m": {"type": "string", "description": "数値条件（例：<=10m）"},
+                "coverage": {"type": "string", "description": "面積や流域など（例：対象流域全体, スワス>=250km）"},
+                "reliability": {"type": "string", "description": "欠測率や雲量など（例：欠測率<20%）"},
+                "cost": {"type": "string", "description": "月額の上限（例：<=500,000円/月）"},
+                "indicators": {"type": "array", "items": {"type": "string"},
+                               "examples": [["使用指標（例：NDVI, NDWI, LST など）"]]},
+            },
+        },
+        "dimensions": {
+            "type": "array",
+            "minItems": 4,
+            "items": {
+                "type": "object",
+                "required": ["axis", "current", "target", "gap", "reason"],
+                "properties": {
+                    "axis": {"type": "string", "enum": AXES},
+                    "current": {"type": "string", "description": "As-Is（例：Sentinel-2:5日, 10m, 290km等）"},
+                    "target": {"type": "string", "description": "To-Be（例：<=3日, <=10m, 流域全体 等）"},
+                    "gap": {"type": "string", "enum": ["大", "中", "小"]},
+                    "reason": {"type": "string", "description": "根拠（数値を含める）"},
+                    "risk": {"type": "string", "description": "影響（検知遅延, 欠測率, コスト超過 等）"},
+                    "mitigation": {"type": "string", "description": "軽減策（SAR併用, 合成, 複数衛星, 地上補完 等）"},
+                },
+            },
+        },
+    },
 }
 
+SYSTEM_PROMPT += "# 出力スキーマ（固定）\n" + schema_prompt(OUTPUT_SCHEMA) + r"""
+
 # ルール
 - 各フィールドに**少なくとも1つ以上の数値**（m, 日, km, %, 円 など）を入れる。
 - dimensions は **4件すべて**（順不同可）。
 - 非衛星（UAV/HAPS/IoT/行政DBなど）はここでは提案しない（Tab3で扱う）。
+- 入力に optical_missing_estimate（AOIの雲量気候値からの光学欠測率%）がある場合、reliability と観測頻度/観測範囲の current・reason には**その数値をそのまま使う**。
+  ただし reference_only が true のときは合成モデルの参考値なので、確定値として書かず「（目安）」を付け、一般的な知見と食い違えば調整してよい。
 """
 
 # =========================
@@ -89,25 +117,36 @@ def _safe_parse_json(raw: str) -> dict:
 # =========================
 # 3) Groq 呼び出し（OpenAI互換）
 # =========================
-def _call_llm(client, model: str, payload: dict):
+def build_payload(tab1_json: dict, goal: str, aoi=None) -> dict:
+    """AOI があれば、Tab1 のセンサ構成と目的の検知窓（「N日以内」）から光学欠測率を見積もって添える。"""
+    payload = {"tab1_output": tab1_json, "goal": goal}
+    facts = cloud_clim.estimate(aoi, (tab1_json or {}).get("sensor_suite"), cloud_clim.window_days_from_goal(goal))
+    if facts:
+        payload["optical_missing_estimate"] = facts
+    return payload
+
+def _call_llm(client, model: str, payload: dict, usecase: str = None, use_cache: bool = True):
+    # 同一入力の結果が既にあれば再利用（プロンプト/モデルが同じ場合のみ）
+    if use_cache:
+        cached = cache_get("tab2", model, SYSTEM_PROMPT, payload)
+        if cached is not None:
+            return cached, None
     if client is None:
         return None, "Groq APIキー未設定"
 
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
-    ]
     try:
-        if hasattr(client, "chat_completions"):
-            resp = client.chat_completions.create(model=model, messages=messages, temperature=0.2, max_tokens=2000)
-        else:
-            resp = client.chat.completions.create(model=model, messages=messages, temperature=0.2, max_tokens=2000)
-        raw = resp.choices[0].message.content or ""
-        data = _safe_parse_json(raw)
-        return data, None
+        data, raw, meta = complete_json(client, model, SYSTEM_PROMPT, payload, parse=_safe_parse_json,
+                                        schema=OUTPUT_SCHEMA, schema_name="tab2_gap", max_tokens=2000)
+    except LLMOutputError as e:
+        record_run("tab2", model, SYSTEM_PROMPT, payload, raw=e.raw, error=str(e), usecase=usecase, **e.meta)
+        return None, f"JSON解析失敗: {e}\nRaw: {e.raw[:700]}..."
     except Exception as e:
-        err = f"JSON解析失敗: {e}"
-        return None, f"{err}\nRaw: {str(raw)[:700]}..." if 'raw' in locals() else err
+        # 通信/API エラー（429・タイムアウト等）も履歴に残す
+        record_run("tab2", model, SYSTEM_PROMPT, payload, error=f"{type(e).__name__}: {e}", usecase=usecase)
+        return None, f"Groq API呼び出し失敗: {e}"
+    record_run("tab2", model, SYSTEM_PROMPT, payload, raw=raw, parsed=data, usecase=usecase, **meta)
+    cache_put("tab2", model, SYSTEM_PROMPT, payload, data)
+    return data, None
 
 # =========================
 # 4) レンダリング（目的 → To-Be → GAP表）
@@ -149,30 +188,61 @@ def _render_gap_readable(data: dict):
         st.json(data, expanded=False)
 
 # =========================
-# 5) エントリポイント
+# 5) 履歴/ジョブからの反映
+# =========================
+def _load_from_history(run: dict):
+    # 入力ペイロードから上流（Tab1）と目的も復元する
+    payload = run.get("payload") or {}
+    if payload.get("tab1_output"):
+        set_session_result("tab1_json", payload["tab1_output"])
+    if payload.get("goal"):
+        set_session_result("tab2_goal", payload["goal"])
+    st.session_state["tab1_aoi"] = (payload.get("optical_missing_estimate") or {}).get("bbox")
+    st.session_state["tab1_usecase"] = run.get("usecase")
+    set_session_result("tab2_json", run["parsed"])
+
+def _apply_job(job):
+    set_session_result("tab2_json", job.result)
+    st.toast("Tab2 JSON を保存しました。")
+
+# =========================
+# 6) エントリポイント
 # =========================
 def render_tab(client, model, tab1_json):
     st.subheader("② GAP分析（目的→To-Be→差分）")
 
+    # 過去の実行から読み込み（上流タブの入力も一緒に復元）
+    render_history("tab2", _load_from_history, usecase=st.session_state.get("tab1_usecase"))
+
     if not tab1_json:
         st.info("まずは『① ユースケース定義』でセンサ構成を生成してください。")
         return
 
     # 目的：初期値（仮説）を編集可能に
     st.markdown("#### このユースケースで実現したいこと（目的）")
-    default_goal = st.session_state.get("tab2_goal", PURPOSE_HYPOTHESIS)
+    default_goal = get_session_result("tab2_goal") or PURPOSE_HYPOTHESIS
     goal = st.text_area("目的（編集可）", value=default_goal, height=80, help="To-Be観測要件の導出に使います。")
-    st.session_state["tab2_goal"] = goal
+    set_session_result("tab2_goal", goal)
+
+    aoi = st.session_state.get("tab1_aoi")
+    cloud_clim.render_estimate(cloud_clim.estimate(aoi, tab1_json.get("sensor_suite"),
+                                                   cloud_clim.window_days_from_goal(goal)),
+                               title="☁️ As-Is の光学欠測率（AOI の雲量気候値 × 目的の検知窓）")
 
     if st.button("GAP分析を実行", type="primary", use_container_width=True):
-        payload = {"tab1_output": tab1_json, "goal": goal}
-        with st.spinner("Groqに問い合わせ中…"):
-            data, err = _call_llm(client, model, payload)
-        if err:
-            st.error(err)
+        payload = build_payload(tab1_json, goal, aoi=aoi)
+        uc = st.session_state.get("tab1_usecase")
+        use_cache = st.session_state.get("use_cache", True)
+        cached = cache_get("tab2", model, SYSTEM_PROMPT, payload) if use_cache else None
+        if cached is not None:
+            set_session_result("tab2_json", cached)
+            st.toast("キャッシュ済みの Tab2 JSON を読み込みました。")
         else:
-            st.session_state["tab2_json"] = data
-            st.success("Tab2 JSON を保存しました。")
+            submit_job("tab2", f"Tab2: {uc or '（UC不明）'}", _call_llm, client, model, payload,
+                       usecase=uc, use_cache=use_cache, meta={"usecase": uc})
+
+    render_jobs_panel("tab2", _apply_job)
 
-    if st.session_state.get("tab2_json"):
-        _render_gap_readable(st.session_state["tab2_json"])
+    tab2_json = get_session_result("tab2_json")
+    if tab2_json:
+        _render_gap_readable(tab2_json)
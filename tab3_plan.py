@@ -3,6 +3,11 @@ import json
 import re
 import streamlit as st
 import pandas as pd
+from llm_runtime import complete_json, LLMOutputError, cache_get, cache_put
+from output_schema import schema_prompt
+from run_store import record_run, render_history
+from jobs import submit_job, render_jobs_panel
+from result_store import get_session_result, set_session_result
 
 # =========================
 # 1) SYSTEM PROMPT：JSONのみ / 理由（rationale）つき統合案
@@ -13,81 +18,144 @@ SYSTEM_PROMPT = r"""
 **統合方針（衛星 + UAV/HAPS + 地上補完 + 融合設計）**を設計し、**JSONのみ**で出力してください。
 説明文・前置き・コードフェンスは禁止。「例:」「サンプル」等の語も出力禁止。
 
-# 出力スキーマ（固定）
-{
-  "rationale": {
-    "overview": "全体方針（例: 雲被りをSAR/HAPSで補完しTo-Beの再訪<=3日・欠測率<20%を達成）",
-    "satellite_choice": "衛星構成の理由（再訪/分解能/スワス/コストの数値根拠）",
-    "aerial_choice": "UAV/HAPS採用の理由（曇天時補完・高分解能検証・日量カバー等）",
-    "ground_choice": "地上観測の理由（QA/QC・バイアス補正・閾値設定の根拠）",
-    "fusion_design_choice": "融合処理をこう設計する理由（NDVI/LST統合・欠測補間等）",
-    "cost_strategy": "月額上限内に収める戦略（商用衛星は必要時タスク等）",
-    "risk_policy": "主要リスクと方針（雲/風/許認可→フォールバック等）"
-  },
-  "constellation": [
-    {
-      "name": "実衛星名（例: Sentinel-2, Sentinel-1, VIIRS, ALOS-2, WorldView-3 等）",
-      "type": "光学|SAR|熱|マイクロ波",
-      "band": "VNIR/SWIR|C-SAR|L-SAR|TIR など",
-      "gsd_m": 10,
-      "revisit_days": 5,
-      "role": "役割（例: 植生/土壌水分/冠水/LST/夜間観測 等）",
-      "why": "採用理由（数値含む）"
-    }
-  ],
-  "aerial_layer": [
-    {
-      "name": "UAV|HAPS",
-      "platform": "例: quadcopter|fixed-wing|Zephyr 等",
-      "altitude_m": 20000,
-      "endurance_h": 24,
-      "gsd_cm": 30,
-      "coverage_km2_per_day": 200,
-      "role": "衛星の欠測補完/高分解能検証 等",
-      "why": "採用理由（欠測率/天候/再訪の数値根拠）"
-    }
-  ],
-  "ground_layer": [
-    {
-      "name": "地上補完",
-      "sensors": ["雨量計","土壌水分センサ","気温/湿度ロガー"],
-      "sampling": "地点数/頻度（例: 50点, 10分間隔）",
-      "role": "衛星/航空の較正・検証（QA/QC）",
-      "why": "閾値/誤差許容の数値根拠"
-    }
-  ],
-  "fusion_design": {
-    "data_flow": ["衛星→クラウド→解析→ダッシュボード","UAV→地上局→クラウド"],
-    "processing": ["NDVI/NDWI/LST計算","SAR干渉/後方散乱変化","欠測補間（合成・時空間）"],
-    "quality": ["地上観測とのバイアス補正","雲/影/異常値のフラグ付け"]
-  },
-  "gap_closures": [
-    {
-      "axis": "観測頻度|空間分解能|観測範囲|コスト",
-      "gap_level": "大|中|小",
-      "approach": "採る対策（例: SAR併用/複数衛星合成/HAPSスポット/UAV臨時）",
-      "effect": "期待改善（数値: 日, m, km, % など）"
-    }
-  ],
-  "monthly_cost_estimate": {
-    "satellite": "例：0〜20万円/月",
-    "aerial": "例：スポット出動 30〜80万円/月",
-    "ground": "例：機器レンタル + 通信 5〜15万円/月",
-    "cloud_processing": "例：5〜15万円/月",
-    "total": "例：〜120万円/月"
-  },
-  "risks_and_mitigations": [
-    {"risk": "雲量>60%で光学欠測", "mitigation": "SAR/夜間観測/合成"},
-    {"risk": "UAV運航制限（風/許認可）", "mitigation": "HAPS/衛星合成へフォールバック"}
-  ],
-  "phased_roadmap": [
-    {"phase": "P0", "months": "0-1", "scope": "PoC準備：パイプライン雛形/データ接続/地上設置"},
-    {"phase": "P1", "months": "2-4", "scope": "対象地域で試行：指標算出・欠測補間・QA/QC"},
-    {"phase": "P2", "months": "5-8", "scope": "HAPS/UAVスポット運用・商用衛星の必要時タスク"},
-    {"phase": "GA", "months": "9+", "scope": "運用化：月額上限内での最適運用/運航計画の自動化"}
-  ]
+"""
+
+# 出力スキーマ（機械可読。プロンプトの雛形・response_format・ローカル検証の全てをここから作る）
+def _str(desc: str) -> dict:
+    return {"type": "string", "description": desc}
+
+def _num(example) -> dict:
+    return {"type": "number", "examples": [example]}
+
+def _str_list(example: list) -> dict:
+    return {"type": "array", "items": {"type": "string"}, "examples": [example]}
+
+AXES = ["観測頻度", "空間分解能", "観測範囲", "コスト"]
+OUTPUT_SCHEMA = {
+    "type": "object",
+    "required": ["rationale", "constellation", "aerial_layer", "ground_layer", "fusion_design",
+                 "gap_closures", "monthly_cost_estimate", "risks_and_mitigations", "phased_roadmap"],
+    "properties": {
+        "rationale": {
+            "type": "object",
+            "required": ["overview", "satellite_choice", "cost_strategy"],
+            "properties": {
+                "overview": _str("全体方針（例: 雲被りをSAR/HAPSで補完しTo-Beの再訪<=3日・欠測率<20%を達成）"),
+                "satellite_choice": _str("衛星構成の理由（再訪/分解能/スワス/コストの数値根拠）"),
+                "aerial_choice": _str("UAV/HAPS採用の理由（曇天時補完・高分解能検証・日量カバー等）"),
+                "ground_choice": _str("地上観測の理由（QA/QC・バイアス補正・閾値設定の根拠）"),
+                "fusion_design_choice": _str("融合処理をこう設計する理由（NDVI/LST統合・欠測補間等）"),
+                "cost_strategy": _str("月額上限内に収める戦略（商用衛星は必要時タスク等）"),
+                "risk_policy": _str("主要リスクと方針（雲/風/許認可→フォールバック等）"),
+            },
+        },
+        "constellation": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["name", "type", "role"],
+                "properties": {
+                    "name": _str("実衛星名（例: Sentinel-2, Sentinel-1, VIIRS, ALOS-2, WorldView-3 等）"),
+                    "type": {"type": "string", "enum": ["光学", "SAR", "熱", "マイクロ波"]},
+                    "band": _str("VNIR/SWIR|C-SAR|L-SAR|TIR など"),
+                    "gsd_m": _num(10),
+                    "revisit_days": _num(5),
+                    "role": _str("役割（例: 植生/土壌水分/冠水/LST/夜間観測 等）"),
+                    "why": _str("採用理由（数値含む）"),
+                },
+            },
+        },
+        "aerial_layer": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name", "role"],
+                "properties": {
+                    "name": {"type": "string", "enum": ["UAV", "HAPS"]},
+                    "platform": _str("例: quadcopter|fixed-wing|Zephyr 等"),
+                    "altitude_m": _num(20000),
+                    "endurance_h": _num(24),
+                    "gsd_cm": _num(30),
+                    "coverage_km2_per_day": _num(200),
+                    "role": _str("衛星の欠測補完/高分解能検証 等"),
+                    "why": _str("採用理由（欠測率/天候/再訪の数値根拠）"),
+                },
+            },
+        },
+        "ground_layer": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name", "role"],
+                "properties": {
+                    "name": {"type": "string", "examples": ["地上補完"]},
+                    "sensors": _str_list(["雨量計", "土壌水分センサ", "気温/湿度ロガー"]),
+                    "sampling": _str("地点数/頻度（例: 50点, 10分間隔）"),
+                    "role": _str("衛星/航空の較正・検証（QA/QC）"),
+                    "why": _str("閾値/誤差許容の数値根拠"),
+                },
+            },
+        },
+        "fusion_design": {
+            "type": "object",
+            "properties": {
+                "data_flow": _str_list(["衛星→クラウド→解析→ダッシュボード", "UAV→地上局→クラウド"]),
+                "processing": _str_list(["NDVI/NDWI/LST計算", "SAR干渉/後方散乱変化", "欠測補間（合成・時空間）"]),
+                "quality": _str_list(["地上観測とのバイアス補正", "雲/影/異常値のフラグ付け"]),
+            },
+        },
+        "gap_closures": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["axis", "approach"],
+                "properties": {
+                    "axis": {"type": "string", "enum": AXES},
+                    "gap_level": {"type": "string", "enum": ["大", "中", "小"]},
+                    "approach": _str("採る対策（例: SAR併用/複数衛星合成/HAPSスポット/UAV臨時）"),
+                    "effect": _str("期待改善（数値: 日, m, km, % など）"),
+                },
+            },
+        },
+        "monthly_cost_estimate": {
+            "type": "object",
+            "required": ["total"],
+            "properties": {
+                "satellite": _str("例：0〜20万円/月"),
+                "aerial": _str("例：スポット出動 30〜80万円/月"),
+                "ground": _str("例：機器レンタル + 通信 5〜15万円/月"),
+                "cloud_processing": _str("例：5〜15万円/月"),
+                "total": _str("例：〜120万円/月"),
+            },
+        },
+        "risks_and_mitigations": {
+            "type": "array",
+            "items": {"type": "object", "required": ["risk", "mitigation"],
+                      "properties": {"risk": {"type": "string"}, "mitigation": {"type": "string"}}},
+            "examples": [[
+                {"risk": "雲量>60%で光学欠測", "mitigation": "SAR/夜間観測/合成"},
+                {"risk": "UAV運航制限（風/許認可）", "mitigation": "HAPS/衛星合成へフォールバック"},
+            ]],
+        },
+        "phased_roadmap": {
+            "type": "array",
+            "items": {"type": "object", "required": ["phase", "scope"],
+                      "properties": {"phase": {"type": "string"}, "months": {"type": "string"},
+                                     "scope": {"type": "string"}}},
+            "examples": [[
+                {"phase": "P0", "months": "0-1", "scope": "PoC準備：パイプライン雛形/データ接続/地上設置"},
+                {"phase": "P1", "months": "2-4", "scope": "対象地域で試行：指標算出・欠測補間・QA/QC"},
+                {"phase": "P2", "months": "5-8", "scope": "HAPS/UAVスポット運用・商用衛星の必要時タスク"},
+                {"phase": "GA", "months": "9+", "scope": "運用化：月額上限内での最適運用/運航計画の自動化"},
+            ]],
+        },
+    },
 }
 
+SYSTEM_PROMPT += "# 出力スキーマ（固定）\n" + schema_prompt(OUTPUT_SCHEMA) + r"""
+
 # 厳格ルール
 - 上記スキーマをテンプレートとして**具体的な値で埋めたJSONのみ**を返す。
 - コメント/説明文/コードフェンス/「例:」という文字は**出力禁止**。
@@ -125,25 +193,31 @@ def _safe_parse_json(raw: str) -> dict:
 # =========================
 # 3) Groq 呼び出し（OpenAI互換）
 # =========================
-def _call_llm(client, model: str, payload: dict):
+def build_payload(tab1_json: dict, tab2_json: dict) -> dict:
+    return {"tab1_output": tab1_json, "tab2_output": tab2_json}
+
+def _call_llm(client, model: str, payload: dict, usecase: str = None, use_cache: bool = True):
+    # 同一入力の結果が既にあれば再利用（プロンプト/モデルが同じ場合のみ）
+    if use_cache:
+        cached = cache_get("tab3", model, SYSTEM_PROMPT, payload)
+        if cached is not None:
+            return cached, None
     if client is None:
         return None, "Groq APIキー未設定"
 
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
-    ]
     try:
-        if hasattr(client, "chat_completions"):
-            resp = client.chat_completions.create(model=model, messages=messages, temperature=0.2, max_tokens=2200)
-        else:
-            resp = client.chat.completions.create(model=model, messages=messages, temperature=0.2, max_tokens=2200)
-        raw = resp.choices[0].message.content or ""
-        data = _safe_parse_json(raw)
-        return data, None
+        data, raw, meta = complete_json(client, model, SYSTEM_PROMPT, payload, parse=_safe_parse_json,
+                                        schema=OUTPUT_SCHEMA, schema_name="tab3_plan", max_tokens=2200)
+    except LLMOutputError as e:
+        record_run("tab3", model, SYSTEM_PROMPT, payload, raw=e.raw, error=str(e), usecase=usecase, **e.meta)
+        return None, f"JSON解析失敗: {e}\nRaw: {e.raw[:700]}..."
     except Exception as e:
-        err = f"JSON解析失敗: {e}"
-        return None, f"{err}\nRaw: {str(raw)[:700]}..." if 'raw' in locals() else err
+        # 通信/API エラー（429・タイムアウト等）も履歴に残す
+        record_run("tab3", model, SYSTEM_PROMPT, payload, error=f"{type(e).__name__}: {e}", usecase=usecase)
+        return None, f"Groq API呼び出し失敗: {e}"
+    record_run("tab3", model, SYSTEM_PROMPT, payload, raw=raw, parsed=data, usecase=usecase, **meta)
+    cache_put("tab3", model, SYSTEM_PROMPT, payload, data)
+    return data, None
 
 # =========================
 # 4) レンダリング（理由→構成→補完策→コスト→リスク→ロードマップ）
@@ -273,24 +347,49 @@ def _render_plan_readable(data: dict):
         st.json(data, expanded=False)
 
 # =========================
-# 5) エントリポイント
+# 5) 履歴/ジョブからの反映
+# =========================
+def _load_from_history(run: dict):
+    # 入力ペイロードから上流（Tab1/Tab2）も復元する
+    payload = run.get("payload") or {}
+    if payload.get("tab1_output"):
+        set_session_result("tab1_json", payload["tab1_output"])
+    if payload.get("tab2_output"):
+        set_session_result("tab2_json", payload["tab2_output"])
+    st.session_state["tab1_usecase"] = run.get("usecase")
+    set_session_result("tab3_json", run["parsed"])
+
+def _apply_job(job):
+    set_session_result("tab3_json", job.result)
+    st.toast("Tab3 JSON を保存しました。")
+
+# =========================
+# 6) エントリポイント
 # =========================
 def render_tab(client, model, tab1_json, tab2_json):
     st.subheader("③ 構成方針提示（統合案）")
 
+    # 過去の実行から読み込み（上流タブの入力も一緒に復元）
+    render_history("tab3", _load_from_history, usecase=st.session_state.get("tab1_usecase"))
+
     if not tab1_json or not tab2_json:
         st.info("まずは『① ユースケース定義』『② GAP分析』を実行してください。")
         return
 
     if st.button("構成方針を生成", type="primary", use_container_width=True):
-        payload = {"tab1_output": tab1_json, "tab2_output": tab2_json}
-        with st.spinner("Groqに問い合わせ中…"):
-            data, err = _call_llm(client, model, payload)
-        if err:
-            st.error(err)
+        payload = build_payload(tab1_json, tab2_json)
+        uc = st.session_state.get("tab1_usecase")
+        use_cache = st.session_state.get("use_cache", True)
+        cached = cache_get("tab3", model, SYSTEM_PROMPT, payload) if use_cache else None
+        if cached is not None:
+            set_session_result("tab3_json", cached)
+            st.toast("キャッシュ済みの Tab3 JSON を読み込みました。")
         else:
-            st.session_state["tab3_json"] = data
-            st.success("Tab3 JSON を保存しました。")
+            submit_job("tab3", f"Tab3: {uc or '（UC不明）'}", _call_llm, client, model, payload,
+                       usecase=uc, use_cache=use_cache, meta={"usecase": uc})
+
+    render_jobs_panel("tab3", _apply_job)
 
-    if st.session_state.get("tab3_json"):
-        _render_plan_readable(st.session_state["tab3_json"])
+    tab3_json = get_session_result("tab3_json")
+    if tab3_json:
+        _render_plan_readable(tab3_json)
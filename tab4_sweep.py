@@ -0,0 +1,254 @@
+# tab4_sweep.py
+import itertools
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit as st
+import pandas as pd
+
+import tab2_gap
+import tab3_plan
+from jobs import submit_job, render_jobs_panel
+from llm_runtime import rate_limiter
+from result_store import get_session_result, set_session_result
+
+SWEEP_WORKERS = int(os.environ.get("CDP_SWEEP_WORKERS", "8"))     # 全スイープ合計の同時実行セル数
+SWEEP_MAX_CELLS = int(os.environ.get("CDP_SWEEP_MAX_CELLS", "36"))
+
+# =========================
+# 0) 目的テンプレート（Tab2 の目的仮説をパラメータ化）
+# =========================
+GOAL_TEMPLATE = (
+    "干ばつ・低温などの気象ストレスを圃場レベル（~{gsd_m}m）で{revisit_days}日以内に面的検知し、"
+    "欠測率を{missing_pct}%未満に抑えたうえで、月額{budget_yen}円以内で保険金仮査定を7日以内に自動化したい。"
+)
+
+PARAMS = {
+    # key: (表示名, 既定レンジ)
+    "revisit_days": ("再訪（日）", "3, 5, 7"),
+    "gsd_m": ("GSD（m）", "3, 10, 30"),
+    "missing_pct": ("欠測率上限（%）", "20"),
+    "budget_yen": ("月額予算（円）", "500000, 1000000"),
+}
+
+GAP_ORDER = {"小": 1, "中": 2, "大": 3}
+
+# =========================
+# 1) 入力の解釈
+# =========================
+def _parse_values(text: str) -> list:
+    vals = []
+    for tok in re.split(r"[,\s、]+", text or ""):
+        tok = tok.replace("_", "").strip()
+        if not tok:
+            continue
+        v = float(tok)
+        vals.append(int(v) if v.is_integer() else v)
+    return list(dict.fromkeys(vals))  # 順序を保って重複除去
+
+def _format_goal(template: str, cell: dict) -> str:
+    return template.format(
+        revisit_days=cell["revisit_days"],
+        gsd_m=cell["gsd_m"],
+        missing_pct=cell["missing_pct"],
+        budget_yen=f"{cell['budget_yen']:,}",
+    )
+
+def build_grid(ranges: dict) -> list:
+    keys = list(PARAMS)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(ranges[k] for k in keys))]
+
+# =========================
+# 2) 結果の要約（GAP等級 / 月額コスト）
+# =========================
+_AMOUNT = re.compile(r"([¥￥]\s*)?(\d[\d,]*(?:\.\d+)?)\s*(億|万|千)?\s*(円)?")
+_UNIT = {"億": 1e8, "万": 1e4, "千": 1e3, None: 1.0}
+_RANGE_SEP = re.compile(r"\s*[〜~～\-–]\s*")
+
+def parse_yen(text) -> float:
+    """
+    「〜120万円/月」「80〜120万円」「1,200,000円」「¥800,000〜¥1,200,000」などから円額を取り出す。
+    最初の「円」「¥」付きの金額（範囲なら上限側）を使う。後ろに続く年額・累計などの金額は見ない。
+    円も¥も無ければ最初の数値を使う。
+    """
+    if isinstance(text, (int, float)):
+        return float(text)
+    text = str(text or "")
+    matches = list(_AMOUNT.finditer(text))
+    if not matches:
+        return None
+    i = next((j for j, m in enumerate(matches) if m.group(1) or m.group(4)), 0)
+    # 「¥80万〜¥120万」のように範囲の下限側に通貨記号があるときは上限側まで進める
+    while i + 1 < len(matches) and _RANGE_SEP.fullmatch(text[matches[i].end():matches[i + 1].start()]):
+        i += 1
+    m = matches[i]
+    return float(m.group(2).replace(",", "")) * _UNIT[m.group(3)]
+
+def _summarize(tab2: dict, tab3: dict) -> dict:
+    grades = {d.get("axis", ""): d.get("gap", "") for d in (tab2 or {}).get("dimensions", []) or []}
+    worst = max(grades.values(), key=lambda g: GAP_ORDER.get(g, 0), default="")
+    cost = ((tab3 or {}).get("monthly_cost_estimate") or {}).get("total")
+    return {
+        **{f"GAP:{axis}": grades.get(axis, "") for axis in tab2_gap.AXES},
+        "最大GAP": worst,
+        "月額見積": cost or "",
+        "月額(円)": parse_yen(cost),
+    }
+
+# =========================
+# 3) スイープ実行（セル単位で Tab2→Tab3 を並列。レート制限/キャッシュは各 _call_llm 側で共有）
+# =========================
+# セルは全ジョブ共有のプールで回す（同時スイープがあっても合計 SWEEP_WORKERS まで）
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=SWEEP_WORKERS, thread_name_prefix="sweep")
+    return _pool
+
+def run_sweep(client, model: str, tab1_json: dict, grid: list, template: str,
+              usecase: str = None, use_cache: bool = True, progress=None, aoi=None):
+    def cell_task(cell):
+        try:
+            payload2 = tab2_gap.build_payload(tab1_json, _format_goal(template, cell), aoi=aoi)
+            tab2, err = tab2_gap._call_llm(client, model, payload2, usecase=usecase, use_cache=use_cache)
+            if err:
+                return {**cell, "エラー": f"Tab2: {err[:200]}"}
+            payload3 = tab3_plan.build_payload(tab1_json, tab2)
+            tab3, err = tab3_plan._call_llm(client, model, payload3, usecase=usecase, use_cache=use_cache)
+            if err:
+                return {**cell, **_summarize(tab2, None), "エラー": f"Tab3: {err[:200]}"}
+            return {**cell, **_summarize(tab2, tab3), "エラー": ""}
+        except Exception as e:
+            # 1セルの失敗でスイープ全体を落とさない
+            return {**cell, "エラー": f"{type(e).__name__}: {str(e)[:200]}"}
+
+    rows = []
+    futures = [_get_pool().submit(cell_task, cell) for cell in grid]
+    for fut in as_completed(futures):
+        rows.append(fut.result())
+        if progress:
+            progress(len(rows) / len(grid), f"{len(rows)}/{len(grid)} セル完了")
+    keys = list(PARAMS)
+    rows.sort(key=lambda r: tuple(r[k] for k in keys))
+    return {"params": keys, "rows": rows, "usecase": usecase, "template": template}, None
+
+# =========================
+# 4) レンダリング（感度マトリクス）
+# =========================
+def _render_matrix(result: dict):
+    df = pd.DataFrame(result["rows"])
+    keys = result["params"]
+    varying = [k for k in keys if df[k].nunique() > 1]
+
+    st.markdown("#### 感度マトリクス")
+    metric = st.selectbox("指標", ["最大GAP", "月額(円)"] + [f"GAP:{a}" for a in tab2_gap.AXES], key="sweep_metric")
+    if metric not in df:
+        st.caption("（集計できるセルがありません。全セルの『エラー』を確認してください）")
+    elif len(varying) >= 2:
+        c1, c2 = st.columns(2)
+        with c1:
+            row_key = st.selectbox("行", varying, format_func=lambda k: PARAMS[k][0], key="sweep_row")
+        with c2:
+            col_key = st.selectbox("列", [k for k in varying if k != row_key],
+                                   format_func=lambda k: PARAMS[k][0], key="sweep_col")
+
+        # 行・列以外の可変パラメータは固定値を選ぶ
+        view = df
+        others = [k for k in varying if k not in (row_key, col_key)]
+        if others:
+            cols = st.columns(len(others))
+            for c, k in zip(cols, others):
+                with c:
+                    v = st.selectbox(PARAMS[k][0], sorted(df[k].unique()), key=f"sweep_fix_{k}")
+                view = view[view[k] == v]
+
+        mat = view.pivot_table(index=row_key, columns=col_key, values=metric, aggfunc="first")
+        mat.index.name, mat.columns.name = PARAMS[row_key][0], PARAMS[col_key][0]
+        if metric == "月額(円)":
+            mat = mat.map(lambda v: f"{v / 1e4:,.0f}万円" if pd.notna(v) else "-")
+        st.dataframe(mat, use_container_width=True)
+    elif varying:
+        k = varying[0]
+        st.dataframe(df.set_index(k)[[metric]].rename_axis(PARAMS[k][0]), use_container_width=True)
+
+    st.markdown("#### 全セル")
+    if "月額(円)" in df:
+        df["予算内"] = [(c <= b) if pd.notna(c) else None for c, b in zip(df["月額(円)"], df["budget_yen"])]
+    st.dataframe(df.rename(columns={k: PARAMS[k][0] for k in keys}), use_container_width=True, hide_index=True)
+
+# =========================
+# 5) エントリポイント
+# =========================
+def _apply_job(job):
+    set_session_result("sweep_result", job.result)
+    st.toast("スイープが完了しました。")
+
+def render_tab(client, model, tab1_json):
+    st.subheader("④ 感度分析（目的しきい値のスイープ）")
+
+    if not tab1_json:
+        st.info("まずは『① ユースケース定義』でセンサ構成を生成してください。")
+        return
+
+    st.markdown("#### スイープ範囲（カンマ区切り）")
+    cols = st.columns(len(PARAMS))
+    ranges, bad = {}, []
+    for c, (k, (label, default)) in zip(cols, PARAMS.items()):
+        with c:
+            text = st.text_input(label, value=default, key=f"sweep_range_{k}")
+        try:
+            ranges[k] = _parse_values(text)
+        except ValueError:
+            bad.append(label)
+        if not ranges.get(k):
+            bad.append(label)
+
+    template = st.text_area(
+        "目的テンプレート", value=GOAL_TEMPLATE, height=80,
+        help="{revisit_days} {gsd_m} {missing_pct} {budget_yen} がセルごとの値に置き換わります。",
+    )
+
+    grid = [] if bad else build_grid(ranges)
+    template_err = None
+    if bad:
+        st.error(f"数値として読めない範囲があります：{', '.join(dict.fromkeys(bad))}")
+    else:
+        calls = len(grid) * 2
+        eta = rate_limiter.eta_s(calls)
+        st.caption(
+            f"{len(grid)} セル（Tab2+Tab3 で最大 {calls} 回の呼び出し。キャッシュ済みセルは再利用）"
+            + (f"｜未キャッシュ時は共有レート制限（{rate_limiter.rpm:g}回/分・連続{rate_limiter.capacity:g}回）"
+               f"により最短でも約{eta:.0f}秒（CDP_LLM_RPM / CDP_LLM_BURST で調整）" if eta else "")
+        )
+        try:
+            example = _format_goal(template, grid[0])
+        except (KeyError, IndexError, ValueError) as e:
+            template_err = f"テンプレートの置換に失敗しました：{e}"
+            st.error(template_err)
+        else:
+            with st.expander("例：最初のセルの目的文", expanded=False):
+                st.write(example)
+
+    if st.button("スイープを実行", type="primary", use_container_width=True, disabled=bool(bad or template_err)):
+        if len(grid) > SWEEP_MAX_CELLS:
+            st.warning(f"セル数が上限（{SWEEP_MAX_CELLS}）を超えています。範囲を絞ってください。")
+        else:
+            uc = st.session_state.get("tab1_usecase")
+            submit_job("sweep", f"スイープ: {uc or '（UC不明）'} × {len(grid)}セル", run_sweep,
+                       client, model, tab1_json, grid, template, usecase=uc,
+                       use_cache=st.session_state.get("use_cache", True),
+                       aoi=st.session_state.get("tab1_aoi"),
+                       with_progress=True, meta={"usecase": uc})
+
+    render_jobs_panel("sweep", _apply_job)
+
+    sweep_result = get_session_result("sweep_result")
+    if sweep_result:
+        _render_matrix(sweep_result)
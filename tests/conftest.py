@@ -0,0 +1,17 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+# モジュールはリポジトリ直下のフラット構成
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 既定の実行履歴DB・書き出し先を一時ディレクトリへ（リポジトリの runs.db を汚さない）。各モジュールの import より前に設定する
+_TMP = tempfile.mkdtemp(prefix="cdp-tests-")
+os.environ.setdefault("CDP_RUN_DB", os.path.join(_TMP, "runs.db"))
+os.environ.setdefault("CDP_EXPORT_DIR", os.path.join(_TMP, "exports"))
+os.environ.setdefault("CDP_EVAL_DIR", os.path.join(_TMP, "eval_data"))
+os.environ.setdefault("CDP_WARMUP", "0")
+os.environ.setdefault("CDP_LLM_RPM", "0")   # 疑似応答ではレート制限不要
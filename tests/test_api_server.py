@@ -0,0 +1,146 @@
+# tests/test_api_server.py
+import asyncio
+import json
+
+import pytest
+
+import api_server
+from api_server import ApiError, content_length, parse_head
+from llm_stub import StubClient, stub_responses
+
+
+def test_parse_head():
+    method, target, version, headers = parse_head(
+        b"POST /v1/tab1?stream=1 HTTP/1.1\r\nHost: x\r\nContent-Type : application/json\r\nbroken\r\n\r\n")
+    assert (method, target, version) == ("POST", "/v1/tab1?stream=1", "HTTP/1.1")
+    assert headers == {"host": "x", "content-type": "application/json"}
+
+
+def test_parse_head_rejects_bad_request_line():
+    with pytest.raises(ApiError) as e:
+        parse_head(b"GARBAGE\r\n\r\n")
+    assert e.value.status == 400
+
+
+@pytest.mark.parametrize("headers, expected", [({}, 0), ({"content-length": "0"}, 0), ({"content-length": " 12 "}, 12)])
+def test_content_length(headers, expected):
+    assert content_length(headers) == expected
+
+
+@pytest.mark.parametrize("headers, status", [
+    ({"content-length": "abc"}, 400),
+    ({"content-length": "-5"}, 400),
+    ({"content-length": "1e3"}, 400),
+    ({"content-length": "²"}, 400),
+    ({"transfer-encoding": "chunked"}, 400),
+    ({"content-length": "11"}, 413),
+])
+def test_content_length_errors(headers, status):
+    with pytest.raises(ApiError) as e:
+        content_length(headers, limit=10)
+    assert e.value.status == status
+
+# =========================
+# 実ソケット越し（疑似応答クライアント）
+# =========================
+async def _call(port: int, raw: bytes) -> tuple:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    if b"transfer-encoding: chunked" in head.lower():
+        lines = [l for l in body.split(b"\r\n")[1::2] if l.strip()]
+        return status, [json.loads(l) for l in lines]
+    return status, json.loads(body) if body else None
+
+
+def _post(path: str, body, headers: str = "") -> bytes:
+    data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+    return (f"POST {path} HTTP/1.1\r\nHost: t\r\nConnection: close\r\n{headers}"
+            f"Content-Length: {len(data)}\r\n\r\n").encode("latin-1") + data
+
+
+def _run(client, requests: list, **kwargs) -> list:
+    async def main():
+        server, _ = await api_server.serve(client, "127.0.0.1", 0, **kwargs)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return [await _call(port, raw) for raw in requests]
+        finally:
+            server.close()
+            await server.wait_closed()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def stub():
+    return StubClient(stub_responses(), latency_s=0.001, jitter=0, malformed_rate=0, violation_rate=0, seed=0)
+
+
+def test_endpoints_and_error_codes(stub):
+    (s_ok, tab1), (s_pipe, pipe), (s_404, _), (s_405, _), (s_json, _), (s_req, _), (s_len, _), (s_health, health) = _run(
+        stub, [
+            _post("/v1/tab1", {"usecase": "テストUC", "background": "b", "use_cache": False}),
+            _post("/v1/pipeline", {"usecase": "テストUC", "goal": "3日以内に検知", "use_cache": False}),
+            _post("/v1/nope", {}),
+            b"GET /v1/tab1 HTTP/1.1\r\nConnection: close\r\n\r\n",
+            _post("/v1/tab1", b"{not json"),
+            _post("/v1/tab2", {"usecase": "テストUC"}),
+            b"POST /v1/tab1 HTTP/1.1\r\nContent-Length: abc\r\n\r\n",
+            b"GET /healthz HTTP/1.1\r\nConnection: close\r\n\r\n",
+        ])
+    assert s_ok == 200 and tab1["stage"] == "tab1" and tab1["data"]["sensor_suite"]
+    assert s_pipe == 200 and set(pipe["stages"]) == {"tab1", "tab2", "tab3"}
+    assert (s_404, s_405, s_json, s_req, s_len) == (404, 405, 400, 400, 400)
+    assert s_health == 200 and health["ok"] and health["served"] == 3
+
+
+def test_stream_events(stub):
+    [(status, events)] = _run(stub, [_post("/v1/pipeline?stream=1", {"usecase": "テストUC", "use_cache": False})])
+    assert status == 200
+    assert [e["event"] for e in events] == ["accepted", "result", "result", "result", "done"]
+    assert [e["stage"] for e in events if e["event"] == "result"] == ["tab1", "tab2", "tab3"]
+
+
+def test_auth_and_missing_client():
+    (s_auth, _), (s_ok, body) = _run(None, [
+        _post("/v1/tab1", {"usecase": "テストUC"}),
+        _post("/v1/tab1", {"usecase": "未キャッシュのUC", "use_cache": False}, "Authorization: Bearer secret\r\n"),
+    ], token="secret")
+    assert s_auth == 401
+    assert s_ok == 503 and "APIキー" in body["error"]
+
+
+class _DownClient:
+    """どの呼び出しも通信エラーになるクライアント"""
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        raise ConnectionError("upstream down")
+
+
+def test_upstream_errors_are_502(monkeypatch):
+    responses = stub_responses()
+    bodies = [
+        ("/v1/tab1", {"usecase": "テストUC", "use_cache": False}),
+        ("/v1/tab2", {"usecase": "テストUC", "tab1_output": responses["tab1"], "use_cache": False}),
+        ("/v1/tab3", {"usecase": "テストUC", "tab1_output": responses["tab1"], "tab2_output": responses["tab2"],
+                      "use_cache": False}),
+    ]
+    results = _run(_DownClient(), [_post(path, body) for path, body in bodies])
+    assert [status for status, _ in results] == [502, 502, 502]
+    assert all("upstream down" in body["error"] for _, body in results)
+
+    # 段の関数自体が例外を投げても 502 に揃える
+    def boom(*args, **kwargs):
+        raise RuntimeError("boom")
+    for mod in api_server.STAGES.values():
+        monkeypatch.setattr(mod, "_call_llm", boom)
+    results = _run(_DownClient(), [_post(path, body) for path, body in bodies])
+    assert [status for status, _ in results] == [502, 502, 502]
+    assert all(body["error"] == "RuntimeError: boom" for _, body in results)
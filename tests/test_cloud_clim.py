@@ -0,0 +1,88 @@
+# tests/test_cloud_clim.py
+import csv
+
+import pytest
+
+import cloud_clim
+from cloud_clim import CloudClimatology, estimate, missing_rate, parse_bbox, window_days_from_goal
+
+KANTO = (139.0, 35.2, 140.2, 36.2)
+SENSORS = [
+    {"name": "Sentinel-2", "bands": ["B4", "B8"], "revisit_days": 5},
+    {"name": "Landsat-9", "bands": ["OLI"], "revisit_days": 16},
+    {"name": "Sentinel-1", "bands": ["C-band SAR"], "revisit_days": 6},
+    {"name": "revisit不明", "revisit_days": "数日"},
+]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("139.0,35.2,140.2,36.2", KANTO),
+    ("139 35.2 140.2 36.2", KANTO),
+    ("139、35.2、140.2、36.2", KANTO),
+    ("170, -10, -170, 10", (170.0, -10.0, -170.0, 10.0)),   # 日付変更線をまたぐ
+])
+def test_parse_bbox(text, expected):
+    assert parse_bbox(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "139,35,140", "139,36,140,35", "200,0,210,10", "a,b,c,d"])
+def test_parse_bbox_rejects(text):
+    with pytest.raises(ValueError):
+        parse_bbox(text)
+
+
+def test_window_days_from_goal():
+    assert window_days_from_goal("3日以内に面的検知したい") == 3
+    assert window_days_from_goal("1.5 日以内") == 1.5
+    assert window_days_from_goal("なるべく早く", default=7) == 7
+
+
+def test_missing_rate():
+    assert missing_rate(0.6, 5, 5, autocorr=0) == pytest.approx(0.6)
+    assert missing_rate(0.6, 5, 10, autocorr=0) == pytest.approx(0.36)
+    assert missing_rate(0.6, 10, 5) == pytest.approx(1 - 0.5 * 0.4)     # 窓内に観測が無いこともある
+    assert missing_rate(0.6, 5, 10, autocorr=0.5) > missing_rate(0.6, 5, 10, autocorr=0)
+
+
+def test_estimate_with_bundled_grid_is_marked_reference_only():
+    facts = estimate(KANTO, SENSORS, window_days=3)
+    assert facts["reference_only"] is True
+    assert len(facts["cloud_pct_by_month"]) == 12
+    assert all(0 <= v <= 100 for v in facts["cloud_pct_by_month"])
+    rows = {r["name"]: r for r in facts["sensors"]}
+    assert set(rows) == {"Sentinel-2", "Landsat-9", "Sentinel-1"}
+    assert rows["Sentinel-1"]["optical"] is False and "missing_pct_annual" not in rows["Sentinel-1"]
+    # 光学2機の合算は単機より欠測が少ない
+    assert facts["optical_combined"]["missing_pct_annual"] < rows["Sentinel-2"]["missing_pct_annual"]
+
+
+def test_estimate_without_aoi_or_sensors():
+    assert estimate(None) is None
+    facts = estimate(KANTO)
+    assert "sensors" not in facts and "window_days" not in facts
+
+
+@pytest.fixture
+def measured_index(tmp_path, monkeypatch):
+    """10° 格子・AOI 周辺だけ雲量 40%（他は欠測）の実測扱いグリッド。"""
+    src = tmp_path / "cf.csv"
+    with open(src, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["month", "lat", "lon", "cloud_frac"])
+        for m in range(1, 13):
+            w.writerow([m, 35, 135, 40])
+    out = tmp_path / "cf.bin"
+    cloud_clim.build_from_csv(str(src), str(out), res=10, tile=4, source="test")
+    index = CloudClimatology(str(out))
+    monkeypatch.setattr(cloud_clim, "_index", index)
+    yield index
+    index.close()
+
+
+def test_estimate_with_measured_grid(measured_index):
+    assert not measured_index.synthetic and measured_index.source == "test"
+    facts = estimate(KANTO, SENSORS[:1], window_days=5)
+    assert "reference_only" not in facts
+    assert facts["cloud_pct_by_month"] == [40.0] * 12
+    assert facts["sensors"][0]["missing_pct_annual"] == pytest.approx(40.0)
+    assert estimate((-60, -10, -50, 0)) is None     # データの無い AOI
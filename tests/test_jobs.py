@@ -0,0 +1,98 @@
+# tests/test_jobs.py
+import threading
+
+import pytest
+
+import jobs
+import result_store
+from jobs import JobManager, QueueFull
+from result_store import ResultStore
+
+
+@pytest.fixture
+def store(monkeypatch):
+    s = ResultStore()
+    monkeypatch.setattr(result_store, "_store", s)
+    return s
+
+
+@pytest.fixture
+def gate():
+    """set() するまでジョブを止めておく。"""
+    ev = threading.Event()
+    yield ev
+    ev.set()
+
+
+def _blocked(gate, value=None):
+    gate.wait(5)
+    return value or {"ok": True}, None
+
+
+def _wait(job):
+    job.future.result(5)
+    return job
+
+
+def test_queue_limits_total_and_per_session(monkeypatch, store, gate):
+    monkeypatch.setattr(jobs, "MAX_PENDING", 3)
+    monkeypatch.setattr(jobs, "MAX_PER_SESSION", 2)
+    mgr = JobManager(max_workers=1)
+    mgr.submit("a", "tab1", "a1", _blocked, gate)
+    mgr.submit("a", "tab1", "a2", _blocked, gate)
+    with pytest.raises(QueueFull, match="このセッション"):
+        mgr.submit("a", "tab1", "a3", _blocked, gate)
+    mgr.submit("b", "tab1", "b1", _blocked, gate)
+    with pytest.raises(QueueFull, match="サーバ全体"):
+        mgr.submit("c", "tab1", "c1", _blocked, gate)
+    gate.set()
+    for j in mgr.for_session("a") + mgr.for_session("b"):
+        _wait(j)
+    mgr.submit("c", "tab1", "c1", _blocked, gate)   # 完了すれば枠が空く
+
+
+def test_cancel_only_queued_jobs(store, gate):
+    mgr = JobManager(max_workers=1)
+    running = mgr.submit("s", "tab1", "running", _blocked, gate)
+    queued = mgr.submit("s", "tab1", "queued", _blocked, gate)
+    assert mgr.cancel(queued.id)
+    assert queued.status == "cancelled"
+    assert not mgr.cancel(running.id)
+    gate.set()
+    assert _wait(running).status == "done"
+    assert queued.result is None and mgr.stats()["cancelled"] == 1
+
+
+def test_failures_set_error_and_message(store):
+    mgr = JobManager(max_workers=1)
+    returned = _wait(mgr.submit("s", "tab1", "err", lambda: (None, "Groq API呼び出し失敗: 429\n詳細")))
+    assert returned.status == "error" and returned.message == "Groq API呼び出し失敗: 429"
+
+    def boom():
+        raise ConnectionError("upstream down")
+    raised = _wait(mgr.submit("s", "tab1", "raise", boom))
+    assert raised.status == "error" and raised.message == "ConnectionError: upstream down"
+    assert store.stats()["entries"] == 0
+
+
+def test_gc_releases_results(monkeypatch, store):
+    mgr = JobManager(max_workers=1)
+    job = _wait(mgr.submit("s", "tab1", "done", lambda: ({"x": 1}, None)))
+    assert job.result == {"x": 1} and store.stats()["refs"] == 1
+    monkeypatch.setattr(jobs, "JOB_TTL_S", -1)   # 完了ジョブをすべて期限切れ扱い
+    with mgr._lock:
+        mgr._gc_locked()
+    assert mgr.get(job.id) is None
+    assert store.stats()["entries"] == 0
+
+
+def test_stage_limits_keep_workers_for_other_tabs(monkeypatch, store, gate):
+    monkeypatch.setitem(jobs.STAGE_LIMITS, "sweep", ("スイープ", 2, 1))
+    mgr = JobManager(max_workers=4)
+    mgr.submit("a", "sweep", "スイープ: a", _blocked, gate)
+    with pytest.raises(QueueFull, match="このセッション"):
+        mgr.submit("a", "sweep", "スイープ: a2", _blocked, gate)
+    mgr.submit("b", "sweep", "スイープ: b", _blocked, gate)
+    with pytest.raises(QueueFull, match="サーバ全体"):
+        mgr.submit("c", "sweep", "スイープ: c", _blocked, gate)
+    mgr.submit("a", "tab1", "Tab1", _blocked, gate)   # 他ステージは通常の上限だけ
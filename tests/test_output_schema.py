@@ -0,0 +1,50 @@
+# tests/test_output_schema.py
+import pytest
+
+import tab1_usecase
+import tab2_gap
+import tab3_plan
+from output_schema import example_instance, response_format, validate
+
+SCHEMA = {
+    "type": "object",
+    "required": ["name", "items"],
+    "properties": {
+        "name": {"type": "string"},
+        "level": {"type": "string", "enum": ["小", "中", "大"]},
+        "count": {"type": "integer"},
+        "items": {"type": "array", "minItems": 2, "items": {"type": "object", "required": ["id"]}},
+    },
+}
+
+
+def test_valid_instance_has_no_problems():
+    assert validate({"name": "a", "level": "中", "count": 3, "items": [{"id": 1}, {"id": 2}]}, SCHEMA) == []
+
+
+@pytest.mark.parametrize("data, fragment", [
+    ([], "型がobject"),
+    ({"items": [{"id": 1}, {"id": 2}]}, "$.name: 必須"),
+    ({"name": "", "items": [{"id": 1}, {"id": 2}]}, "$.name: 必須"),
+    ({"name": "a", "items": [{"id": 1}]}, "2件以上"),
+    ({"name": "a", "items": [{"id": 1}, {}]}, "$.items[1].id: 必須"),
+    ({"name": "a", "level": "特大", "items": [{"id": 1}, {"id": 2}]}, "$.level"),
+    ({"name": "a", "count": True, "items": [{"id": 1}, {"id": 2}]}, "$.count: 型がinteger"),
+])
+def test_violations_are_reported_with_path(data, fragment):
+    problems = validate(data, SCHEMA)
+    assert any(fragment in p for p in problems), problems
+
+
+@pytest.mark.parametrize("schema", [tab1_usecase.OUTPUT_SCHEMA, tab2_gap.OUTPUT_SCHEMA, tab3_plan.OUTPUT_SCHEMA])
+def test_stub_template_satisfies_tab_schema(schema):
+    # llm_stub の疑似応答はこのテンプレートから作るので、スキーマ合格であること
+    assert validate(example_instance(schema, fill_min_items=True), schema) == []
+
+
+def test_response_format_modes():
+    assert response_format(SCHEMA, "x", "off") is None
+    assert response_format(SCHEMA, "x", "json_object") == {"type": "json_object"}
+    fmt = response_format({**SCHEMA, "description": "d"}, "x", "json_schema")
+    assert fmt["json_schema"]["name"] == "x"
+    assert "description" not in fmt["json_schema"]["schema"]
@@ -0,0 +1,70 @@
+# tests/test_result_store.py
+import time
+
+import pytest
+
+import result_store
+from result_store import ResultStore
+
+DATA = {"sensor_suite": [{"name": "Sentinel-2", "bands": ["B4", "B8"]}], "note": "雲量 60%"}
+
+
+def test_put_is_content_addressed_and_refcounted():
+    s = ResultStore()
+    h = s.put(DATA)
+    assert s.put({"note": "雲量 60%", "sensor_suite": [{"bands": ["B4", "B8"], "name": "Sentinel-2"}]}) == h
+    assert s.stats()["entries"] == 1 and s.stats()["refs"] == 2
+    assert s.acquire(h) and s.stats()["refs"] == 3
+    s.release(h)
+    s.release(h)
+    assert s.get(h) == DATA
+    s.release(h)
+    assert s.get(h) is None and s.stats()["entries"] == 0
+    assert not s.acquire(h)
+    s.release(h)          # 解放済みでも例外にしない
+    s.release(None)
+    assert s.stats()["refs"] == 0
+
+
+def test_get_returns_independent_objects():
+    s = ResultStore()
+    h = s.put(DATA)
+    a = s.get(h)
+    a["note"] = "書き換え"
+    a["sensor_suite"][0]["bands"].append("B11")
+    assert s.get(h) == DATA
+    assert s.get(h) is not s.get(h)
+
+
+def test_decoded_lru_is_bounded():
+    s = ResultStore(decoded_max=2)
+    hs = [s.put({"i": i}) for i in range(4)]
+    for h in hs:
+        s.get(h)
+    assert s.stats()["decoded_entries"] == 2
+    assert [s.get(h) for h in hs] == [{"i": i} for i in range(4)]
+
+
+@pytest.fixture
+def shared_store(monkeypatch):
+    store = ResultStore()
+    monkeypatch.setattr(result_store, "_store", store)
+    monkeypatch.setattr(result_store, "_sessions", {})
+    return store
+
+
+def test_evict_idle_releases_only_idle_sessions(shared_store):
+    h_shared = shared_store.put(DATA)      # 2セッションで共有
+    shared_store.acquire(h_shared)
+    h_idle = shared_store.put({"only": "idle"})
+    now = time.time()
+    result_store._sessions.update({
+        "idle": {"refs": {"tab1_json": h_shared, "tab2_json": h_idle}, "last_seen": now - 3600},
+        "active": {"refs": {"tab1_json": h_shared}, "last_seen": now},
+    })
+
+    assert result_store.evict_idle(idle_s=1800) == 1
+    assert set(result_store._sessions) == {"active"}
+    assert shared_store.get(h_shared) == DATA       # まだ active が参照している
+    assert shared_store.get(h_idle) is None
+    assert shared_store.stats()["refs"] == 1
@@ -0,0 +1,68 @@
+# tests/test_run_store.py
+import pytest
+
+from run_store import RunStore, input_hash
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RunStore(str(tmp_path / "runs.db"))
+
+
+def _record(store, stage="tab3", payload=None, error=None, usecase="uc", model="m", created_at=1.0):
+    payload = payload or {"i": 0}
+    store.record({
+        "created_at": created_at, "stage": stage, "usecase": usecase, "model": model,
+        "input_hash": input_hash(stage, model, "P", payload), "payload_json": "{}", "raw": "{}",
+        "parsed_json": None if error else '{"ok": true}', "error": error,
+    })
+
+
+def _ids(store, **kw):
+    return [r["id"] for chunk in store.iter_runs(**kw) for r in chunk]
+
+
+def test_input_hash_depends_on_prompt_and_payload():
+    base = input_hash("tab1", "m", "P", {"a": 1, "b": 2})
+    assert base == input_hash("tab1", "m", "P", {"b": 2, "a": 1})
+    assert base != input_hash("tab1", "m", "P2", {"a": 1, "b": 2})
+    assert base != input_hash("tab1", "m", "P", {"a": 1, "b": 3})
+
+
+def test_iter_runs_filters_and_chunks(store):
+    for i in range(5):
+        _record(store, stage="tab1" if i % 2 else "tab3", payload={"i": i}, usecase=f"uc{i % 2}",
+                created_at=float(i))
+    _record(store, payload={"i": 9}, error="boom", created_at=9.0)
+    store.flush()
+
+    assert _ids(store) == [1, 2, 3, 4, 5]
+    assert _ids(store, ok_only=False) == [1, 2, 3, 4, 5, 6]
+    assert _ids(store, stage="tab1") == [2, 4]
+    assert _ids(store, usecase="uc0") == [1, 3, 5]
+    assert _ids(store, since=3.0) == [4, 5]
+    chunks = list(store.iter_runs(chunk_size=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert chunks[0][0]["parsed"] == {"ok": True} and "parsed_json" not in chunks[0][0]
+
+
+def test_latest_only_keeps_inputs_whose_newest_run_failed(store):
+    # 5入力が成功、そのうち1つは後から失敗した実行がある
+    for i in range(5):
+        _record(store, payload={"i": i}, created_at=float(i))
+    _record(store, payload={"i": 0}, created_at=10.0)               # 入力0の成功（新しい方）
+    _record(store, payload={"i": 1}, error="boom", created_at=11.0)  # 入力1の最新は失敗
+    store.flush()
+
+    assert _ids(store, latest_only=True) == [2, 3, 4, 5, 6]
+    assert _ids(store, latest_only=True, ok_only=False) == [3, 4, 5, 6, 7]
+
+
+def test_latest_by_hash(store):
+    _record(store, created_at=1.0)
+    _record(store, error="boom", created_at=2.0)
+    store.flush()
+    h = input_hash("tab3", "m", "P", {"i": 0})
+    assert store.latest_by_hash(h)["id"] == 1
+    assert store.latest_by_hash(h, ok_only=False)["id"] == 2
+    assert store.latest_by_hash("0" * 64) is None
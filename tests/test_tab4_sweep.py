@@ -0,0 +1,59 @@
+# tests/test_tab4_sweep.py
+import pytest
+
+import tab4_sweep
+from llm_stub import StubClient, stub_responses
+from tab4_sweep import build_grid, parse_yen, run_sweep
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1,200,000円", 1_200_000),
+    ("〜120万円/月", 1_200_000),
+    ("80〜120万円", 1_200_000),
+    ("約 80 〜 120 万円/月", 1_200_000),
+    ("¥800,000〜¥1,200,000", 1_200_000),
+    ("1.2億円", 120_000_000),
+    ("月額120万円（年間1,440万円）", 1_200_000),            # 年額・累計に引っ張られない
+    ("衛星3基・UAV 2機で 95万円/月（初年度累計 1,500万円）", 950_000),
+    ("120万", 1_200_000),                                   # 円が無ければ最初の数値
+    (500000, 500_000),
+])
+def test_parse_yen(text, expected):
+    assert parse_yen(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("text", [None, "", "未定"])
+def test_parse_yen_without_amount(text):
+    assert parse_yen(text) is None
+
+
+def test_parse_values_and_grid():
+    assert tab4_sweep._parse_values("3, 5 、7 5 1_000") == [3, 5, 7, 1000]
+    with pytest.raises(ValueError):
+        tab4_sweep._parse_values("3, x")
+    grid = build_grid({"revisit_days": [3, 5], "gsd_m": [10], "missing_pct": [20], "budget_yen": [1, 2]})
+    assert len(grid) == 4 and grid[0] == {"revisit_days": 3, "gsd_m": 10, "missing_pct": 20, "budget_yen": 1}
+
+
+@pytest.fixture
+def stub():
+    return StubClient(stub_responses(), latency_s=0.001, jitter=0, malformed_rate=0, violation_rate=0, seed=0)
+
+
+GRID = build_grid({"revisit_days": [3, 5], "gsd_m": [10], "missing_pct": [20], "budget_yen": [500000]})
+
+
+def test_run_sweep_summarizes_every_cell(stub):
+    result, err = run_sweep(stub, "m", stub_responses()["tab1"], GRID, tab4_sweep.GOAL_TEMPLATE, use_cache=False)
+    assert err is None
+    assert [r["revisit_days"] for r in result["rows"]] == [3, 5]
+    assert all(r["エラー"] == "" and "最大GAP" in r for r in result["rows"])
+
+
+def test_run_sweep_keeps_cell_errors_in_rows(stub):
+    progress = []
+    result, err = run_sweep(stub, "m", stub_responses()["tab1"], GRID, "{unknown} {revisit_days}",
+                            use_cache=False, progress=lambda p, m: progress.append(p))
+    assert err is None
+    assert all("KeyError" in r["エラー"] for r in result["rows"])
+    assert progress[-1] == 1.0
@@ -0,0 +1,71 @@
+# tests/test_warmup.py
+from types import SimpleNamespace
+
+import tab1_usecase
+import warmup
+from llm_stub import StubClient, stub_responses
+from uc_seed import UC_DATA
+
+N_SEEDS = len(UC_DATA)
+
+
+def _stub(**kw):
+    return StubClient(stub_responses(), **{"latency_s": 0.0, "jitter": 0, "malformed_rate": 0,
+                                           "violation_rate": 0, "seed": 0, **kw})
+
+
+class _Flaky:
+    """最初の fail 回だけ ConnectionError を投げる（429・タイムアウトの代わり）。"""
+
+    def __init__(self, client, fail: int = 1):
+        self._client = client
+        self.fail = fail
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        if self.fail > 0:
+            self.fail -= 1
+            raise ConnectionError("upstream timeout")
+        return self._client.chat.completions.create(**kwargs)
+
+
+def test_full_pass_then_cached_seeds_cost_nothing():
+    stats = warmup.warm_seed_catalog(_stub(), "warm-cache", token_budget=10**7, refresh=True)
+    assert stats["done"] == 3 * N_SEEDS and stats["errors"] == 0 and stats["skipped"] == 0
+
+    again = _stub()
+    stats = warmup.warm_seed_catalog(again, "warm-cache", token_budget=10**7)
+    assert again.calls == 0 and stats["tokens"] == 0 and stats["done"] == 3 * N_SEEDS
+
+
+def test_budget_stops_retries_mid_call():
+    # 1呼び出しあたりの消費量を測り、予算を「1.5回分」にする → 初回は通り、再試行の前で止まる
+    uc, seed = next(iter(UC_DATA.items()))
+    payload = tab1_usecase.build_payload(uc, seed["background"], seed["question"], seed["issues"], aoi=seed.get("aoi"))
+    probe = warmup._BudgetedClient(_stub(violation_rate=1.0), 1)   # 予算1 → 初回だけ呼んで止まる
+    tab1_usecase._call_llm(probe, "warm-probe", payload, use_cache=False)
+    assert probe.calls == 1 and probe.exhausted
+    budget = int(probe.spent * 1.5)
+
+    client = _stub(violation_rate=1.0)   # 毎回スキーマ違反 → complete_json が再試行する
+    stats = warmup.warm_seed_catalog(client, "warm-budget", token_budget=budget, refresh=True)
+    assert client.calls == 1
+    assert stats["done"] == 0 and stats["errors"] == 0
+    assert stats["skipped"] == N_SEEDS      # 再試行中に止まった1件も予算切れとしてスキップ扱い
+    assert stats["tokens"] <= budget
+
+
+def test_error_on_one_seed_does_not_stop_the_pass():
+    client = _Flaky(_stub(), fail=1)
+    stats = warmup.warm_seed_catalog(client, "warm-flaky", token_budget=10**7, refresh=True)
+    assert stats["errors"] == 1
+    assert "upstream timeout" in stats["last_error"]
+    assert stats["done"] == 3 * N_SEEDS - 3     # 失敗したシードは Tab2/Tab3 も作れない
+
+
+def test_raising_stage_is_counted_as_error(monkeypatch):
+    def boom(*args, **kwargs):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(tab1_usecase, "_call_llm", boom)
+    stats = warmup.warm_seed_catalog(_stub(), "warm-raise", token_budget=10**7, refresh=True)
+    assert stats["errors"] == N_SEEDS and stats["last_error"].endswith("RuntimeError: boom")
@@ -3,6 +3,7 @@
 
 UC_DATA = {
     "洪水・浸水リスク評価": {
+        "aoi": (139.0, 35.2, 140.2, 36.2),    # 既定AOI（西端経度, 南端緯度, 東端経度, 北端緯度）：首都圏
         "background": (
             "豪雨や台風による水害が全国的に増加。保険会社としての支払いリスクが上昇。"
             "過去被災地の評価は進む一方、土砂災害や内水氾濫の即時把握が不十分。"
@@ -17,6 +18,7 @@ UC_DATA = {
         ),
     },
     "農業保険（干ばつ・冷害）": {
+        "aoi": (142.5, 42.5, 143.8, 43.4),    # 十勝平野
         "background": (
             "気候変動が顕在化。干ばつや冷害で作柄が悪化し、農業生産の変動が拡大。"
             "農業者支援や農業保険の精緻化が求められている。"
@@ -31,6 +33,7 @@ UC_DATA = {
         ),
     },
     "森林火災モニタリング": {
+        "aoi": (-123.5, 37.0, -120.0, 41.0),  # カリフォルニア北部
         "background": (
             "乾燥化で火災リスクが上昇。広域火災が頻発し再保険の大口支払いも増加。"
         ),
@@ -44,6 +47,7 @@ UC_DATA = {
         ),
     },
     "地盤・地盤沈下（InSAR評価）": {
+        "aoi": (139.6, 35.4, 140.1, 35.8),    # 東京湾岸
         "background": (
             "地震や地盤改変に伴う沈下・変状が広域で発生。"
             "インフラ・建物の損傷評価、補償に即時性が求められる。"
@@ -58,6 +62,7 @@ UC_DATA = {
         ),
     },
     "海上保険（AIS異常/航跡リスク）": {
+        "aoi": (98.0, 1.0, 104.5, 6.5),       # マラッカ海峡
         "background": (
             "海事事故や海賊行為、違法操業のリスクが増大。"
             "保険金支払いの増加や引受判断の難度が上昇。"
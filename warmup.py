@@ -0,0 +1,176 @@
+# warmup.py
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import tab1_usecase
+import tab2_gap
+import tab3_plan
+from uc_seed import UC_DATA
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# 0) 設定
+# =========================
+WARMUP_ENABLED = os.environ.get("CDP_WARMUP", "1") == "1"
+WARMUP_MODELS = [m.strip() for m in os.environ.get("CDP_WARMUP_MODELS", "llama-3.1-8b-instant").split(",") if m.strip()]
+WARMUP_TOKEN_BUDGET = int(os.environ.get("CDP_WARMUP_TOKEN_BUDGET", "120000"))   # 1パスあたりの上限
+WARMUP_REFRESH_HOURS = float(os.environ.get("CDP_WARMUP_REFRESH_HOURS", "24"))   # 0 なら再計算しない
+WARMUP_START_DELAY_S = float(os.environ.get("CDP_WARMUP_START_DELAY_S", "5"))    # 初回描画を優先
+WARMUP_RETRY_S = float(os.environ.get("CDP_WARMUP_RETRY_S", "300"))              # 失敗があったパスの再試行待ち（倍々で最大1時間）
+
+# =========================
+# 1) トークン計上つきクライアント
+# =========================
+class BudgetExhausted(Exception):
+    """トークン予算を使い切った（complete_json 内の再試行もここで止まる）。"""
+
+
+class _BudgetedClient:
+    """usage を合算し、予算を使い切ったら以降の呼び出しを止めるためのラッパ。"""
+
+    def __init__(self, client, budget: int):
+        self._client = client
+        self.budget = budget
+        self.spent = 0
+        self.calls = 0
+        self.exhausted = False
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        # 段の前だけでなく1回ごとに確認する（再試行で予算を超えないように）
+        if not self.can_afford():
+            self.exhausted = True
+            raise BudgetExhausted(f"トークン予算 {self.budget:,} を使い切りました（{self.spent:,} 使用）")
+        if hasattr(self._client, "chat_completions"):
+            resp = self._client.chat_completions.create(**kwargs)
+        else:
+            resp = self._client.chat.completions.create(**kwargs)
+        usage = getattr(resp, "usage", None)
+        self.spent += (getattr(usage, "prompt_tokens", 0) or 0) + (getattr(usage, "completion_tokens", 0) or 0)
+        self.calls += 1
+        return resp
+
+    def can_afford(self) -> bool:
+        # 1呼び出しの平均消費を見込んで、予算超過しそうなら止める
+        per_call = self.spent / self.calls if self.calls else 0
+        return self.spent + per_call <= self.budget
+
+# =========================
+# 2) シードカタログの事前計算
+# =========================
+_status = {"state": "disabled" if not WARMUP_ENABLED else "idle", "done": 0, "skipped": 0,
+           "errors": 0, "tokens": 0, "last_run": None, "next_run": None, "last_error": None}
+
+def status() -> dict:
+    return dict(_status)
+
+def warm_seed_catalog(client, model: str, token_budget: int = WARMUP_TOKEN_BUDGET, refresh: bool = False) -> dict:
+    """
+    UC_DATA の全ユースケースについて、既定入力（シード文・既定AOI・PURPOSE_HYPOTHESIS）で
+    Tab1→Tab2→Tab3 を計算し応答キャッシュへ載せる。画面のボタンと同じペイロードを作るのでそのままヒットする。
+    refresh=False なら既存キャッシュ/履歴を優先（トークン消費なし）、True なら再生成して差し替える。
+    段階ごと（全Tab1 → 全Tab2 → 全Tab3）に進め、予算切れなら以降はスキップ。
+    1件の失敗（429・タイムアウト等）は errors / last_error に数えて次のシードへ進む。
+    """
+    bc = _BudgetedClient(client, token_budget)
+    stats = {"done": 0, "skipped": 0, "errors": 0, "last_error": None}
+    use_cache = not refresh
+
+    def step(call, payload, usecase):
+        if not bc.can_afford():
+            stats["skipped"] += 1
+            return None
+        try:
+            data, err = call(bc, model, payload, usecase=usecase, use_cache=use_cache)
+        except BudgetExhausted:
+            data, err = None, "budget"
+        except Exception as e:
+            data, err = None, f"{type(e).__name__}: {e}"
+        if err and bc.exhausted:
+            stats["skipped"] += 1   # 途中（再試行中）で予算切れ
+        elif err:
+            stats["errors"] += 1
+            stats["last_error"] = f"{usecase}: {err.splitlines()[0][:200]}"
+            logger.warning("シード事前計算に失敗しました（%s / %s）: %s", model, usecase, err.splitlines()[0])
+        else:
+            stats["done"] += 1
+        return data
+
+    tab1 = {}
+    for uc, seed in UC_DATA.items():
+        payload = tab1_usecase.build_payload(uc, seed["background"], seed["question"], seed["issues"],
+                                             aoi=seed.get("aoi"))
+        tab1[uc] = step(tab1_usecase._call_llm, payload, uc)
+    tab2 = {}
+    for uc, t1 in tab1.items():
+        if t1:
+            payload = tab2_gap.build_payload(t1, tab2_gap.PURPOSE_HYPOTHESIS, aoi=UC_DATA[uc].get("aoi"))
+            tab2[uc] = step(tab2_gap._call_llm, payload, uc)
+    for uc, t2 in tab2.items():
+        if t2:
+            step(tab3_plan._call_llm, tab3_plan.build_payload(tab1[uc], t2), uc)
+
+    stats["tokens"] = bc.spent
+    return stats
+
+# =========================
+# 3) バックグラウンド起動（プロセスで1回だけ）
+# =========================
+_started = False
+_start_lock = threading.Lock()
+
+def _loop(client, models):
+    time.sleep(WARMUP_START_DELAY_S)
+    refresh = False
+    retries = 0
+    while True:
+        _status.update(state="running", done=0, skipped=0, errors=0, tokens=0, last_error=None)
+        for model in models:
+            try:
+                s = warm_seed_catalog(client, model, refresh=refresh)
+            except Exception as e:
+                logger.warning("シード事前計算に失敗しました（%s）: %s", model, e)
+                _status["errors"] += 1
+                _status["last_error"] = f"{model}: {e}"
+                continue
+            for k in ("done", "skipped", "errors", "tokens"):
+                _status[k] += s[k]
+            if s["last_error"]:
+                _status["last_error"] = f"{model}: {s['last_error']}"
+        _status["last_run"] = time.time()
+        if _status["errors"]:
+            # 失敗したシードだけ短い間隔で取り直す（成功分はキャッシュに当たるのでトークンを使わない）
+            delay = min(WARMUP_RETRY_S * 2 ** retries, 3600)
+            retries += 1
+            refresh = False
+        elif WARMUP_REFRESH_HOURS <= 0:
+            _status.update(state="idle", next_run=None)
+            return
+        else:
+            delay = WARMUP_REFRESH_HOURS * 3600
+            retries = 0
+            refresh = True  # 2回目以降は定期再生成
+        _status.update(state="idle", next_run=time.time() + delay)
+        time.sleep(delay)
+
+def start_background(api_key: str, models=None) -> bool:
+    """
+    サーバ側のAPIキー（Secrets/環境変数）がある場合だけ、デーモンスレッドでウォームアップを始める。
+    即時リターンするので最初の描画は待たせない。
+    """
+    global _started
+    if not WARMUP_ENABLED or not api_key or _started:
+        return False
+    with _start_lock:
+        if _started:
+            return False
+        from openai import OpenAI
+        client = OpenAI(base_url="https://api.groq.com/openai/v1", api_key=api_key)
+        threading.Thread(target=_loop, args=(client, models or WARMUP_MODELS),
+                         name="cache-warmup", daemon=True).start()
+        _started = True
+    return True